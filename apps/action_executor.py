@@ -0,0 +1,382 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+    wait,
+)
+from dataclasses import dataclass
+from typing import Optional
+from structured_log import get_log
+
+
+@dataclass(slots=True)
+class ActionOutcome:
+    """The result of one dispatched service call or state write."""
+
+    method: str
+    entity_id: str
+    succeeded: bool
+    attempts: int
+    duration: float
+    error: Optional[str] = None
+
+
+def _target(call):
+    """Returns the entity or entities a recorded call acts on, as a string."""
+    method, args, kwargs = call
+    if method == "call_service":
+        entity_ids = kwargs.get("entity_id", [])
+        return entity_ids if isinstance(entity_ids, str) else ", ".join(entity_ids)
+    return args[0]
+
+
+def _entities(call):
+    """Returns the entities a recorded call acts on, as a list."""
+    method, args, kwargs = call
+    if method == "call_service":
+        entity_ids = kwargs.get("entity_id", [])
+        return [entity_ids] if isinstance(entity_ids, str) else list(entity_ids)
+    return [args[0]]
+
+
+def _start_call(function, args, kwargs):
+    """
+    Runs a call on a thread of its own and returns its future, so a hung call never
+    holds a shared worker.
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(function(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="action-call", daemon=True).start()
+    return future
+
+
+def _group_by_device(calls):
+    """Groups recorded calls by their target, keeping the order of calls per target."""
+    devices = {}
+    for call in calls:
+        devices.setdefault(_target(call), []).append(call)
+    return devices
+
+
+class ActionExecutor:
+    """
+    Dispatches recorded actions in the background, so a slow or hung device does not
+    block the control loop.
+
+    Actions are grouped by device. Devices are dispatched concurrently on a bounded
+    worker pool, while the actions of one device run in order. A merged call to several
+    entities runs in order with the calls to each of them. Each call gets a timeout, and
+    a failed call is retried with exponential backoff. A call that timed out is not
+    retried, since it may still take effect, and no further call is sent to its entities
+    until it has returned. If a device is still busy when new actions for it arrive,
+    only the newest actions are kept. The outcome of every action is logged on failure
+    and kept in `outcomes`, and an optional callback given with the actions is called
+    for each call that succeeded.
+    """
+
+    def __init__(
+        self,
+        app,
+        max_workers=4,
+        timeout_seconds=10.0,
+        retries=2,
+        backoff_seconds=1.0,
+        sleep=time.sleep,
+    ):
+        """
+        Initializes the executor.
+        Args:
+            app: The AppDaemon app instance the calls are sent to.
+            max_workers: The maximum number of devices dispatched at the same time.
+            timeout_seconds: The time after which a single call is considered failed.
+            retries: The number of retries of a failed call.
+            backoff_seconds: The delay before the first retry. It doubles with every
+                further retry.
+            sleep: The function used to wait between retries.
+        """
+        self.app = app
+        self.log = get_log(app)
+        self.timeout_seconds = timeout_seconds
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.sleep = sleep
+        self.outcomes = deque(maxlen=100)
+        self.succeeded = 0
+        self.failed = 0
+        self.superseded = 0
+        # Device chains wait on their calls. The calls run on threads of their own, so
+        # hung calls cannot starve other devices.
+        self._devices = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="action-device"
+        )
+        self._lock = threading.Lock()
+        self._running = {}
+        # Calls waiting for a running chain, by chain and target
+        self._queued = {}
+        # The chain each entity with running or queued calls belongs to
+        self._owners = {}
+        # Futures or tasks of timed-out calls that are still running, by entity
+        self._hung = {}
+
+    def submit(self, calls, on_success=None):
+        """
+        Queues recorded calls for dispatch and returns immediately.
+        Args:
+            calls: A list of (method, args, kwargs) tuples, e.g. from an ActionRecorder.
+            on_success: An optional callable called with (method, args, kwargs) after
+                each call that succeeded.
+        """
+        with self._lock:
+            for target, device_calls in _group_by_device(calls).items():
+                self._enqueue(target, [(call, on_success) for call in device_calls])
+
+    def _enqueue(self, target, calls):
+        """
+        Starts a device chain for the calls of one target, or queues them on the chain
+        that already owns one of their entities, so that all calls to an entity run in
+        order, whether they are merged or not. The calls are (call, on_success) pairs.
+        The lock must be held.
+        """
+        entities = _entities(calls[0][0])
+        chains = {
+            self._owners[entity_id]
+            for entity_id in entities
+            if entity_id in self._owners
+        }
+        if len(chains) > 1:
+            # The entities of a merged call are busy on different chains, so it is split
+            # into one call per entity
+            for entity_id in entities:
+                self._enqueue(
+                    entity_id,
+                    [
+                        ((method, args, {**kwargs, "entity_id": entity_id}), on_success)
+                        for (method, args, kwargs), on_success in calls
+                    ],
+                )
+            return
+        if not chains:
+            self._owners.update(dict.fromkeys(entities, target))
+            self._running[target] = self._devices.submit(
+                self._run_device, target, calls
+            )
+            return
+        chain = chains.pop()
+        self._owners.update(dict.fromkeys(entities, chain))
+        queued = self._queued.setdefault(chain, {})
+        if target in queued:
+            self.superseded += len(queued.pop(target))
+        # Reinserted at the end, so the newest actions also run last
+        queued[target] = calls
+
+    def _run_device(self, chain, calls):
+        """
+        Runs the calls of one device chain, followed by any calls queued on it in the
+        meantime.
+        """
+        try:
+            while True:
+                for call, on_success in calls:
+                    self._run_call(_target(call), *call, on_success=on_success)
+                with self._lock:
+                    queued = self._queued.pop(chain, None)
+                    if queued is None:
+                        return
+                calls = [
+                    call for target_calls in queued.values() for call in target_calls
+                ]
+        finally:
+            # Also after an unexpected error, so that the entities of the chain accept
+            # new calls
+            with self._lock:
+                self._queued.pop(chain, None)
+                del self._running[chain]
+                self._owners = {
+                    entity_id: owner
+                    for entity_id, owner in self._owners.items()
+                    if owner != chain
+                }
+
+    def _run_call(self, target, method, args, kwargs, on_success=None):
+        """Runs one call with a timeout and retries."""
+        start = time.monotonic()
+        entities = _entities((method, args, kwargs))
+        attempt = 0
+        error = self._still_running(entities)
+        if error is None:
+            for attempt in range(1, self.retries + 2):
+                if attempt > 1:
+                    self.sleep(self.backoff_seconds * 2 ** (attempt - 2))
+                future = _start_call(getattr(self.app, method), args, kwargs)
+                try:
+                    future.result(timeout=self.timeout_seconds)
+                    error = None
+                    break
+                except FutureTimeoutError:
+                    error = f"timed out after {self.timeout_seconds} s"
+                    # The call keeps running on its thread and may still take effect, so
+                    # it is not retried
+                    if not future.cancel():
+                        with self._lock:
+                            for entity_id in entities:
+                                self._hung[entity_id] = future
+                    break
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+        self._report(
+            ActionOutcome(
+                method, target, error is None, attempt, time.monotonic() - start, error
+            )
+        )
+        if error is None and on_success is not None:
+            self._call_on_success(on_success, method, target, args, kwargs)
+
+    def _call_on_success(self, on_success, method, target, args, kwargs):
+        """
+        Calls the success callback of a call. A failing callback is logged and does not
+        affect other calls.
+        """
+        try:
+            on_success(method, args, kwargs)
+        except Exception as e:
+            self.log.error(
+                "action_callback_failed", method=method, entity=target, error=repr(e)
+            )
+
+    def _still_running(self, entities):
+        """
+        Returns an error if an earlier timed-out call to one of the entities has not
+        returned yet, otherwise None. The call is a future or, when dispatched on the
+        event loop, a task.
+        """
+        with self._lock:
+            for entity_id in entities:
+                future = self._hung.get(entity_id)
+                if future is None:
+                    continue
+                if not future.done():
+                    return f"an earlier call to {entity_id} is still running"
+                del self._hung[entity_id]
+        return None
+
+    async def dispatch_async(self, calls, on_success=None):
+        """
+        Dispatches recorded calls on the event loop and waits for all of them.
+        The app methods must return awaitables, as they do in async AppDaemon callbacks.
+        Args:
+            calls: A list of (method, args, kwargs) tuples, e.g. from an ActionRecorder.
+            on_success: An optional callable called with (method, args, kwargs) after
+                each call that succeeded.
+        """
+        await asyncio.gather(
+            *(
+                self._run_device_async(target, device_calls, on_success)
+                for target, device_calls in _group_by_device(calls).items()
+            )
+        )
+
+    async def _run_device_async(self, target, calls, on_success=None):
+        """
+        Runs the calls of one device on the event loop, with the same timeout and retry
+        rules as `_run_call`.
+        """
+        for method, args, kwargs in calls:
+            start = time.monotonic()
+            entities = _entities((method, args, kwargs))
+            attempt = 0
+            error = self._still_running(entities)
+            if error is None:
+                for attempt in range(1, self.retries + 2):
+                    if attempt > 1:
+                        await asyncio.sleep(self.backoff_seconds * 2 ** (attempt - 2))
+                    try:
+                        task = asyncio.ensure_future(
+                            getattr(self.app, method)(*args, **kwargs)
+                        )
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                        continue
+                    done, _ = await asyncio.wait({task}, timeout=self.timeout_seconds)
+                    if not done:
+                        error = f"timed out after {self.timeout_seconds} s"
+                        # The call keeps running and may still take effect, so it is
+                        # not retried
+                        with self._lock:
+                            for entity_id in entities:
+                                self._hung[entity_id] = task
+                        break
+                    exception = task.exception()
+                    if exception is None:
+                        error = None
+                        break
+                    error = str(exception) or type(exception).__name__
+            self._report(
+                ActionOutcome(
+                    method,
+                    target,
+                    error is None,
+                    attempt,
+                    time.monotonic() - start,
+                    error,
+                )
+            )
+            if error is None and on_success is not None:
+                self._call_on_success(on_success, method, target, args, kwargs)
+
+    def _report(self, outcome):
+        """Records an outcome and logs failed or retried calls."""
+        self.outcomes.append(outcome)
+        if outcome.succeeded:
+            self.succeeded += 1
+            if outcome.attempts > 1:
+                self.log.info(
+                    "action_retried",
+                    method=outcome.method,
+                    entity=outcome.entity_id,
+                    attempts=outcome.attempts,
+                )
+        else:
+            self.failed += 1
+            self.log.error(
+                "action_failed",
+                method=outcome.method,
+                entity=outcome.entity_id,
+                attempts=outcome.attempts,
+                error=outcome.error,
+            )
+
+    def wait(self, timeout=None) -> bool:
+        """
+        Waits until all queued actions are dispatched.
+        Args:
+            timeout: The maximum number of seconds to wait, or None to wait
+                indefinitely.
+        Returns:
+            True if no actions are pending anymore.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                futures = list(self._running.values())
+            if not futures:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            wait(futures, timeout=remaining)
+
+    def shutdown(self):
+        """Stops the worker pool without waiting for hung calls."""
+        self._devices.shutdown(wait=False, cancel_futures=True)
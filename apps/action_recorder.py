@@ -0,0 +1,78 @@
+# Recorded methods that map onto a Home Assistant service of the entity's domain
+BATCHABLE_METHODS = ("turn_on", "turn_off")
+
+
+class ActionRecorder:
+    """
+    Stands in for the app and records service calls and state writes instead of sending
+    them.
+    """
+
+    def __init__(self, app):
+        """
+        Initializes the recorder.
+        Args:
+            app: The AppDaemon app instance. Reads and logging are passed through to it.
+        """
+        self.app = app
+        self.args = app.args
+        self.calls = []
+
+    def get_state(self, *args, **kwargs):
+        return self.app.get_state(*args, **kwargs)
+
+    def log(self, *args, **kwargs):
+        self.app.log(*args, **kwargs)
+
+    def error(self, *args, **kwargs):
+        self.app.error(*args, **kwargs)
+
+    def turn_on(self, entity_id, **kwargs):
+        self.calls.append(("turn_on", (entity_id,), kwargs))
+
+    def turn_off(self, entity_id, **kwargs):
+        self.calls.append(("turn_off", (entity_id,), kwargs))
+
+    def set_state(self, entity_id, **kwargs):
+        self.calls.append(("set_state", (entity_id,), kwargs))
+
+    def batched_calls(self):
+        """
+        Returns the recorded calls with switch actions that share a service merged into
+        one call.
+
+        `turn_on` and `turn_off` calls without extra arguments are grouped by the entity
+        domain. Groups of more than one entity become a single `call_service` call with
+        a list of `entity_id` values, placed where the first call of the group was. All
+        other calls are returned unchanged.
+        """
+        groups = {}
+        for call in self.calls:
+            method, args, kwargs = call
+            if method in BATCHABLE_METHODS and not kwargs:
+                groups.setdefault(f"{args[0].split('.', 1)[0]}/{method}", []).append(
+                    call
+                )
+
+        batched = []
+        merged = set()
+        for call in self.calls:
+            method, args, kwargs = call
+            service = (
+                f"{args[0].split('.', 1)[0]}/{method}"
+                if method in BATCHABLE_METHODS and not kwargs
+                else None
+            )
+            group = groups.get(service)
+            if group is None or len(group) == 1:
+                batched.append(call)
+            elif service not in merged:
+                merged.add(service)
+                batched.append(
+                    (
+                        "call_service",
+                        (service,),
+                        {"entity_id": [grouped[1][0] for grouped in group]},
+                    )
+                )
+        return batched
@@ -0,0 +1,139 @@
+import asyncio
+from energy_controller import EnergyController
+from system_state import SystemState
+from state_cache import StateCache, value_from_full_state
+from action_recorder import ActionRecorder
+
+
+class _SnapshotReader:
+    """
+    Answers cache misses from the gathered snapshot so no blocking read happens on the
+    event loop.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get_state(self, entity_id, attribute=None):
+        full_state = self.snapshot.get(entity_id)
+        if full_state is None:
+            return None
+        return value_from_full_state(full_state, attribute)
+
+
+class AsyncEnergyController(EnergyController):
+    """
+    A variant of EnergyController that runs its I/O on AppDaemon's event loop.
+
+    All entity reads of a cycle are gathered concurrently and all service calls are
+    dispatched concurrently by the action executor, with the same timeouts and retries
+    as in the synchronous controller, so the wall time of a loop depends on the slowest
+    call rather than the sum of all calls. The handlers and SystemState logic are the
+    same as in the synchronous controller.
+    """
+
+    def control_loop(self, kwargs):
+        """Schedules one control cycle on AppDaemon's event loop."""
+        self.run_in(self.async_control_loop, 0)
+
+    def _entities_to_read(self):
+        """
+        Returns all entities read during one cycle, including the input entities of the
+        handlers, e.g. forecasts.
+        """
+        config = self.controller_config
+        entity_ids = list(config.snapshot_entities)
+        for handler in self.device_handlers:
+            for entity_id in handler.input_entities:
+                if entity_id not in entity_ids:
+                    entity_ids.append(entity_id)
+        for entity_id in config.actuator_entities:
+            if entity_id not in entity_ids:
+                entity_ids.append(entity_id)
+        return entity_ids
+
+    async def _gather_snapshot(self):
+        """Reads all entities of a cycle concurrently and returns them as a snapshot."""
+        entity_ids = self._entities_to_read()
+        full_states = await asyncio.gather(
+            *(
+                self.get_state(entity_id, attribute="all", copy=False)
+                for entity_id in entity_ids
+            )
+        )
+        return {
+            entity_id: full_state
+            for entity_id, full_state in zip(entity_ids, full_states)
+            if full_state is not None
+        }
+
+    async def async_control_loop(self, kwargs):
+        """
+        The main control loop, running on the event loop. Overlapping runs are coalesced
+        like in the synchronous controller.
+        """
+        if not self.loop_guard.try_enter():
+            self.structured_log.info(
+                "loop_skipped",
+                interval_seconds=round(self.loop_guard.effective_interval),
+            )
+            return
+        overruns = self.loop_guard.overruns
+        try:
+            await self._async_control_cycle()
+        finally:
+            follow_up = self.loop_guard.exit()
+            if self.loop_guard.overruns > overruns:
+                self.structured_log.warning(
+                    "loop_overrun",
+                    budget_seconds=self.loop_guard.budget_seconds,
+                    interval_seconds=round(self.loop_guard.effective_interval),
+                )
+            if follow_up:
+                self.run_in(
+                    self.async_control_loop, self.loop_guard.seconds_until_due()
+                )
+
+    async def _async_control_cycle(self):
+        """Runs one control cycle."""
+        self.structured_log.debug("loop_started")
+        snapshot = await self._gather_snapshot()
+        cache = StateCache(_SnapshotReader(snapshot))
+        cache.prime(snapshot)
+        state = SystemState.from_snapshot(self, snapshot, config=self.controller_config)
+
+        if state is None:
+            self.structured_log.warning(
+                "loop_aborted", reason="system state unavailable"
+            )
+            running_entity = self.publish_plan.running_entity
+            await self.set_state(running_entity, state="off")
+            self.publish_filter.mark_published(running_entity, "off")
+            return
+
+        if self.signal_stats is not None:
+            self.signal_stats.update(state, self._monotonic())
+        self.handler_scheduler.run(state, cache)
+
+        recorder = ActionRecorder(self)
+        state.publish_to_ha(
+            recorder,
+            self.controller_config.publish_entities,
+            self.publish_filter,
+            self.publish_plan,
+        )
+        state.execute_actions(
+            recorder,
+            cache,
+            self.write_ledger,
+            self.controller_config,
+            record_writes=False,
+        )
+        calls = recorder.batched_calls()
+        if self.cycle_log:
+            self._append_cycle(state)
+        await self.action_executor.dispatch_async(calls, on_success=self._record_write)
+
+        self.structured_log.debug(
+            "loop_finished", entities=len(snapshot), calls=len(calls)
+        )
@@ -1,42 +1,60 @@
 import appdaemon.plugins.hass.hassapi as hass
 from system_state import SystemState
+from controller_config import BatteryConfig
+from structured_log import get_log
+
 
 class BatteryHandler:
     """A class to contain all logic for controlling the battery charging."""
 
+    # SystemState fields read and intended actions set by this handler
+    INPUTS = ("battery_soc", "chp_production", "grid_export")
+    OUTPUTS = ("battery_intended_charge_switch_state",)
+
     def __init__(self, app, config):
         """
         Initializes the handler.
         Args:
             app: The AppDaemon app instance.
-            config: The configuration dictionary for this handler.
+            config: The BatteryConfig of this handler, or its `battery_handler` section
+                as a dictionary.
         """
         self.app = app
-        self.config = config
-        self.disable_charge_switch = self.config.get("disable_charge_switch")
-        self.min_soc_for_chp_charging = self.config.get("min_soc_for_chp_charging", 50)
-        self.min_chp_production_for_logic = self.config.get("min_chp_production_for_logic", 100)
+        self.log = get_log(app)
+        self.config = BatteryConfig.from_dict(config)
+        self.disable_charge_switch = self.config.disable_charge_switch
+        self.min_soc_for_chp_charging = self.config.min_soc_for_chp_charging
+        self.min_chp_production_for_logic = self.config.min_chp_production_for_logic
+        # Entities whose state changes require a new evaluation
+        self.input_entities = ()
 
-    def evaluate_and_act(self, state: SystemState):
+    def evaluate_and_act(self, state: SystemState, cache=None):
         """
-        Main decision-making method to control the battery charging.
-        This method calculates the intended state and stores it in the SystemState object.
+        Main decision-making method to control the battery charging. This method
+        calculates the intended state and stores it in the SystemState object.
         Args:
             state: The current system state.
+            cache: An optional per-cycle StateCache. Unused, as this handler only reads
+                the SystemState.
         """
         if not self.disable_charge_switch:
-            self.app.log("`disable_charge_switch` is not configured for BatteryHandler. Skipping.")
+            self.log.info(
+                "battery_handler_skipped", reason="disable_charge_switch not configured"
+            )
             return
 
         soc_is_high = state.battery_soc >= self.min_soc_for_chp_charging
-        is_charging_from_chp_only = (state.chp_production >= self.min_chp_production_for_logic and
-                                     state.grid_export < state.chp_production)
+        is_charging_from_chp_only = (
+            state.chp_production >= self.min_chp_production_for_logic
+            and state.grid_export < state.chp_production
+        )
 
-        # Condition to disable charging: SOC is high and the only significant power source is CHP.
+        # Condition to disable charging: SOC is high and the only significant power
+        # source is CHP.
         if soc_is_high and is_charging_from_chp_only:
             # We want the disable_charge_switch to be 'on'.
-            state.battery_intended_charge_switch_state = 'on'
+            state.battery_intended_charge_switch_state = "on"
         # Otherwise, charging should be enabled.
         else:
             # We want the disable_charge_switch to be 'off'.
-            state.battery_intended_charge_switch_state = 'off'
+            state.battery_intended_charge_switch_state = "off"
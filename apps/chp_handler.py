@@ -1,61 +1,109 @@
 import appdaemon.plugins.hass.hassapi as hass
 from system_state import SystemState
 from datetime import datetime, timezone
+from toggle_index import parse_last_changed
+from controller_config import ChpConfig, MinerConfig
+from structured_log import get_log
+
 
 class ChpHandler:
     """A class to contain all logic for controlling the CHP plant."""
 
-    def __init__(self, app, config):
+    # SystemState fields read and intended actions set by this handler
+    INPUTS = ("grid_import", "house_consumption")
+    OUTPUTS = ("chp_intended_switch_state",)
+
+    def __init__(self, app, config, clock=None, toggle_index=None, miner_config=None):
         """
         Initializes the handler.
         Args:
             app: The AppDaemon app instance.
-            config: The configuration dictionary for this handler.
+            config: The ChpConfig of this handler, or its `chp_handler` section as a
+                dictionary.
+            clock: An optional callable returning the current aware datetime, e.g.
+                simulated time in a replay.
+            toggle_index: An optional shared ToggleIndex. Without it, `last_changed` is
+                read from Home Assistant.
+            miner_config: The MinerConfig of the miner, which has to be off before the
+                CHP turns on. Optional.
         """
         self.app = app
-        self.config = config
-        self.entity_id = self.config.get("switch_entity")
-        self.power_draw_threshold = self.config.get("power_draw_threshold", 1000)
-        self.min_wait_time_minutes = self.config.get("min_wait_time", 3)
+        self.log = get_log(app)
+        self.config = ChpConfig.from_dict(config)
+        self.clock = clock
+        self.toggle_index = toggle_index
+        self.entity_id = self.config.switch_entity
+        self.power_draw_threshold = self.config.power_draw_threshold
+        self.min_wait_time_minutes = self.config.min_wait_time
 
-        # Get miner config from top-level args
-        miner_config = self.app.args.get("miner_heater", {})
-        self.miner_switch_entity = miner_config.get("switch_entity")
+        miner_config = MinerConfig.from_dict(miner_config)
+        self.miner_switch_entity = miner_config.switch_entity
         # The user requested a configurable min wait time for the miner as well.
-        self.miner_min_wait_time_minutes = miner_config.get("min_wait_time", 3)
-
+        self.miner_min_wait_time_minutes = miner_config.min_wait_time
+        # Entities whose state changes require a new evaluation
+        self.input_entities = tuple(
+            entity_id
+            for entity_id in (self.entity_id, self.miner_switch_entity)
+            if entity_id
+        )
 
-    def _can_toggle(self, entity_id, min_wait_minutes):
-        """Checks if an entity can be toggled based on its last_changed attribute."""
-        if not entity_id:
-            return True # Nothing to check against
+        if self.toggle_index is not None:
+            self.toggle_index.track(self.entity_id)
+            self.toggle_index.track(self.miner_switch_entity)
 
-        last_changed_str = self.app.get_state(entity_id, attribute="last_changed")
-        if last_changed_str:
-            # Appdaemon 4.x returns a datetime object, 3.x returns a string.
-            if isinstance(last_changed_str, datetime):
-                last_changed_dt = last_changed_str
-            else:
-                last_changed_dt = datetime.fromisoformat(last_changed_str)
+    def _now(self):
+        """Returns the current time from the configured clock, or the wall clock."""
+        return self.clock() if self.clock else datetime.now(timezone.utc)
 
-            # Ensure the datetime is timezone-aware for comparison
-            if last_changed_dt.tzinfo is None:
-                last_changed_dt = last_changed_dt.astimezone()
+    def _seconds_since_change(self, entity_id, reader):
+        """
+        Returns the seconds since an entity last changed, or None if it is unknown.
+        """
+        if self.toggle_index is not None:
+            return self.toggle_index.seconds_since_change(entity_id)
+        last_changed = parse_last_changed(
+            reader.get_state(entity_id, attribute="last_changed")
+        )
+        if last_changed is None:
+            return None
+        return (self._now() - last_changed).total_seconds()
 
-            now = datetime.now(timezone.utc)
-            time_since_last_change_seconds = (now - last_changed_dt).total_seconds()
+    def _can_toggle(self, entity_id, min_wait_minutes, reader=None):
+        """
+        Checks if an entity can be toggled based on the time since it last changed.
+        """
+        if not entity_id:
+            return True  # Nothing to check against
 
-            if time_since_last_change_seconds < min_wait_minutes * 60:
-                self.app.log(f"Cannot toggle {entity_id}. Only {time_since_last_change_seconds:.0f}s of {min_wait_minutes*60}s elapsed.")
-                return False
+        reader = reader if reader is not None else self.app
+        time_since_last_change_seconds = self._seconds_since_change(entity_id, reader)
+        if (
+            time_since_last_change_seconds is not None
+            and time_since_last_change_seconds < min_wait_minutes * 60
+        ):
+            self.log.info(
+                "toggle_blocked",
+                entity=entity_id,
+                elapsed_seconds=round(time_since_last_change_seconds),
+                min_wait_seconds=min_wait_minutes * 60,
+            )
+            return False
         return True
 
-    def evaluate_and_act(self, state: SystemState):
+    def evaluate_and_act(self, state: SystemState, cache=None):
         """
         Main decision-making method to control the CHP.
+        Args:
+            state: The current system state.
+            cache: An optional per-cycle StateCache used for reading entity states.
         """
-        chp_is_on = self.app.get_state(self.entity_id) == "on"
-        miner_is_on = self.app.get_state(self.miner_switch_entity) == "on" if self.miner_switch_entity else False
+        reader = cache if cache is not None else self.app
+        chp_is_on = reader.get_state(self.entity_id) == "on"
+        miner_is_on = (
+            reader.get_state(self.miner_switch_entity) == "on"
+            if self.miner_switch_entity
+            else False
+        )
 
         # Determine if the CHP should be on based on house consumption
         should_be_on = state.grid_import > self.power_draw_threshold
@@ -64,18 +112,37 @@ class ChpHandler:
             # Condition to turn on CHP is met
             if miner_is_on:
                 # If miner is on, we must turn it off first.
-                if self._can_toggle(self.miner_switch_entity, self.miner_min_wait_time_minutes):
-                    self.app.log(f"CHP: Drawing from grid ({state.grid_import}W > {self.power_draw_threshold}W), but miner is on. Waiting for miner to turn off first.")
-                # Do not proceed to turn on CHP in this cycle. Wait for the miner to be off.
+                if self._can_toggle(
+                    self.miner_switch_entity, self.miner_min_wait_time_minutes, reader
+                ):
+                    self.log.info(
+                        "chp_waiting_for_miner",
+                        grid_import=state.grid_import,
+                        threshold=self.power_draw_threshold,
+                    )
+                # Do not proceed to turn on CHP in this cycle. Wait for the miner to be
+                # off.
             else:
                 # Miner is off, and we need power, so turn CHP on if it's currently off.
                 if not chp_is_on:
-                    if self._can_toggle(self.entity_id, self.min_wait_time_minutes):
-                        self.app.log(f"CHP: House consumption is high ({state.house_consumption}W > {self.power_draw_threshold}W) and miner is off. Turning CHP on.")
-                        state.chp_intended_switch_state = 'on'
+                    if self._can_toggle(
+                        self.entity_id, self.min_wait_time_minutes, reader
+                    ):
+                        self.log.info(
+                            "chp_on",
+                            grid_import=state.grid_import,
+                            house_consumption=state.house_consumption,
+                            threshold=self.power_draw_threshold,
+                        )
+                        state.chp_intended_switch_state = "on"
         else:
             # Condition to turn on CHP is not met, so it should be off.
             if chp_is_on:
-                if self._can_toggle(self.entity_id, self.min_wait_time_minutes):
-                    self.app.log(f"CHP: House consumption is low ({state.house_consumption}W <= {self.power_draw_threshold}W). Turning CHP off.")
-                    state.chp_intended_switch_state = 'off'
+                if self._can_toggle(self.entity_id, self.min_wait_time_minutes, reader):
+                    self.log.info(
+                        "chp_off",
+                        grid_import=state.grid_import,
+                        house_consumption=state.house_consumption,
+                        threshold=self.power_draw_threshold,
+                    )
+                    state.chp_intended_switch_state = "off"
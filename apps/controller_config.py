@@ -0,0 +1,482 @@
+import dataclasses
+import typing
+from dataclasses import dataclass, field
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from signal_stats import DEFAULT_FIELDS, STATISTICS
+from structured_log import LEVELS
+
+
+class ConfigError(ValueError):
+    """Raised when the app arguments in apps.yaml are invalid."""
+
+
+class _Section:
+    """
+    Base class of the config sections, which are frozen, slotted dataclasses.
+
+    `from_dict` checks a section of the app arguments against the dataclass fields:
+    unknown keys, missing required keys and values of the wrong type raise a ConfigError
+    naming the offending key. Fields typed as another section, or as a mapping of
+    sections, are parsed recursively.
+    """
+
+    __slots__ = ()
+
+    # The name of the section in apps.yaml, used in error messages
+    SECTION = ""
+
+    @classmethod
+    def from_dict(cls, data, section=None):
+        """
+        Parses and validates a section of the app arguments.
+        Args:
+            data: The section as loaded from apps.yaml, or None for an empty section.
+            section: The path of the section in error messages. Defaults to `SECTION`.
+        Returns:
+            An instance of the section class.
+        Raises:
+            ConfigError: If the section is invalid.
+        """
+        section = section or cls.SECTION
+        if data is None:
+            data = {}
+        if isinstance(data, cls):
+            return data
+        if not isinstance(data, dict):
+            raise ConfigError(
+                f"`{section}` must be a mapping, got {type(data).__name__}."
+            )
+
+        hints = typing.get_type_hints(cls)
+        init_fields = [f for f in dataclasses.fields(cls) if f.init]
+        unknown = set(data) - {f.name for f in init_fields}
+        if unknown:
+            raise ConfigError(
+                f"Unknown keys in `{section}`: {', '.join(sorted(map(str, unknown)))}."
+            )
+
+        values = {}
+        for f in init_fields:
+            path = f"{section}.{f.name}" if section else f.name
+            if f.name in data:
+                values[f.name] = _convert(data[f.name], hints[f.name], path)
+            elif (
+                f.default is dataclasses.MISSING
+                and f.default_factory is dataclasses.MISSING
+            ):
+                raise ConfigError(f"`{path}` is required.")
+        return cls(**values)
+
+
+def _convert(value, annotation, path):
+    """
+    Checks a value against a field annotation and converts lists to tuples and mappings
+    to sections.
+    """
+    if typing.get_origin(annotation) is typing.Union:
+        options = [
+            option for option in typing.get_args(annotation) if option is not type(None)
+        ]
+        if value is None:
+            return None
+        annotation = options[0]
+
+    if isinstance(annotation, type) and issubclass(annotation, _Section):
+        return annotation.from_dict(value, path)
+    if annotation is bool:
+        if not isinstance(value, bool):
+            raise ConfigError(f"`{path}` must be true or false, got {value!r}.")
+        return value
+    if annotation is int:
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ConfigError(f"`{path}` must be an integer, got {value!r}.")
+        return value
+    if annotation is float:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ConfigError(f"`{path}` must be a number, got {value!r}.")
+        # Integers are kept, so configured values appear unchanged in logs and published
+        # states
+        return value
+    if annotation is str:
+        if not isinstance(value, str):
+            raise ConfigError(f"`{path}` must be a string, got {value!r}.")
+        return value
+    if typing.get_origin(annotation) is dict:
+        if value is None:
+            return {}
+        if not isinstance(value, dict):
+            raise ConfigError(f"`{path}` must be a mapping, got {value!r}.")
+        key_type, item_type = typing.get_args(annotation)
+        return {
+            _convert(key, key_type, path): _convert(item, item_type, f"{path}.{key}")
+            for key, item in value.items()
+        }
+    if typing.get_origin(annotation) is tuple:
+        if not isinstance(value, (list, tuple)):
+            raise ConfigError(f"`{path}` must be a list, got {value!r}.")
+        item_type = typing.get_args(annotation)[0]
+        return tuple(
+            _convert(item, item_type, f"{path}[{index}]")
+            for index, item in enumerate(value)
+        )
+    raise TypeError(f"Unsupported config annotation {annotation!r} for `{path}`.")
+
+
+def _check(condition, message):
+    if not condition:
+        raise ConfigError(message)
+
+
+def _signal_fields():
+    """
+    Returns the numeric SystemState fields, which statistics and deadbands apply to.
+    """
+    # Imported here, since system_state imports this module
+    from system_state import SystemState
+
+    return [
+        name
+        for name, annotation in typing.get_type_hints(SystemState).items()
+        if annotation is float
+    ]
+
+
+def _check_signal_fields(names, path):
+    """Checks that all names are numeric SystemState fields."""
+    known = _signal_fields()
+    unknown = [name for name in names if name not in known]
+    _check(
+        not unknown,
+        f"Unknown SystemState fields in `{path}`: {', '.join(unknown)}. Expected some of {', '.join(known)}.",
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class SensorConfig(_Section):
+    """The input sensors the SystemState is built from."""
+
+    SECTION = "sensors"
+
+    grid_power: str
+    battery_soc: str
+    battery_power: str
+    solar_production: str
+    miner_consumption: str
+    chp_production: str
+
+    def entities(self) -> dict:
+        """
+        Returns a dictionary mapping sensor names to entity IDs, in declaration order.
+        """
+        return {f.name: getattr(self, f.name) for f in dataclasses.fields(self)}
+
+
+@dataclass(frozen=True, slots=True)
+class MinerConfig(_Section):
+    """The `miner_heater` section."""
+
+    SECTION = "miner_heater"
+
+    switch_entity: Optional[str] = None
+    power_limit_entity: Optional[str] = None
+    activation_threshold: float = 2000
+    max_power: float = 6000
+    power_step: float = 1000
+    min_write_interval_seconds: float = 60
+    min_wait_time: float = 3
+    surplus_statistic: str = "last"
+
+    def __post_init__(self):
+        _check(self.power_step > 0, "`miner_heater.power_step` must be positive.")
+        _check(
+            self.max_power >= self.activation_threshold,
+            "`miner_heater.max_power` must not be below `activation_threshold`.",
+        )
+        _check(
+            self.surplus_statistic in STATISTICS,
+            f"`miner_heater.surplus_statistic` must be one of {', '.join(STATISTICS)}, got {self.surplus_statistic!r}.",
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ChpConfig(_Section):
+    """The `chp_handler` section."""
+
+    SECTION = "chp_handler"
+
+    switch_entity: Optional[str] = None
+    power_draw_threshold: float = 1000
+    min_wait_time: float = 3
+
+
+@dataclass(frozen=True, slots=True)
+class BatteryConfig(_Section):
+    """The `battery_handler` section."""
+
+    SECTION = "battery_handler"
+
+    disable_charge_switch: Optional[str] = None
+    min_soc_for_chp_charging: float = 50
+    min_chp_production_for_logic: float = 100
+
+
+@dataclass(frozen=True, slots=True)
+class ExecutorConfig(_Section):
+    """The `action_executor` section."""
+
+    SECTION = "action_executor"
+
+    max_workers: int = 4
+    timeout_seconds: float = 10
+    retries: int = 2
+    backoff_seconds: float = 1
+
+    def __post_init__(self):
+        _check(
+            self.max_workers >= 1, "`action_executor.max_workers` must be at least 1."
+        )
+        _check(self.retries >= 0, "`action_executor.retries` must not be negative.")
+
+
+@dataclass(frozen=True, slots=True)
+class SignalStatsConfig(_Section):
+    """The `signal_stats` section, see `signal_stats.SignalStats`."""
+
+    SECTION = "signal_stats"
+
+    fields: tuple[str, ...] = DEFAULT_FIELDS
+    window: int = 30
+    ewma_seconds: float = 300
+
+    def __post_init__(self):
+        _check_signal_fields(self.fields, "signal_stats.fields")
+        _check(self.window >= 1, "`signal_stats.window` must be at least 1.")
+        _check(self.ewma_seconds > 0, "`signal_stats.ewma_seconds` must be positive.")
+
+
+@dataclass(frozen=True, slots=True)
+class DeadbandConfig(_Section):
+    """
+    A deadband of one value in `handler_deadbands` or `publish_deadbands`. A relative
+    deadband is a fraction of the last value.
+    """
+
+    SECTION = "deadband"
+
+    absolute: float = 0
+    relative: float = 0
+
+    def __post_init__(self):
+        _check(
+            self.absolute >= 0 and self.relative >= 0,
+            "Deadbands must not be negative.",
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class EventDrivenConfig(_Section):
+    """The `event_driven` section."""
+
+    SECTION = "event_driven"
+
+    debounce_seconds: float = 5
+    min_interval_seconds: float = 60
+    fallback_interval_seconds: float = 300
+
+    def __post_init__(self):
+        _check(
+            self.debounce_seconds >= 0,
+            "`event_driven.debounce_seconds` must not be negative.",
+        )
+        _check(
+            self.fallback_interval_seconds > 0,
+            "`event_driven.fallback_interval_seconds` must be positive.",
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class LoggingConfig(_Section):
+    """The `logging` section, see `structured_log.StructuredLog`."""
+
+    SECTION = "logging"
+
+    level: str = "INFO"
+    repeat_seconds: float = 300
+    rate_limits: dict[str, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        _check(
+            self.level.upper() in LEVELS,
+            f"`logging.level` must be one of {', '.join(LEVELS)}, got {self.level!r}.",
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ProfileConfig(_Section):
+    """
+    A forecast or profile source of the planning handler, see `forecast.ProfileSource`.
+    """
+
+    SECTION = "profile"
+
+    file: Optional[str] = None
+    column: str = "value"
+    entity: Optional[str] = None
+    attribute: str = "forecast"
+    time_key: str = "period_start"
+    value_key: str = "value"
+    scale: float = 1
+    # The time zone of the hours of a daily `hour` profile, e.g. Europe/Berlin. Defaults
+    # to the local time zone.
+    time_zone: Optional[str] = None
+
+    def __post_init__(self):
+        _check(
+            self.file or self.entity,
+            "A profile source needs either a `file` or an `entity`.",
+        )
+        if self.time_zone is not None:
+            try:
+                ZoneInfo(self.time_zone)
+            except (ValueError, ZoneInfoNotFoundError):
+                raise ConfigError(
+                    f"Unknown `time_zone` of a profile source: {self.time_zone!r}."
+                )
+
+
+@dataclass(frozen=True, slots=True)
+class PlanningConfig(_Section):
+    """The `planning_handler` section."""
+
+    SECTION = "planning_handler"
+
+    solar_forecast: ProfileConfig
+    consumption_profile: ProfileConfig
+    step_minutes: float = 60
+    horizon_hours: float = 24
+    soc_levels: int = 41
+    cpu_budget_ms: float = 200
+    battery_capacity_wh: float = 10000
+    min_soc: float = 10
+    battery_max_charge_w: float = 3000
+    battery_max_discharge_w: float = 3000
+    battery_efficiency: float = 0.95
+    grid_import_price: float = 0.30
+    grid_export_price: float = 0.08
+    chp_power_w: float = 1500
+    chp_cost_per_kwh: float = 0.12
+    miner_value_per_kwh: float = 0.10
+    # Defaults to the grid export price
+    battery_terminal_value_per_kwh: Optional[float] = None
+    # Defaults to off plus the miner's power steps
+    miner_levels: Optional[tuple[float, ...]] = None
+
+    def __post_init__(self):
+        _check(
+            self.step_minutes > 0, "`planning_handler.step_minutes` must be positive."
+        )
+        _check(
+            self.horizon_hours * 60 >= self.step_minutes,
+            "`planning_handler.horizon_hours` must cover at least one step.",
+        )
+        _check(
+            self.soc_levels >= 2, "`planning_handler.soc_levels` must be at least 2."
+        )
+        _check(
+            0 < self.battery_efficiency <= 1,
+            "`planning_handler.battery_efficiency` must be in (0, 1].",
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ControllerConfig(_Section):
+    """
+    The configuration the control loop needs, parsed once from the app arguments.
+
+    Entity lists that are read or written every cycle are precomputed, so the control
+    loop only does attribute lookups. Options not listed here, e.g. file locations and
+    loop metrics, are only read during initialization and stay in the app arguments.
+    """
+
+    SECTION = ""
+
+    sensors: SensorConfig
+    dry_run_switch_entity: Optional[str] = None
+    snapshot_reads: bool = False
+    miner_heater: Optional[MinerConfig] = None
+    chp_handler: Optional[ChpConfig] = None
+    battery_handler: Optional[BatteryConfig] = None
+    planning_handler: Optional[PlanningConfig] = None
+    action_executor: ExecutorConfig = field(default_factory=ExecutorConfig)
+    signal_stats: SignalStatsConfig = field(default_factory=SignalStatsConfig)
+    handler_deadbands: dict[str, DeadbandConfig] = field(default_factory=dict)
+    handler_max_age_seconds: float = 60
+    publish_entities: dict[str, str] = field(default_factory=dict)
+    publish_deadbands: dict[str, DeadbandConfig] = field(default_factory=dict)
+    publish_heartbeat_minutes: Optional[float] = 10
+    # None polls every 60 seconds instead
+    event_driven: Optional[EventDrivenConfig] = None
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
+
+    # Entities read to build a SystemState, and the switch and power limit entities the
+    # actions target
+    snapshot_entities: tuple = field(init=False, default=())
+    actuator_entities: tuple = field(init=False, default=())
+
+    def __post_init__(self):
+        _check_signal_fields(self.handler_deadbands, "handler_deadbands")
+        if self.publish_entities:
+            unknown = [
+                key
+                for key in self.publish_deadbands
+                if key not in self.publish_entities
+            ]
+            _check(
+                not unknown,
+                f"Unknown keys in `publish_deadbands`: {', '.join(unknown)}. Expected keys of `publish_entities`.",
+            )
+        miner = self.miner_heater
+        if miner is not None and miner.surplus_statistic != "last":
+            _check(
+                "miner_surplus" in self.signal_stats.fields,
+                f"`miner_heater.surplus_statistic` {miner.surplus_statistic!r} needs `miner_surplus` in `signal_stats.fields`.",
+            )
+        snapshot = [
+            self.dry_run_switch_entity,
+            *self.sensors.entities().values(),
+            miner and miner.power_limit_entity,
+        ]
+        actuators = [
+            miner and miner.switch_entity,
+            miner and miner.power_limit_entity,
+            self.chp_handler and self.chp_handler.switch_entity,
+            self.battery_handler and self.battery_handler.disable_charge_switch,
+        ]
+        object.__setattr__(
+            self,
+            "snapshot_entities",
+            tuple(entity_id for entity_id in snapshot if entity_id),
+        )
+        object.__setattr__(
+            self,
+            "actuator_entities",
+            tuple(entity_id for entity_id in actuators if entity_id),
+        )
+
+    @classmethod
+    def from_args(cls, args: dict) -> "ControllerConfig":
+        """
+        Parses the typed sections of the app arguments. Other keys are left to their
+        consumers.
+        Args:
+            args: The app arguments from apps.yaml.
+        Returns:
+            The ControllerConfig.
+        Raises:
+            ConfigError: If a section is missing or invalid.
+        """
+        names = {f.name for f in dataclasses.fields(cls) if f.init}
+        return cls.from_dict(
+            {key: value for key, value in args.items() if key in names}
+        )
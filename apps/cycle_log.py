@@ -0,0 +1,201 @@
+"""
+Append-only binary log of the control cycles.
+
+Every cycle appends one fixed-size record with the SystemState sensor fields and the
+intended actions to a file per UTC day, `cycles-YYYYMMDD.bin` in the log directory. A
+file is a 16-byte header followed by packed little-endian records, so it can be
+memory-mapped as a NumPy structured array:
+
+    records = read_cycle_log("logs/cycles-20240601.bin")
+    records["grid_power"].mean()
+"""
+
+import math
+import os
+import struct
+import time
+from datetime import datetime, timezone
+import numpy as np
+from system_state import SystemState
+from system_state_batch import FIELDS, SystemStateBatch
+
+MAGIC = b"ECYC"
+VERSION = 1
+
+# The record layout as (name, struct format character) pairs
+RECORD_FIELDS = [
+    ("time", "d"),
+    *((name, "f") for name in FIELDS),
+    ("duration", "f"),
+    ("miner_intended_power_limit", "f"),
+    ("miner_intended_switch_state", "b"),
+    ("battery_intended_charge_switch_state", "b"),
+    ("chp_intended_switch_state", "b"),
+    ("is_dry_run", "B"),
+]
+RECORD = struct.Struct("<" + "".join(code for _, code in RECORD_FIELDS))
+DTYPE = np.dtype([(name, "<" + code) for name, code in RECORD_FIELDS])
+
+# Magic, version, header size and record size, padded to 16 bytes
+HEADER = struct.Struct("<4sHHH6x")
+
+# Switch states as stored in the record. -1 means the handler did not set an intended
+# state.
+SWITCH_CODES = {None: -1, "off": 0, "on": 1}
+SWITCH_STATES = {code: state for state, code in SWITCH_CODES.items()}
+
+
+class CycleLog:
+    """
+    Appends a fixed-size record per control cycle to a daily rotated binary file.
+
+    Records are written unbuffered with a single `write` call, so they are visible to
+    readers at once and a crash loses at most the record being written. A partial record
+    left by a crash is cut off when the file is reopened.
+    """
+
+    def __init__(self, directory, clock=None):
+        """
+        Initializes the log.
+        Args:
+            directory: The directory of the daily files. It is created if it does not
+                exist.
+            clock: An optional callable returning the current aware datetime, e.g.
+                simulated time in a replay.
+        """
+        self.directory = directory
+        self.clock = clock
+        self._file = None
+        self._day = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, day) -> str:
+        """Returns the file of a day, given as days since the epoch."""
+        date = datetime.fromtimestamp(day * 86400, timezone.utc)
+        return os.path.join(self.directory, f"cycles-{date:%Y%m%d}.bin")
+
+    def _open(self, day):
+        """
+        Opens the file of a day for appending. A file that is not a cycle log of this
+        version is renamed to `<name>.invalid` and replaced by a new one.
+        """
+        self.close()
+        path = self.path(day)
+        file = open(path, "a+b", buffering=0)
+        try:
+            size = file.seek(0, os.SEEK_END)
+            if size >= HEADER.size:
+                file.seek(0)
+                try:
+                    _check_header(file.read(HEADER.size), path)
+                except ValueError:
+                    file.close()
+                    os.replace(path, f"{path}.invalid")
+                    file = open(path, "a+b", buffering=0)
+                    size = 0
+            if size < HEADER.size:
+                file.truncate(0)
+                file.write(HEADER.pack(MAGIC, VERSION, HEADER.size, RECORD.size))
+            else:
+                # Drop a partial record left by an interrupted write
+                records = (size - HEADER.size) // RECORD.size
+                if HEADER.size + records * RECORD.size != size:
+                    file.truncate(HEADER.size + records * RECORD.size)
+        except BaseException:
+            file.close()
+            raise
+        self._file = file
+        self._day = day
+
+    def append(self, state: SystemState, duration=None, timestamp=None):
+        """
+        Appends a record of a control cycle.
+        Args:
+            state: The SystemState of the cycle, after the handlers set their intended
+                actions.
+            duration: The duration of the cycle in seconds, if known.
+            timestamp: The cycle time in epoch seconds. Defaults to the current time.
+        """
+        if timestamp is None:
+            timestamp = self.clock().timestamp() if self.clock else time.time()
+        day = int(timestamp // 86400)
+        if day != self._day:
+            self._open(day)
+        limit = state.miner_intended_power_limit
+        self._file.write(
+            RECORD.pack(
+                timestamp,
+                *(getattr(state, name) for name in FIELDS),
+                math.nan if duration is None else duration,
+                math.nan if limit is None else limit,
+                SWITCH_CODES[state.miner_intended_switch_state],
+                SWITCH_CODES[state.battery_intended_charge_switch_state],
+                SWITCH_CODES[state.chp_intended_switch_state],
+                state.is_dry_run,
+            )
+        )
+
+    def close(self):
+        """Closes the current file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._day = None
+
+
+def _check_header(header, path):
+    magic, version, header_size, record_size = HEADER.unpack(header)
+    if (
+        magic != MAGIC
+        or version != VERSION
+        or header_size != HEADER.size
+        or record_size != RECORD.size
+    ):
+        raise ValueError(f"{path} is not a version {VERSION} cycle log.")
+
+
+def read_cycle_log(path) -> np.ndarray:
+    """
+    Memory-maps a cycle log file.
+    Args:
+        path: A daily file written by CycleLog.
+    Returns:
+        A read-only structured array with one element per complete record and the fields
+            of RECORD_FIELDS.
+    Raises:
+        ValueError: If the file is not a cycle log of this version.
+    """
+    with open(path, "rb") as f:
+        _check_header(f.read(HEADER.size), path)
+    records = (os.path.getsize(path) - HEADER.size) // RECORD.size
+    if records == 0:
+        return np.zeros(0, dtype=DTYPE)
+    return np.memmap(path, dtype=DTYPE, mode="r", offset=HEADER.size, shape=(records,))
+
+
+def read_cycle_logs(directory, start=None, end=None):
+    """
+    Yields the memory-mapped daily files of a log directory in time order.
+    Args:
+        directory: The log directory.
+        start: An optional first day to read, as an aware datetime.
+        end: An optional last day to read, as an aware datetime.
+    Yields:
+        Structured arrays as returned by `read_cycle_log`.
+    """
+    first = f"cycles-{start:%Y%m%d}.bin" if start else None
+    last = f"cycles-{end:%Y%m%d}.bin" if end else None
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("cycles-") and name.endswith(".bin")):
+            continue
+        if (first and name < first) or (last and name > last):
+            continue
+        yield read_cycle_log(os.path.join(directory, name))
+
+
+def cycle_batch(records) -> SystemStateBatch:
+    """Returns cycle log records as a SystemStateBatch with epoch second timestamps."""
+    return SystemStateBatch(
+        records["time"].astype(np.float64),
+        **{name: records[name].astype(np.float64) for name in FIELDS},
+    )
@@ -1,66 +1,397 @@
+import os
+import struct
+import time
 import appdaemon.plugins.hass.hassapi as hass
 from datetime import datetime, timezone
 from system_state import SystemState
+from state_cache import StateCache
+from publish_filter import PublishFilter
+from publish_plan import PublishPlan
+from loop_metrics import LoopMetrics, CallCounter
+from toggle_index import ToggleIndex
+from write_ledger import WriteLedger
+from structured_log import create_structured_log
+from action_executor import ActionExecutor
+from action_recorder import ActionRecorder
+from loop_guard import LoopGuard
+from signal_stats import SignalStats
+from controller_config import ConfigError, ControllerConfig
+from handler_graph import HandlerScheduler
 from miner_heater_handler import MinerHeaterHandler
 from battery_handler import BatteryHandler
 from chp_handler import ChpHandler
 
+# Default file name of the persisted write ledger in AppDaemon's configuration
+# directory, so runtime state is not written into the apps directory
+WRITE_LEDGER_FILE = "energy_controller_write_ledger.json"
+
+
+def create_signal_stats(config):
+    """
+    Creates the SignalStats configured in the `signal_stats` section of a
+    ControllerConfig. Returns None if no handler reads a smoothed statistic, so that the
+    loop does not update statistics nobody uses.
+    """
+    if config.miner_heater is None or config.miner_heater.surplus_statistic == "last":
+        return None
+    stats_config = config.signal_stats
+    return SignalStats(
+        stats_config.fields, stats_config.window, stats_config.ewma_seconds
+    )
+
+
+def create_handler_scheduler(config, handlers, clock=time.monotonic):
+    """
+    Creates the HandlerScheduler configured by `handler_deadbands` and
+    `handler_max_age_seconds` of a ControllerConfig.
+    """
+    return HandlerScheduler(
+        handlers, config.handler_deadbands, config.handler_max_age_seconds, clock
+    )
+
+
+def create_handlers(
+    app, config, clock=None, toggle_index=None, write_ledger=None, signal_stats=None
+):
+    """
+    Instantiates the device handlers configured in the app arguments.
+    Args:
+        app: The app instance the handlers read from and log to.
+        config: The ControllerConfig parsed from the app arguments.
+        clock: An optional callable returning the current aware datetime, passed to
+            time-dependent handlers.
+        toggle_index: An optional ToggleIndex shared by the handlers that check switch
+            dwell times.
+        write_ledger: An optional WriteLedger shared by the handlers that rate-limit
+            actuator writes.
+        signal_stats: Optional SignalStats shared by the handlers that use smoothed
+            signals.
+    Returns:
+        A list of handlers in evaluation order.
+    """
+    device_handlers = []
+
+    if config.miner_heater is not None:
+        device_handlers.append(
+            MinerHeaterHandler(
+                app,
+                config.miner_heater,
+                clock=clock,
+                write_ledger=write_ledger,
+                signal_stats=signal_stats,
+            )
+        )
+        app.log("Initialized MinerHeaterHandler.")
+
+    if config.battery_handler is not None:
+        device_handlers.append(BatteryHandler(app, config.battery_handler))
+        app.log("Initialized BatteryHandler.")
+
+    if config.chp_handler is not None:
+        device_handlers.append(
+            ChpHandler(
+                app,
+                config.chp_handler,
+                clock=clock,
+                toggle_index=toggle_index,
+                miner_config=config.miner_heater,
+            )
+        )
+        app.log("Initialized ChpHandler.")
+
+    if config.planning_handler is not None:
+        # Imported here so that NumPy is only needed when planning is configured
+        from planning_handler import PlanningHandler
+
+        device_handlers.append(
+            PlanningHandler(
+                app,
+                config.planning_handler,
+                clock=clock,
+                toggle_index=toggle_index,
+                write_ledger=write_ledger,
+                miner_config=config.miner_heater,
+                chp_config=config.chp_handler,
+                battery_config=config.battery_handler,
+            )
+        )
+        app.log("Initialized PlanningHandler.")
+
+    # Add more handlers here for other devices, e.g., wallbox
+    return device_handlers
+
+
 class EnergyController(hass.Hass):
     """The main AppDaemon class for orchestrating energy devices."""
 
+    # An optional callable returning the current aware datetime. Without it, the wall
+    # clock is used. A simulation sets its own clock, so that dwell times, write
+    # intervals and loop intervals follow simulated time.
+    clock = None
+
+    def _monotonic(self):
+        """
+        Returns seconds for interval measurements, from the configured clock or the
+        monotonic clock.
+        """
+        return self.clock().timestamp() if self.clock else time.monotonic()
+
     def initialize(self):
         """Initializes the controller, loads handlers, and schedules the loop."""
         self.log("Hello from the Solalindenstein AppDaemon Energy Manager!")
         self.log("Initializing Modular Energy Controller.")
 
-        self.dry_run_switch_entity = self.args.get("dry_run_switch_entity")
-        if not SystemState.validate_sensors(self, self.args.get("sensors", {})):
+        try:
+            # Parsed once, so the control loop does not look up the app arguments
+            self.controller_config = ControllerConfig.from_args(self.args)
+        except ConfigError as e:
+            self.error(f"Aborting initialization due to invalid configuration: {e}")
+            return
+        self.structured_log = create_structured_log(
+            self, self.controller_config.logging, clock=self._monotonic
+        )
+
+        self.dry_run_switch_entity = self.controller_config.dry_run_switch_entity
+        if not SystemState.validate_sensors(
+            self, self.controller_config.sensors.entities()
+        ):
             self.error("Aborting initialization due to bad sensor configuration.")
             return
 
-        self.device_handlers = []
+        self.publish_filter = PublishFilter(
+            self.controller_config.publish_deadbands,
+            self.controller_config.publish_heartbeat_minutes,
+        )
+
+        self.publish_plan = PublishPlan(self.controller_config.publish_entities)
+        self.loop_metrics = LoopMetrics(self.args.get("loop_metrics_window", 60))
+
+        if "write_ledger_path" in self.args:
+            ledger_path = self.args["write_ledger_path"]
+        else:
+            ledger_path = self._default_ledger_path()
+        self.write_ledger = WriteLedger(
+            ledger_path, clock=self.clock, log=self.structured_log
+        )
+        if self.write_ledger.load():
+            self.log(f"Loaded write ledger from {self.write_ledger.path}.")
+        else:
+            self.log("Starting with an empty write ledger.")
+        cycle_log_dir = self.args.get("cycle_log_dir")
+        self.cycle_log = None
+        if cycle_log_dir:
+            # Imported here so that NumPy is only needed when the cycle log is
+            # configured
+            from cycle_log import CycleLog
+
+            self.cycle_log = CycleLog(cycle_log_dir, clock=self.clock)
+        self.action_executor = self._create_action_executor()
+        self.toggle_index = ToggleIndex(self, clock=self.clock)
+        self.signal_stats = create_signal_stats(self.controller_config)
+        self.device_handlers = create_handlers(
+            self,
+            self.controller_config,
+            clock=self.clock,
+            toggle_index=self.toggle_index,
+            write_ledger=self.write_ledger,
+            signal_stats=self.signal_stats,
+        )
+        self.handler_scheduler = create_handler_scheduler(
+            self.controller_config, self.device_handlers, clock=self._monotonic
+        )
+        self.log(
+            f"Handler execution order: {', '.join(type(handler).__name__ for handler in self.handler_scheduler.handlers)}."
+        )
 
-        # Instantiate handlers based on configuration
-        if "miner_heater" in self.args:
-            miner_config = self.args["miner_heater"]
-            self.device_handlers.append(MinerHeaterHandler(self, miner_config))
-            self.log("Initialized MinerHeaterHandler.")
+        # Schedule the main control loop. In event-driven mode, sensor changes trigger
+        # debounced runs and the periodic run only acts as a fallback.
+        self._pending_loop = None
+        event_config = self.controller_config.event_driven
+        if event_config is not None:
+            self.debounce_seconds = event_config.debounce_seconds
+            self.min_interval_seconds = event_config.min_interval_seconds
+            interval = event_config.fallback_interval_seconds
+            sensor_entities = self.controller_config.sensors.entities().values()
+            for entity_id in sensor_entities:
+                self.listen_state(self._on_sensor_change, entity_id)
+            self.log(f"Listening for changes of {len(sensor_entities)} sensors.")
+            budget = self.min_interval_seconds
+        else:
+            interval = 60
+            budget = interval
+        self.loop_guard = LoopGuard(
+            budget, self.args.get("loop_max_backoff_factor", 4), clock=self._monotonic
+        )
+        self._schedule_control_loop(interval)
 
-        if "battery_handler" in self.args:
-            battery_config = self.args["battery_handler"]
-            self.device_handlers.append(BatteryHandler(self, battery_config))
-            self.log("Initialized BatteryHandler.")
+    def _default_ledger_path(self):
+        """Returns the write ledger file used if `write_ledger_path` is not set."""
+        return os.path.join(self.config_dir, WRITE_LEDGER_FILE)
 
-        if "chp_handler" in self.args:
-            chp_config = self.args["chp_handler"]
-            self.device_handlers.append(ChpHandler(self, chp_config))
-            self.log("Initialized ChpHandler.")
+    def _create_action_executor(self):
+        """
+        Creates the executor that dispatches the actions of the control loop in the
+        background.
+        """
+        executor_config = self.controller_config.action_executor
+        return ActionExecutor(
+            self,
+            max_workers=executor_config.max_workers,
+            timeout_seconds=executor_config.timeout_seconds,
+            retries=executor_config.retries,
+            backoff_seconds=executor_config.backoff_seconds,
+        )
 
-        # Add more handlers here for other devices, e.g., wallbox
+    def _record_write(self, method, args, kwargs):
+        """
+        Records a power limit write in the write ledger once it succeeded, so a failed
+        write does not delay the next one.
+        """
+        miner_config = self.controller_config.miner_heater
+        if (
+            method == "set_state"
+            and miner_config
+            and args[0] == miner_config.power_limit_entity
+        ):
+            self.write_ledger.record(args[0], kwargs["state"])
 
-        # Schedule the main control loop
-        self.run_every(self.control_loop, "now", 60)
-        self.log("Control loop scheduled to run every minute.")
+    def _schedule_control_loop(self, interval):
+        """Schedules the periodic control loop and runs the first loop immediately."""
+        self.run_every(self.control_loop, "now", interval)
+        self.log(f"Control loop scheduled to run every {interval} seconds.")
 
         # Run first control loop immediately
         self.control_loop(None)
 
+    def _on_sensor_change(self, entity, attribute, old, new, kwargs):
+        """Schedules a debounced control loop run when an input sensor changes."""
+        if old == new or self._pending_loop is not None:
+            # Coalesce bursts of updates into the already scheduled run
+            return
+        # Wait at least the minimum interval, or longer while the loop guard backs off
+        delay = max(self.debounce_seconds, self.loop_guard.seconds_until_due())
+        self._pending_loop = self.run_in(self._run_triggered_loop, delay)
+
+    def _run_triggered_loop(self, kwargs):
+        """Runs the control loop scheduled by a sensor change."""
+        self._pending_loop = None
+        self.control_loop(kwargs)
+
     def control_loop(self, kwargs):
-        """The main control loop."""
-        self.log("Running control loop...")
-        state = SystemState.from_home_assistant(self)
-
-        if state is None:
-            self.log("Could not retrieve system state. Skipping control loop.")
-            # Set controller_running to off if the loop fails
-            publish_entities = self.args["publish_entities"]
-            self.set_state(publish_entities["controller_running"], state="off")
+        """
+        The main control loop. Only one loop runs at a time; triggers during a run are
+        coalesced into one follow-up run.
+        """
+        if not self.loop_guard.try_enter():
+            self.structured_log.info(
+                "loop_skipped",
+                interval_seconds=round(self.loop_guard.effective_interval),
+            )
             return
+        overruns = self.loop_guard.overruns
+        try:
+            self.structured_log.debug("loop_started")
+            loop_start = time.perf_counter()
+            api = CallCounter(self)
+            cache = StateCache(api)
+            state = SystemState.from_home_assistant(
+                api, cache=cache, config=self.controller_config
+            )
+            read_done = time.perf_counter()
+
+            if state is None:
+                self.structured_log.warning(
+                    "loop_aborted", reason="system state unavailable"
+                )
+                # Set controller_running to off if the loop fails
+                running_entity = self.publish_plan.running_entity
+                self.set_state(running_entity, state="off")
+                self.publish_filter.mark_published(running_entity, "off")
+                return
+
+            if self.signal_stats is not None:
+                self.signal_stats.update(state, self._monotonic())
+            self.handler_scheduler.run(state, cache)
+            handlers_done = time.perf_counter()
+
+            state.publish_to_ha(
+                api,
+                self.controller_config.publish_entities,
+                self.publish_filter,
+                self.publish_plan,
+            )
+            publish_done = time.perf_counter()
+            # Actions are dispatched in the background, so slow devices do not delay the
+            # loop
+            recorder = ActionRecorder(api)
+            state.execute_actions(
+                recorder,
+                cache,
+                self.write_ledger,
+                self.controller_config,
+                record_writes=False,
+            )
+            actions = recorder.batched_calls()
+            if len(actions) < len(recorder.calls):
+                self.structured_log.debug(
+                    "actions_merged", actions=len(recorder.calls), calls=len(actions)
+                )
+            self.action_executor.submit(actions, on_success=self._record_write)
+            execute_done = time.perf_counter()
+            if self.cycle_log:
+                self._append_cycle(state, execute_done - loop_start)
+
+            self.loop_metrics.record(
+                {
+                    "read_state": read_done - loop_start,
+                    "handlers": handlers_done - read_done,
+                    "publish": publish_done - handlers_done,
+                    "execute": execute_done - publish_done,
+                    "total": execute_done - loop_start,
+                },
+                api.calls,
+            )
+            self.loop_metrics.publish(
+                self,
+                self.controller_config.publish_entities,
+                self.publish_filter,
+                self.loop_guard.summary(),
+            )
 
-        for handler in self.device_handlers:
-            handler.evaluate_and_act(state)
+            self.structured_log.debug(
+                "loop_finished",
+                ms=round((execute_done - loop_start) * 1000, 1),
+                ha_calls=api.calls,
+                actions=len(actions),
+                cache_hits=cache.hits,
+                cache_reads=cache.misses,
+            )
+        finally:
+            follow_up = self.loop_guard.exit()
+            if self.loop_guard.overruns > overruns:
+                self.structured_log.warning(
+                    "loop_overrun",
+                    budget_seconds=self.loop_guard.budget_seconds,
+                    interval_seconds=round(self.loop_guard.effective_interval),
+                )
+            if follow_up:
+                self.run_in(self.control_loop, self.loop_guard.seconds_until_due())
 
-        state.publish_to_ha(self, self.args["publish_entities"])
-        state.execute_actions(self)
+    def _append_cycle(self, state, duration=None):
+        """
+        Appends the cycle to the cycle log. A failing disk must not stop the control
+        loop.
+        """
+        try:
+            self.cycle_log.append(state, duration)
+        except (OSError, ValueError, struct.error) as e:
+            self.structured_log.error("cycle_log_failed", error=e)
 
-        self.log("Control loop finished.")
+    def terminate(self):
+        """
+        Stops the action executor and closes the cycle log when AppDaemon stops the app.
+        """
+        if hasattr(self, "action_executor"):
+            self.action_executor.shutdown()
+        if getattr(self, "cycle_log", None):
+            self.cycle_log.close()
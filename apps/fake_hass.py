@@ -0,0 +1,212 @@
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from controller_config import LoggingConfig
+from structured_log import create_structured_log
+
+# Hass API methods that an app created with `FakeHass.create_app` gets from the fake
+API_METHODS = [
+    "get_state",
+    "set_state",
+    "turn_on",
+    "turn_off",
+    "call_service",
+    "log",
+    "error",
+    "run_every",
+    "run_in",
+    "listen_state",
+    "cancel_timer",
+]
+
+
+class FakeHass:
+    """
+    An in-memory stand-in for the parts of the AppDaemon Hass API used by the
+    controller.
+
+    States are held as full state dictionaries like AppDaemon's, every API call is
+    counted, and switch and state writes are applied to the in-memory states and
+    recorded as actions. Time is taken from `now`, so it can be driven by a replay or
+    simulation.
+    """
+
+    def __init__(self, args, now=None, latency=0.0, record_actions=True):
+        """
+        Initializes the fake.
+        Args:
+            args: The app arguments, as they would be loaded from apps.yaml.
+            now: The initial aware datetime. Defaults to the current time.
+            latency: Seconds to sleep in every API call, to emulate a remote Home
+                Assistant.
+            record_actions: Keep a list of all actions. Counts per action and entity are
+                always kept.
+        """
+        self.args = args
+        self.now = now or datetime.now(timezone.utc)
+        self.latency = latency
+        self.record_actions = record_actions
+        self.states = {}
+        self.call_counts = Counter()
+        self.action_counts = Counter()
+        self.actions = []
+        self.timers = []
+        self.listeners = []
+        self._entity_listeners = {}
+        # Handlers and SystemState log through it, with deduplication in the fake's time
+        self.structured_log = create_structured_log(
+            self,
+            LoggingConfig.from_dict(args.get("logging")),
+            clock=lambda: self.now.timestamp(),
+        )
+
+    def create_app(self, app_class):
+        """
+        Creates an instance of an AppDaemon app class whose Hass API calls are served by
+        this fake.
+        Args:
+            app_class: The app class, e.g. EnergyController.
+        Returns:
+            The app instance. `initialize` has not been called yet. Its `clock` is the
+                fake's clock.
+        """
+        app = app_class.__new__(app_class)
+        app.args = self.args
+        app.clock = self.clock
+        for name in API_METHODS:
+            setattr(app, name, getattr(self, name))
+        return app
+
+    def clock(self):
+        """Returns the current (possibly simulated) time."""
+        return self.now
+
+    def set_entity(self, entity_id, state, attributes=None):
+        """
+        Sets an entity state directly, as an integration would, without counting an API
+        call. State listeners of the entity are called if the state changed.
+        """
+        full_state = self.states.get(entity_id)
+        if full_state is None:
+            full_state = {"state": None, "attributes": {}, "last_changed": self.now}
+            self.states[entity_id] = full_state
+        old_state = full_state["state"]
+        if old_state != state:
+            full_state["last_changed"] = self.now
+        full_state["state"] = state
+        if attributes is not None:
+            full_state["attributes"] = attributes
+        if old_state != state and entity_id in self._entity_listeners:
+            for callback, kwargs in self._entity_listeners[entity_id]:
+                callback(entity_id, "state", old_state, state, kwargs)
+
+    def _call(self, method):
+        self.call_counts[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _record(self, method, entity_id, state):
+        self.action_counts[(method, entity_id)] += 1
+        if self.record_actions:
+            self.actions.append((self.now, method, entity_id, state))
+
+    def get_state(
+        self, entity_id=None, attribute=None, default=None, copy=True, **kwargs
+    ):
+        self._call("get_state")
+        if entity_id is None:
+            return self.states
+        full_state = self.states.get(entity_id)
+        if full_state is None:
+            return default
+        if attribute is None:
+            return full_state["state"]
+        if attribute == "all":
+            return full_state
+        if attribute in full_state["attributes"]:
+            return full_state["attributes"][attribute]
+        return full_state.get(attribute, default)
+
+    def set_state(self, entity_id, state=None, attributes=None, **kwargs):
+        self._call("set_state")
+        self.set_entity(entity_id, state, attributes)
+        self._record("set_state", entity_id, state)
+
+    def turn_on(self, entity_id, **kwargs):
+        self._call("turn_on")
+        self.set_entity(entity_id, "on")
+        self._record("turn_on", entity_id, "on")
+
+    def turn_off(self, entity_id, **kwargs):
+        self._call("turn_off")
+        self.set_entity(entity_id, "off")
+        self._record("turn_off", entity_id, "off")
+
+    def call_service(self, service, **kwargs):
+        """
+        Handles `<domain>/turn_on` and `<domain>/turn_off` for one entity or a list of
+        entities.
+        """
+        self._call("call_service")
+        state = {"turn_on": "on", "turn_off": "off"}.get(service.split("/", 1)[1])
+        entity_ids = kwargs.get("entity_id", [])
+        for entity_id in [entity_ids] if isinstance(entity_ids, str) else entity_ids:
+            if state is not None:
+                self.set_entity(entity_id, state)
+                self._record(f"turn_{state}", entity_id, state)
+
+    def log(self, msg, *args, **kwargs):
+        pass
+
+    def error(self, msg, *args, **kwargs):
+        pass
+
+    def run_every(self, callback, start, interval, **kwargs):
+        self.timers.append((callback, interval, kwargs))
+        return len(self.timers) - 1
+
+    def run_in(self, callback, delay, **kwargs):
+        self.timers.append((callback, delay, kwargs))
+        return len(self.timers) - 1
+
+    def listen_state(self, callback, entity_id=None, **kwargs):
+        self.listeners.append((callback, entity_id, kwargs))
+        self._entity_listeners.setdefault(entity_id, []).append((callback, kwargs))
+        return len(self.listeners) - 1
+
+    def cancel_timer(self, handle):
+        pass
+
+
+def site_entities(args, name):
+    """
+    Returns the site arguments that give a site of a MultiSiteController its own copy
+    of every entity in apps.yaml, e.g. `sensor.grid_power_north` for the site `north`.
+    Args:
+        args: The app arguments from apps.yaml.
+        name: The site name.
+    """
+
+    def rename(entity_id):
+        return f"{entity_id}_{name}"
+
+    return {
+        "dry_run_switch_entity": rename(args["dry_run_switch_entity"]),
+        "sensors": {
+            key: rename(entity_id) for key, entity_id in args["sensors"].items()
+        },
+        "miner_heater": {
+            "switch_entity": rename(args["miner_heater"]["switch_entity"]),
+            "power_limit_entity": rename(args["miner_heater"]["power_limit_entity"]),
+        },
+        "chp_handler": {"switch_entity": rename(args["chp_handler"]["switch_entity"])},
+        "battery_handler": {
+            "disable_charge_switch": rename(
+                args["battery_handler"]["disable_charge_switch"]
+            )
+        },
+        "publish_entities": {
+            key: rename(entity_id)
+            for key, entity_id in args["publish_entities"].items()
+        },
+    }
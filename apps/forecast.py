@@ -0,0 +1,135 @@
+import csv
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import numpy as np
+from controller_config import ProfileConfig
+
+
+class ProfileSource:
+    """
+    A power forecast or load profile, read from a CSV file or a Home Assistant entity
+    attribute.
+
+    Files have either an `hour` column (a daily profile with one row per hour of the
+    day, in local time or the configured `time_zone`) or a `timestamp` column (ISO
+    8601), and a value column. They are read once and re-read when they change on disk.
+    Entity attributes hold either a list of numbers, one per planning step from now, or
+    a list of dictionaries with a time key and a value key, as provided by most solar
+    forecast integrations. Values are multiplied by `scale`, e.g. 1000 to convert kW to
+    W.
+    """
+
+    def __init__(self, config):
+        """
+        Initializes the source.
+        Args:
+            config: A ProfileConfig, or a dictionary with either `file` and `column`, or
+                `entity`, `attribute`, `time_key` and `value_key`, and an optional
+                `scale`.
+        Raises:
+            ConfigError: If the configuration is invalid.
+        """
+        config = ProfileConfig.from_dict(config)
+        self.file = config.file
+        self.column = config.column
+        self.entity = config.entity
+        self.attribute = config.attribute
+        self.time_key = config.time_key
+        self.value_key = config.value_key
+        self.scale = config.scale
+        self.time_zone = ZoneInfo(config.time_zone) if config.time_zone else None
+        self._file_mtime = None
+        self._hourly = None
+        self._times = None
+        self._values = None
+
+    def _load_file(self):
+        """Reads the file if it changed since the last read."""
+        mtime = os.path.getmtime(self.file)
+        if mtime == self._file_mtime:
+            return
+        with open(self.file, newline="") as f:
+            rows = list(csv.DictReader(f))
+        if rows and "hour" in rows[0]:
+            totals = np.zeros(24)
+            counts = np.zeros(24)
+            for row in rows:
+                hour = int(float(row["hour"])) % 24
+                totals[hour] += float(row[self.column])
+                counts[hour] += 1
+            self._hourly = (
+                np.divide(totals, counts, out=np.zeros(24), where=counts > 0)
+                * self.scale
+            )
+            self._times = self._values = None
+        else:
+            self._set_series(
+                [_parse_time(row["timestamp"]) for row in rows],
+                [float(row[self.column]) for row in rows],
+            )
+            self._hourly = None
+        self._file_mtime = mtime
+
+    def _set_series(self, times, values):
+        order = np.argsort(times)
+        self._times = np.asarray(times, dtype=float)[order]
+        self._values = np.asarray(values, dtype=float)[order] * self.scale
+
+    def values(self, reader, start: datetime, steps: int, step_seconds: float):
+        """
+        Returns the profile resampled onto planning steps.
+        Args:
+            reader: An object with a `get_state` method, used for entity sources.
+            start: The aware start time of the first step.
+            steps: The number of steps.
+            step_seconds: The length of one step.
+        Returns:
+            A NumPy array of `steps` values, or None if the entity provides no usable
+                data.
+        """
+        if self.file:
+            self._load_file()
+        else:
+            data = reader.get_state(self.entity, attribute=self.attribute)
+            if not data:
+                return None
+            if not isinstance(data[0], dict):
+                values = np.asarray(data[:steps], dtype=float) * self.scale
+                if len(values) < steps:
+                    # Hold the last value for steps beyond the provided data
+                    values = np.concatenate(
+                        [values, np.full(steps - len(values), values[-1])]
+                    )
+                return values
+            self._set_series(
+                [_parse_time(entry[self.time_key]) for entry in data],
+                [float(entry[self.value_key]) for entry in data],
+            )
+            self._hourly = None
+
+        offsets = np.arange(steps) * step_seconds
+        if self._hourly is not None:
+            # Household profiles are in local hours, while the planner runs in UTC
+            local_start = start.astimezone(self.time_zone)
+            start_hour = local_start.hour + local_start.minute / 60
+            return self._hourly[((start_hour + offsets / 3600) % 24).astype(int)]
+
+        if self._times is None or len(self._times) == 0:
+            return None
+        # Forward-fill: each step takes the most recent value at or before its start
+        indices = (
+            np.searchsorted(self._times, start.timestamp() + offsets, side="right") - 1
+        )
+        return self._values[np.clip(indices, 0, len(self._values) - 1)]
+
+
+def _parse_time(value):
+    """
+    Converts an ISO 8601 string or datetime into epoch seconds, assuming UTC for naive
+    times.
+    """
+    timestamp = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
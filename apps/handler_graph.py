@@ -0,0 +1,169 @@
+import time
+from operator import attrgetter
+from publish_filter import exceeds_deadband, parse_deadbands
+
+
+def _field_reader(fields):
+    """Returns a function that returns the given fields of a SystemState as a tuple."""
+    if len(fields) > 1:
+        return attrgetter(*fields)
+    if fields:
+        getter = attrgetter(fields[0])
+        return lambda state: (getter(state),)
+    return lambda state: ()
+
+
+def order_handlers(handlers):
+    """
+    Orders handlers so that every handler runs after the handlers whose outputs it
+    reads.
+
+    Handlers declare the SystemState fields they read in `INPUTS` and the intended
+    actions they set in `OUTPUTS`. A handler that sets the same output as an earlier
+    handler keeps running after it, so later handlers can override earlier decisions.
+    Otherwise the given order is kept.
+
+    Args:
+        handlers: The handlers in configuration order.
+    Returns:
+        The handlers in execution order.
+    Raises:
+        ValueError: If the dependencies form a cycle.
+    """
+    successors = {index: set() for index in range(len(handlers))}
+    for before, first in enumerate(handlers):
+        for after, second in enumerate(handlers):
+            if before == after:
+                continue
+            if set(first.OUTPUTS) & set(second.INPUTS):
+                successors[before].add(after)
+            elif after > before and set(first.OUTPUTS) & set(second.OUTPUTS):
+                successors[before].add(after)
+
+    predecessors = {index: 0 for index in successors}
+    for targets in successors.values():
+        for target in targets:
+            predecessors[target] += 1
+
+    order = []
+    ready = [index for index, count in predecessors.items() if count == 0]
+    while ready:
+        # Take the earliest configured handler that is ready, to keep the configuration
+        # order where possible
+        ready.sort()
+        index = ready.pop(0)
+        order.append(handlers[index])
+        for target in successors[index]:
+            predecessors[target] -= 1
+            if predecessors[target] == 0:
+                ready.append(target)
+
+    if len(order) < len(handlers):
+        cyclic = [
+            type(handlers[index]).__name__
+            for index, count in predecessors.items()
+            if count > 0
+        ]
+        raise ValueError(
+            f"Handler dependencies form a cycle between {', '.join(cyclic)}."
+        )
+    return order
+
+
+class HandlerScheduler:
+    """
+    Runs only the handlers whose inputs changed since their last evaluation.
+
+    A handler is evaluated if one of its `INPUTS` fields changed beyond its deadband, if
+    one of the entities in its `input_entities` changed state, or if its last evaluation
+    is older than `max_age_seconds`, which lets time-based rules such as minimum write
+    intervals and wait times make progress. Otherwise the intended actions of its last
+    evaluation are copied onto the new SystemState. Handlers that decide on derived
+    values of their inputs, e.g. a smoothed statistic, provide them with an
+    `input_values(state)` method.
+    """
+
+    def __init__(
+        self, handlers, deadbands=None, max_age_seconds=60, clock=time.monotonic
+    ):
+        """
+        Initializes the scheduler.
+        Args:
+            handlers: The handlers in configuration order.
+            deadbands: A dictionary mapping SystemState fields to DeadbandConfig
+                objects or {"absolute": x, "relative": y} dictionaries.
+            max_age_seconds: The time after which a handler is evaluated even if its
+                inputs did not change.
+            clock: A callable returning the current time in seconds.
+        """
+        self.handlers = order_handlers(handlers)
+        self.deadbands = parse_deadbands(deadbands, "handler_deadbands")
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        self.evaluated = 0
+        self.skipped = 0
+        # Per handler: (time of the last evaluation, input field values, input entity
+        # states, output values)
+        self._last = {}
+        # Per handler, in execution order: the handler, functions reading its inputs and
+        # outputs from a SystemState, and the deadbands of its inputs
+        self._plans = [
+            (
+                handler,
+                getattr(handler, "input_values", None) or _field_reader(handler.INPUTS),
+                tuple(self.deadbands.get(field) for field in handler.INPUTS),
+                _field_reader(handler.OUTPUTS),
+            )
+            for handler in self.handlers
+        ]
+
+    def _is_current(self, last, fields, entities, deadbands, now):
+        """
+        Returns whether the last evaluation of a handler is still valid for the given
+        inputs.
+        """
+        if now - last[0] >= self.max_age_seconds or entities != last[2]:
+            return False
+        last_fields = last[1]
+        if fields == last_fields:
+            return True
+        for value, last_value, deadband in zip(fields, last_fields, deadbands):
+            if exceeds_deadband(value, last_value, deadband):
+                return False
+        return True
+
+    def run(self, state, cache=None):
+        """
+        Evaluates the handlers whose inputs changed and restores the intended actions of
+        the others.
+        Args:
+            state: The current SystemState.
+            cache: An optional per-cycle StateCache, passed to the handlers and used for
+                reading input entities.
+        """
+        now = self.clock()
+        for handler, read_inputs, deadbands, read_outputs in self._plans:
+            fields = read_inputs(state)
+            input_entities = handler.input_entities
+            if input_entities:
+                reader = cache if cache is not None else handler.app
+                entities = tuple(
+                    reader.get_state(entity_id) for entity_id in input_entities
+                )
+            else:
+                entities = ()
+            last = self._last.get(id(handler))
+
+            if last is not None and self._is_current(
+                last, fields, entities, deadbands, now
+            ):
+                for field, value in zip(handler.OUTPUTS, last[3]):
+                    setattr(state, field, value)
+                self.skipped += 1
+                continue
+
+            handler.evaluate_and_act(state, cache)
+            self.evaluated += 1
+            # Inputs are compared with those of the last evaluation, so slow drifts add
+            # up until they exceed the deadband
+            self._last[id(handler)] = (now, fields, entities, read_outputs(state))
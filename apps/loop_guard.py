@@ -0,0 +1,96 @@
+import threading
+import time
+
+
+class LoopGuard:
+    """
+    Makes sure only one control loop runs at a time and adapts the loop interval to its
+    duration.
+
+    Triggers that arrive while a loop is running are coalesced into a single follow-up
+    run. A loop that takes longer than the interval budget counts as an overrun. Every
+    overrun doubles the effective interval, up to `max_backoff_factor` times the budget,
+    and every loop within the budget halves it again.
+    """
+
+    def __init__(self, budget_seconds, max_backoff_factor=4, clock=time.monotonic):
+        """
+        Initializes the guard.
+        Args:
+            budget_seconds: The nominal loop interval. Loops taking longer are overruns.
+            max_backoff_factor: The maximum ratio between the effective interval and the
+                budget.
+            clock: A callable returning monotonic seconds.
+        """
+        self.budget_seconds = budget_seconds
+        self.max_interval = budget_seconds * max_backoff_factor
+        self.effective_interval = budget_seconds
+        self.clock = clock
+        self.overruns = 0
+        self.coalesced_triggers = 0
+        self.last_started = None
+        self._lock = threading.Lock()
+        self._pending = False
+
+    def try_enter(self) -> bool:
+        """
+        Starts a loop if none is running and the effective interval has passed.
+        Returns:
+            True if the caller may run the loop. False if a loop is running, in which
+                case the trigger is
+            coalesced into a follow-up run, or if the loop is not due yet.
+        """
+        if not self._lock.acquire(blocking=False):
+            self._pending = True
+            self.coalesced_triggers += 1
+            return False
+        if not self.is_due():
+            self._lock.release()
+            return False
+        self.last_started = self.clock()
+        return True
+
+    def exit(self) -> bool:
+        """
+        Ends the running loop and adapts the effective interval to its duration.
+        Returns:
+            True if triggers were coalesced during the loop and a follow-up run is due.
+        """
+        duration = self.clock() - self.last_started
+        if duration > self.budget_seconds:
+            self.overruns += 1
+            self.effective_interval = min(
+                self.effective_interval * 2, self.max_interval
+            )
+        else:
+            self.effective_interval = max(
+                self.effective_interval / 2, self.budget_seconds
+            )
+        pending, self._pending = self._pending, False
+        self._lock.release()
+        return pending
+
+    def is_due(self) -> bool:
+        """
+        Returns whether the effective interval has passed since the last loop started,
+        allowing 10 % scheduling jitter.
+        """
+        if self.last_started is None:
+            return True
+        return self.clock() - self.last_started >= 0.9 * self.effective_interval
+
+    def seconds_until_due(self) -> float:
+        """
+        Returns the seconds until the effective interval has passed since the last loop
+        started.
+        """
+        if self.last_started is None:
+            return 0.0
+        return max(0.0, self.last_started + self.effective_interval - self.clock())
+
+    def summary(self) -> dict:
+        """Returns the counters, keyed like the publish entity keys."""
+        return {
+            "loop_overruns": self.overruns,
+            "loop_coalesced_triggers": self.coalesced_triggers,
+        }
@@ -0,0 +1,133 @@
+from array import array
+
+# Hass API methods that result in a call to Home Assistant
+COUNTED_METHODS = ("get_state", "set_state", "turn_on", "turn_off", "call_service")
+
+# Phases of one control loop, in execution order
+PHASES = ("read_state", "handlers", "publish", "execute", "total")
+
+
+class CallCounter:
+    """
+    Passes Hass API calls through to the app and counts the ones that reach Home
+    Assistant.
+    """
+
+    def __init__(self, app):
+        """
+        Initializes the counter.
+        Args:
+            app: The AppDaemon app instance.
+        """
+        self.app = app
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.app, name)
+        if name not in COUNTED_METHODS:
+            return attribute
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return attribute(*args, **kwargs)
+
+        return counted
+
+
+class RingBuffer:
+    """A fixed-size buffer of the most recent float samples."""
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self._index = 0
+        self._values = array("d", bytes(8 * size))
+
+    def append(self, value):
+        self._values[self._index] = value
+        self._index = (self._index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def values(self):
+        """Returns the buffered samples in no particular order."""
+        return self._values[: self.count]
+
+
+class LoopMetrics:
+    """
+    Keeps rolling per-phase durations and Home Assistant call counts of the control
+    loop.
+    """
+
+    def __init__(self, window=60):
+        """
+        Initializes the metrics.
+        Args:
+            window: The number of recent loops the percentiles are computed over.
+        """
+        self.durations = {phase: RingBuffer(window) for phase in PHASES}
+        self.api_calls = RingBuffer(window)
+
+    def record(self, durations: dict, api_calls: int):
+        """
+        Records one loop.
+        Args:
+            durations: A dictionary mapping phase names to durations in seconds.
+            api_calls: The number of Home Assistant calls made by the loop.
+        """
+        for phase, duration in durations.items():
+            self.durations[phase].append(duration * 1000)
+        self.api_calls.append(api_calls)
+
+    @staticmethod
+    def _percentiles(buffer, prefix):
+        values = sorted(buffer.values())
+        if not values:
+            return {}
+        last = len(values) - 1
+        return {
+            f"{prefix}_p50": values[round(0.5 * last)],
+            f"{prefix}_p95": values[round(0.95 * last)],
+            f"{prefix}_max": values[last],
+        }
+
+    def summary(self) -> dict:
+        """
+        Returns p50, p95 and max of every phase in milliseconds and of the API call
+        count. The keys are named like `loop_total_p95` and `loop_api_calls_max`,
+        matching the publish entity keys.
+        """
+        summary = {}
+        for phase, buffer in self.durations.items():
+            summary.update(self._percentiles(buffer, f"loop_{phase}"))
+        summary.update(self._percentiles(self.api_calls, "loop_api_calls"))
+        return summary
+
+    def publish(self, hass_app, publish_entities, publish_filter=None, counters=None):
+        """
+        Publishes the configured metrics to Home Assistant sensors.
+        Args:
+            hass_app: The AppDaemon app instance.
+            publish_entities: A dictionary mapping publish keys to entity IDs.
+            publish_filter: An optional PublishFilter to suppress unchanged values.
+            counters: Optional unitless values to publish along, e.g.
+                `LoopGuard.summary()`.
+        """
+        counters = counters or {}
+        for key, value in {**self.summary(), **counters}.items():
+            entity_id = publish_entities.get(key)
+            if entity_id is None:
+                continue
+            value = round(value, 1)
+            if publish_filter is not None and not publish_filter.should_publish(
+                key, entity_id, value
+            ):
+                continue
+            unit = None if key in counters or key.startswith("loop_api_calls") else "ms"
+            hass_app.set_state(
+                entity_id,
+                state=value,
+                attributes={"unit_of_measurement": unit} if unit else {},
+            )
+            if publish_filter is not None:
+                publish_filter.mark_published(entity_id, value)
@@ -2,66 +2,139 @@ import math
 from datetime import datetime, timezone
 import appdaemon.plugins.hass.hassapi as hass
 from system_state import SystemState
+from controller_config import MinerConfig
+from structured_log import get_log
+
 
 class MinerHeaterHandler:
     """A class to contain all logic for controlling the miner."""
 
-    def __init__(self, app, config):
+    # SystemState fields read and intended actions set by this handler
+    INPUTS = ("miner_surplus", "miner_power_limit")
+    OUTPUTS = ("miner_intended_switch_state", "miner_intended_power_limit")
+
+    def __init__(self, app, config, clock=None, write_ledger=None, signal_stats=None):
         """
         Initializes the handler.
         Args:
             app: The AppDaemon app instance.
-            config: The configuration dictionary for this handler.
+            config: The MinerConfig of this handler, or its `miner_heater` section as a
+                dictionary.
+            clock: An optional callable returning the current aware datetime, e.g.
+                simulated time in a replay.
+            write_ledger: An optional WriteLedger. Without it, the `last_write`
+                attribute is read from Home Assistant.
+            signal_stats: Optional SignalStats to take a smoothed miner surplus from,
+                see `surplus_statistic`.
         """
         self.app = app
-        self.config = config
-        self.entity_id = self.config.get("switch_entity")
-        self.power_limit_entity = self.config.get("power_limit_entity")
-        self.activation_threshold = self.config.get("activation_threshold", 2000)
-        self.max_power = self.config.get("max_power", 6000)
-        self.power_step = self.config.get("power_step", 1000)
-        self.min_write_interval_seconds = self.config.get("min_write_interval_seconds", 60)
+        self.log = get_log(app)
+        self.config = MinerConfig.from_dict(config)
+        self.clock = clock
+        self.write_ledger = write_ledger
+        self.signal_stats = signal_stats
+        self.entity_id = self.config.switch_entity
+        self.power_limit_entity = self.config.power_limit_entity
+        self.activation_threshold = self.config.activation_threshold
+        self.max_power = self.config.max_power
+        self.power_step = self.config.power_step
+        self.min_write_interval_seconds = self.config.min_write_interval_seconds
+        # The statistic of the miner surplus the decisions are based on, e.g. "ewma" or
+        # "min" to avoid flapping
+        self.surplus_statistic = self.config.surplus_statistic
+        # Entities whose state changes require a new evaluation
+        self.input_entities = ()
+
+    def _now(self):
+        """Returns the current time from the configured clock, or the wall clock."""
+        return self.clock() if self.clock else datetime.now(timezone.utc)
+
+    def _seconds_since_last_write(self, reader):
+        """
+        Returns the seconds since the last power limit write, or None if there was none.
+        """
+        if self.write_ledger is not None:
+            return self.write_ledger.seconds_since_write(self.power_limit_entity)
+        power_limit_entity_state = (
+            reader.get_state(self.power_limit_entity, attribute="all") or {}
+        )
+        last_write_str = power_limit_entity_state.get("attributes", {}).get(
+            "last_write"
+        )
+        if last_write_str is None:
+            return None
+        return (self._now() - datetime.fromisoformat(last_write_str)).total_seconds()
 
-    def evaluate_and_act(self, state: SystemState):
+    def _surplus(self, state: SystemState):
         """
-        Main decision-making method to control the miner.
-        This method calculates the intended state and stores it in the SystemState object.
+        Returns the miner surplus the decisions are based on: the configured statistic,
+        or the latest value.
+        """
+        if self.signal_stats is not None and self.surplus_statistic != "last":
+            smoothed_surplus = self.signal_stats.value(
+                "miner_surplus", self.surplus_statistic
+            )
+            if smoothed_surplus is not None:
+                return smoothed_surplus
+        return state.miner_surplus
+
+    def input_values(self, state: SystemState) -> tuple:
+        """
+        Returns the values of `INPUTS` as the handler uses them, for the
+        HandlerScheduler's change detection. With a smoothed `surplus_statistic`, the
+        statistic can cross the activation threshold while the latest value does not
+        move.
+        """
+        return (self._surplus(state), state.miner_power_limit)
+
+    def evaluate_and_act(self, state: SystemState, cache=None):
+        """
+        Main decision-making method to control the miner. This method calculates the
+        intended state and stores it in the SystemState object.
         Args:
             state: The current system state.
+            cache: An optional per-cycle StateCache used for reading entity states.
         """
-        is_on = self.app.get_state(self.entity_id) == "on"
+        reader = cache if cache is not None else self.app
+        is_on = reader.get_state(self.entity_id) == "on"
 
-        adjusted_surplus = state.miner_surplus
+        adjusted_surplus = self._surplus(state)
 
         if adjusted_surplus >= self.activation_threshold:
             # We want the miner to be on.
-            state.miner_intended_switch_state = 'on'
+            state.miner_intended_switch_state = "on"
 
-            # Only adjust power limit if the surplus is significantly different from the current limit
+            # Only adjust power limit if the surplus is significantly different from the
+            # current limit
             if abs(adjusted_surplus - state.miner_power_limit) >= self.power_step:
                 # Calculate new power limit
-                new_power_limit = min(self.max_power, self.activation_threshold + self.power_step * math.floor((adjusted_surplus - self.activation_threshold) / self.power_step))
+                new_power_limit = min(
+                    self.max_power,
+                    self.activation_threshold
+                    + self.power_step
+                    * math.floor(
+                        (adjusted_surplus - self.activation_threshold) / self.power_step
+                    ),
+                )
 
                 if new_power_limit != state.miner_power_limit:
                     # Check if we are allowed to write based on the interval
-                    power_limit_entity_state = self.app.get_state(self.power_limit_entity, attribute="all") or {}
-                    last_write_str = power_limit_entity_state.get("attributes", {}).get("last_write")
-
-                    can_write = False
-                    if last_write_str is None:
-                        can_write = True
-                    else:
-                        last_write_dt = datetime.fromisoformat(last_write_str)
-                        time_since_last_write = (datetime.now(timezone.utc) - last_write_dt).total_seconds()
-                        if time_since_last_write >= self.min_write_interval_seconds:
-                            can_write = True
+                    time_since_last_write = self._seconds_since_last_write(reader)
+                    can_write = (
+                        time_since_last_write is None
+                        or time_since_last_write >= self.min_write_interval_seconds
+                    )
 
                     if can_write:
                         state.miner_intended_power_limit = new_power_limit
                     else:
-                        self.app.log(f"Skipping miner power limit write for {self.power_limit_entity} due to minimum interval. New limit would be {new_power_limit}W.")
+                        self.log.info(
+                            "miner_write_skipped",
+                            entity=self.power_limit_entity,
+                            new_limit=new_power_limit,
+                            reason="min_write_interval",
+                        )
         else:
             # We want the miner to be off.
-            state.miner_intended_switch_state = 'off'
+            state.miner_intended_switch_state = "off"
             state.miner_intended_power_limit = 0
-
@@ -0,0 +1,343 @@
+import heapq
+import math
+import os
+import time
+import appdaemon.plugins.hass.hassapi as hass
+from typing import Optional
+from action_executor import ActionExecutor
+from controller_config import ConfigError, ExecutorConfig, LoggingConfig
+from energy_controller import EnergyController, WRITE_LEDGER_FILE
+from state_cache import value_from_full_state
+from structured_log import create_structured_log
+
+# Fractional part of the golden ratio. Offsets that are multiples of it spread any
+# number of loops evenly over an interval.
+_GOLDEN_FRACTION = (math.sqrt(5) - 1) / 2
+
+
+def _site_path(path, name):
+    """Returns the file of a site, e.g. `ledger_north.json` for `ledger.json`."""
+    root, extension = os.path.splitext(path)
+    return f"{root}_{name}{extension}"
+
+
+def site_args(name, defaults, overrides):
+    """
+    Builds the app arguments of one site from the shared defaults and the site's own
+    arguments. Sections given in both are merged key by key. Files named in the defaults
+    would be shared by all sites, so each site gets its own write ledger and cycle log
+    directory unless it names them itself. A `write_ledger_path` of null in the defaults
+    keeps every site's ledger in memory, and without one each site keeps its ledger in
+    AppDaemon's configuration directory.
+    Args:
+        name: The site name.
+        defaults: The `site_defaults` section.
+        overrides: The site's section under `sites`.
+    Returns:
+        The site's app arguments.
+    """
+    overrides = overrides or {}
+    args = dict(defaults)
+    for key, value in overrides.items():
+        default = args.get(key)
+        args[key] = (
+            {**default, **value}
+            if isinstance(default, dict) and isinstance(value, dict)
+            else value
+        )
+
+    ledger_path = defaults.get("write_ledger_path")
+    if "write_ledger_path" not in overrides and ledger_path is not None:
+        args["write_ledger_path"] = _site_path(ledger_path, name)
+    if defaults.get("cycle_log_dir") and "cycle_log_dir" not in overrides:
+        args["cycle_log_dir"] = os.path.join(defaults["cycle_log_dir"], name)
+    return args
+
+
+class StaggeredScheduler:
+    """
+    Runs the periodic loops of many sites from one timer.
+
+    Each loop gets a fixed phase within its interval, so the loops of many sites are
+    spread over the interval instead of all running at the same moment. The phases are
+    multiples of the golden ratio, which keeps them evenly spread however many loops are
+    added. A loop that fell behind skips its missed runs.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        Initializes an empty scheduler.
+        Args:
+            clock: A callable returning monotonic seconds.
+        """
+        self.clock = clock
+        self._queue = []
+        self._count = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, callback, interval, name=None):
+        """
+        Adds a periodic loop. Its first run is due within one interval from now.
+        Args:
+            callback: The loop callback. It is called with AppDaemon's `kwargs`
+                argument, here None.
+            interval: The interval between runs in seconds.
+            name: An optional name reported with the callback, e.g. the site name.
+        """
+        offset = (self._count * _GOLDEN_FRACTION) % 1.0 * interval
+        heapq.heappush(
+            self._queue, (self.clock() + offset, self._count, interval, name, callback)
+        )
+        self._count += 1
+
+    def next_due(self) -> Optional[float]:
+        """Returns the time the next loop is due, or None if no loop was added."""
+        return self._queue[0][0] if self._queue else None
+
+    def pop_due(self, now=None) -> list:
+        """
+        Returns the loops due at `now` and schedules their next runs.
+        Args:
+            now: The current monotonic time. Read from the clock if not given.
+        Returns:
+            A list of (name, callback) tuples in the order they became due.
+        """
+        now = self.clock() if now is None else now
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            due_time, order, interval, name, callback = heapq.heappop(self._queue)
+            due.append((name, callback))
+            # Keep the phase, skipping the runs that were missed
+            due_time += (math.floor((now - due_time) / interval) + 1) * interval
+            heapq.heappush(self._queue, (due_time, order, interval, name, callback))
+        return due
+
+
+class SharedStateCache:
+    """
+    Entity states shared by all sites of a MultiSiteController.
+
+    The whole namespace is read with one bulk `get_state` call, at most once per
+    `max_age_seconds`, and all sites read from it. The number of Home Assistant reads
+    does not grow with the number of sites.
+    """
+
+    def __init__(self, app, max_age_seconds=1.0, clock=time.monotonic):
+        """
+        Initializes the cache. Nothing is read until the first request.
+        Args:
+            app: The AppDaemon app instance the states are read from.
+            max_age_seconds: The age after which a request reads the states again.
+            clock: A callable returning monotonic seconds.
+        """
+        self.app = app
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        self.refreshes = 0
+        self._states = None
+        self._refreshed = None
+
+    def refresh(self):
+        """Reads all entity states with one bulk call, without copying them."""
+        self._states = self.app.get_state(copy=False) or {}
+        self._refreshed = self.clock()
+        self.refreshes += 1
+
+    def get_state(
+        self, entity_id=None, attribute=None, default=None, copy=True, **kwargs
+    ):
+        """
+        Returns a state the same way AppDaemon's `get_state` does. The returned values
+        are shared and must not be modified.
+        Args:
+            entity_id: The entity to read, or None for the states of all entities.
+            attribute: An optional attribute name, or "all" for the full state
+                dictionary.
+            default: The value returned for unknown entities and attributes.
+            copy: Ignored. States are never copied.
+        """
+        if (
+            self._states is None
+            or self.clock() - self._refreshed > self.max_age_seconds
+        ):
+            self.refresh()
+        if entity_id is None:
+            return self._states
+        full_state = self._states.get(entity_id)
+        if full_state is None:
+            return default
+        value = value_from_full_state(full_state, attribute)
+        return default if value is None else value
+
+
+class SiteController(EnergyController):
+    """
+    An EnergyController hosted by a MultiSiteController instead of being an AppDaemon
+    app of its own.
+
+    It keeps its own configuration, SystemState, handlers, write ledger and loop guard,
+    so sites do not affect each other's decisions. Reads are served from the host's
+    SharedStateCache, actions go through the host's ActionExecutor, and its control loop
+    is run by the host's StaggeredScheduler. All other Hass API calls are passed to the
+    host, with log messages prefixed by the site name.
+    """
+
+    def __init__(self, host, site_name, args):
+        """
+        Creates a site. Call `initialize` to start it.
+        Args:
+            host: The MultiSiteController hosting the site.
+            site_name: The name of the site, used in log messages.
+            args: The site's app arguments, see `site_args`.
+        """
+        self.host = host
+        self.site_name = site_name
+        self.args = args
+        self.clock = host.clock
+
+    def get_state(
+        self, entity_id=None, attribute=None, default=None, copy=True, **kwargs
+    ):
+        return self.host.shared_states.get_state(
+            entity_id, attribute=attribute, default=default
+        )
+
+    def set_state(self, entity_id, **kwargs):
+        return self.host.set_state(entity_id, **kwargs)
+
+    def turn_on(self, entity_id, **kwargs):
+        return self.host.turn_on(entity_id, **kwargs)
+
+    def turn_off(self, entity_id, **kwargs):
+        return self.host.turn_off(entity_id, **kwargs)
+
+    def call_service(self, service, **kwargs):
+        return self.host.call_service(service, **kwargs)
+
+    def log(self, msg, *args, **kwargs):
+        self.host.log(f"{self.site_name}: {msg}", *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.host.error(f"{self.site_name}: {msg}", *args, **kwargs)
+
+    def run_every(self, callback, start, interval, **kwargs):
+        return self.host.run_every(callback, start, interval, **kwargs)
+
+    def run_in(self, callback, delay, **kwargs):
+        return self.host.run_in(callback, delay, **kwargs)
+
+    def listen_state(self, callback, entity_id=None, **kwargs):
+        return self.host.listen_state(callback, entity_id, **kwargs)
+
+    def cancel_timer(self, handle):
+        return self.host.cancel_timer(handle)
+
+    def _default_ledger_path(self):
+        return _site_path(
+            os.path.join(self.host.config_dir, WRITE_LEDGER_FILE), self.site_name
+        )
+
+    def _create_action_executor(self):
+        return self.host.action_executor
+
+    def _schedule_control_loop(self, interval):
+        """
+        Adds the control loop to the host's scheduler. The first loop runs at the site's
+        phase, not immediately.
+        """
+        self.host.scheduler.add(self.control_loop, interval, self.site_name)
+        self.log(f"Control loop scheduled to run every {interval} seconds.")
+
+    def terminate(self):
+        """Closes the cycle log. The shared action executor is stopped by the host."""
+        if getattr(self, "cycle_log", None):
+            self.cycle_log.close()
+
+
+class MultiSiteController(hass.Hass):
+    """
+    An AppDaemon app running the energy controllers of many sites in one process.
+
+    One timer runs the sites' control loops staggered over their interval, one bulk read
+    per tick serves the entity states of all sites, and one worker pool dispatches the
+    actions of all sites. Only the per-site state (configuration, handlers, statistics
+    and ledgers) is kept per site, so hundreds of sites fit on one host.
+    """
+
+    # An optional callable returning the current aware datetime, see
+    # EnergyController.clock
+    clock = None
+
+    def _monotonic(self):
+        """
+        Returns seconds for interval measurements, from the configured clock or the
+        monotonic clock.
+        """
+        return self.clock().timestamp() if self.clock else time.monotonic()
+
+    def initialize(self):
+        """Creates and starts the configured sites and schedules the shared timer."""
+        try:
+            logging_config = LoggingConfig.from_dict(self.args.get("logging"))
+            executor_config = ExecutorConfig.from_dict(
+                self.args.get("action_executor", {})
+            )
+        except ConfigError as e:
+            self.error(f"Aborting initialization due to invalid configuration: {e}")
+            return
+        self.structured_log = create_structured_log(
+            self, logging_config, clock=self._monotonic
+        )
+
+        tick_seconds = self.args.get("tick_seconds", 1)
+        self.shared_states = SharedStateCache(
+            self, max_age_seconds=tick_seconds, clock=self._monotonic
+        )
+        self.action_executor = ActionExecutor(
+            self,
+            max_workers=executor_config.max_workers,
+            timeout_seconds=executor_config.timeout_seconds,
+            retries=executor_config.retries,
+            backoff_seconds=executor_config.backoff_seconds,
+        )
+        self.scheduler = StaggeredScheduler(clock=self._monotonic)
+
+        defaults = self.args.get("site_defaults", {})
+        self.sites = {}
+        for name, overrides in (self.args.get("sites") or {}).items():
+            site = SiteController(self, name, site_args(name, defaults, overrides))
+            site.initialize()
+            # A site whose configuration is invalid logged why and never scheduled its
+            # loop
+            if hasattr(site, "loop_guard"):
+                self.sites[name] = site
+        self.log(
+            f"Started {len(self.sites)} of {len(self.args.get('sites') or {})} sites."
+        )
+
+        self.run_every(self.tick, "now", tick_seconds)
+
+    def tick(self, kwargs):
+        """
+        Runs the control loops that are due, after refreshing the shared entity states
+        once for all of them.
+        """
+        due = self.scheduler.pop_due(self._monotonic())
+        if not due:
+            return
+        self.shared_states.refresh()
+        for name, control_loop in due:
+            try:
+                control_loop(None)
+            except Exception as e:
+                # A failing site must not keep the other sites from running
+                self.structured_log.error("site_loop_failed", site=name, error=repr(e))
+
+    def terminate(self):
+        """Closes the sites' cycle logs and stops the shared action executor."""
+        for site in getattr(self, "sites", {}).values():
+            site.terminate()
+        if hasattr(self, "action_executor"):
+            self.action_executor.shutdown()
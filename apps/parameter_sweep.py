@@ -0,0 +1,374 @@
+"""
+Parallel parameter sweep of the handlers over recorded sensor history.
+
+Usage:
+    python apps/parameter_sweep.py history.csv --grid
+        miner_heater.activation_threshold=1500,2000,2500 \ --random
+        chp_handler.power_draw_threshold=500:2000 --samples 50
+
+Every parameter combination is replayed with ReplayEngine.run_batch in a process pool.
+The history is converted into SystemStateBatch columns once and placed in shared memory,
+which the workers map as NumPy arrays instead of receiving a copy each. Results are
+ranked by the estimated self-consumption, then the grid import cost, then the number of
+device toggles.
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+import numpy as np
+from recorder_history import read_recorder_columns, to_float
+from replay import ReplayEngine, load_app_args, read_history_csv
+from system_state_batch import FIELDS, SENSOR_KEYS, SystemStateBatch
+
+# Parameters swept when none are given, with their default grids
+DEFAULT_GRID = {
+    "miner_heater.activation_threshold": [1500, 2000, 2500],
+    "miner_heater.power_step": [500, 1000],
+    "miner_heater.min_write_interval_seconds": [60, 300],
+    "chp_handler.power_draw_threshold": [500, 1000, 1500],
+    "battery_handler.min_soc_for_chp_charging": [30, 50, 70],
+}
+
+# Columns of the shared array: the sample times, then the SystemStateBatch fields
+COLUMNS = ["time"] + FIELDS
+
+
+@dataclass(slots=True)
+class SweepResult:
+    """The metrics of one parameter combination."""
+
+    parameters: dict
+    self_consumption: float
+    grid_import_kwh: float
+    grid_import_cost: float
+    toggles: int
+    power_limit_writes: int
+    miner_energy_kwh: float
+
+    def rank_key(self):
+        """
+        Sorts by higher self-consumption, then lower import cost, then fewer toggles.
+        """
+        return (
+            -round(self.self_consumption, 4),
+            round(self.grid_import_cost, 2),
+            self.toggles,
+        )
+
+
+def grid_combinations(grid: dict) -> list:
+    """
+    Returns all combinations of a parameter grid.
+    Args:
+        grid: A dictionary mapping "section.key" paths to lists of values.
+    Returns:
+        A list of dictionaries mapping paths to values.
+    """
+    paths = list(grid)
+    return [
+        dict(zip(paths, values))
+        for values in itertools.product(*(grid[path] for path in paths))
+    ]
+
+
+def random_combinations(ranges: dict, samples: int, seed=0) -> list:
+    """
+    Returns random parameter combinations drawn uniformly from ranges.
+    Args:
+        ranges: A dictionary mapping "section.key" paths to (low, high) bounds. Integer
+            bounds draw integers.
+        samples: The number of combinations.
+        seed: The random seed, so that samples are reproducible.
+    Returns:
+        A list of dictionaries mapping paths to values.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for path, (low, high) in ranges.items():
+        if isinstance(low, int) and isinstance(high, int):
+            columns[path] = [
+                int(value) for value in rng.integers(low, high, samples, endpoint=True)
+            ]
+        else:
+            columns[path] = [float(value) for value in rng.uniform(low, high, samples)]
+    return [{path: columns[path][index] for path in ranges} for index in range(samples)]
+
+
+def apply_parameters(args: dict, parameters: dict) -> dict:
+    """Returns a copy of the app arguments with "section.key" parameters set."""
+    args = {
+        key: dict(value) if isinstance(value, dict) else value
+        for key, value in args.items()
+    }
+    for path, value in parameters.items():
+        section, key = path.split(".", 1)
+        args.setdefault(section, {})[key] = value
+    return args
+
+
+def load_history(path, sensors=None, step_seconds=60) -> tuple:
+    """
+    Reads a history CSV or recorder database into sample times and SystemStateBatch
+    columns.
+    Args:
+        path: A CSV file as read by `replay.read_history_csv`, or a recorder .db file.
+        sensors: The sensor entities of a recorder file, i.e. `args["sensors"]`.
+        step_seconds: The resampling step of a recorder file.
+    Returns:
+        A tuple of the sample times in epoch seconds and the SystemStateBatch.
+    """
+    if str(path).endswith(".db"):
+        blocks = list(read_recorder_columns(path, sensors, step_seconds=step_seconds))
+        times = np.concatenate([times for times, _ in blocks])
+        columns = {
+            key: np.concatenate([columns[key] for _, columns in blocks])
+            for key in sensors
+        }
+        return times, SystemStateBatch.from_sensor_columns(times, columns)
+
+    times = []
+    columns = {key: [] for key in SENSOR_KEYS}
+    for timestamp, values in read_history_csv(path, SENSOR_KEYS):
+        times.append(timestamp.timestamp())
+        for key in SENSOR_KEYS:
+            columns[key].append(to_float(values.get(key)))
+    times = np.asarray(times, dtype=np.float64)
+    return times, SystemStateBatch.from_sensor_columns(times, columns)
+
+
+# Per worker process: the shared memory block, the batch viewing it, and the sweep
+# settings
+_worker = {}
+
+
+def _init_worker(name, length, base_args, import_price, chp_power_w):
+    """Maps the shared history in a worker process."""
+    block = shared_memory.SharedMemory(name=name)
+    data = np.ndarray((len(COLUMNS), length), dtype=np.float64, buffer=block.buf)
+    times = data[0]
+    _worker.update(
+        block=block,
+        times=times,
+        batch=SystemStateBatch(
+            times, **{field: data[index + 1] for index, field in enumerate(FIELDS)}
+        ),
+        base_args=base_args,
+        import_price=import_price,
+        chp_power_w=chp_power_w,
+    )
+
+
+def _evaluate(parameters) -> SweepResult:
+    """Replays the shared history with one parameter combination."""
+    engine = ReplayEngine(
+        apply_parameters(_worker["base_args"], parameters),
+        chp_power_w=_worker["chp_power_w"],
+    )
+    summary = engine.run_batch(_worker["batch"], _worker["times"])
+    return SweepResult(
+        parameters=parameters,
+        self_consumption=summary.estimated_self_consumption,
+        grid_import_kwh=summary.estimated_grid_import_kwh,
+        grid_import_cost=summary.estimated_grid_import_kwh * _worker["import_price"],
+        toggles=sum(summary.switch_toggles.values()),
+        power_limit_writes=summary.power_limit_writes,
+        miner_energy_kwh=summary.miner_energy_kwh,
+    )
+
+
+def sweep(
+    args, times, batch, combinations, workers=None, import_price=0.30, chp_power_w=1500
+) -> list:
+    """
+    Replays the history with every parameter combination in a process pool.
+    Args:
+        args: The base app arguments.
+        times: The sample times in epoch seconds.
+        batch: The SystemStateBatch of the history.
+        combinations: A list of parameter dictionaries, e.g. from `grid_combinations`.
+        workers: The number of worker processes. Defaults to the number of CPUs.
+        import_price: The grid import price per kWh for the import cost.
+        chp_power_w: The CHP production assumed while the replayed CHP runs but the
+            recorded one did not.
+    Returns:
+        The SweepResults, best first.
+    """
+    length = len(times)
+    block = shared_memory.SharedMemory(
+        create=True, size=max(len(COLUMNS) * length * 8, 1)
+    )
+    try:
+        data = np.ndarray((len(COLUMNS), length), dtype=np.float64, buffer=block.buf)
+        data[0] = times
+        for index, field in enumerate(FIELDS):
+            data[index + 1] = getattr(batch, field)
+        del data
+
+        workers = min(workers or os.cpu_count() or 1, max(len(combinations), 1))
+        chunksize = max(1, len(combinations) // (workers * 4))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(block.name, length, args, import_price, chp_power_w),
+        ) as executor:
+            results = list(executor.map(_evaluate, combinations, chunksize=chunksize))
+    finally:
+        block.close()
+        block.unlink()
+    return sorted(results, key=SweepResult.rank_key)
+
+
+def _parse_assignment(text):
+    path, values = text.split("=", 1)
+    return path, values
+
+
+def _parse_number(text):
+    number = float(text)
+    return int(number) if number.is_integer() and "." not in text else number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Sweep handler parameters over recorded history in parallel."
+    )
+    parser.add_argument(
+        "history",
+        help="CSV file with a timestamp column and one column per sensor key, or a recorder .db file",
+    )
+    parser.add_argument(
+        "--step",
+        type=float,
+        default=60,
+        help="Resampling step in seconds for recorder files",
+    )
+    parser.add_argument("--config", default="apps/apps.yaml", help="Path to apps.yaml")
+    parser.add_argument(
+        "--app", default="energy_manager", help="App section in apps.yaml"
+    )
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        default=[],
+        help="Override a config value for all runs",
+    )
+    parser.add_argument(
+        "--grid",
+        action="append",
+        default=[],
+        help="Grid values of a parameter, e.g. miner_heater.power_step=500,1000",
+    )
+    parser.add_argument(
+        "--random",
+        action="append",
+        default=[],
+        help="Range of a randomly sampled parameter, e.g. chp_handler.power_draw_threshold=500:2000",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=20,
+        help="Random samples, combined with every grid combination",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--workers", type=int, help="Worker processes. Defaults to the number of CPUs"
+    )
+    parser.add_argument(
+        "--import-price", type=float, default=0.30, help="Grid import price per kWh"
+    )
+    parser.add_argument(
+        "--chp-power-w",
+        type=float,
+        default=1500,
+        help="CHP production assumed when the replay runs the CHP",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of results to print"
+    )
+    parser.add_argument("--output", help="Write all results to this CSV file")
+    options = parser.parse_args(argv)
+
+    args = load_app_args(options.config, options.app, options.overrides)
+    args.pop("dry_run_switch_entity", None)
+    grid = {
+        path: [_parse_number(value) for value in values.split(",")]
+        for path, values in map(_parse_assignment, options.grid)
+    }
+    ranges = {
+        path: tuple(_parse_number(value) for value in bounds.split(":", 1))
+        for path, bounds in map(_parse_assignment, options.random)
+    }
+    if not grid and not ranges:
+        grid = DEFAULT_GRID
+    combinations = grid_combinations(grid)
+    if ranges:
+        samples = random_combinations(ranges, options.samples, options.seed)
+        combinations = [
+            {**fixed, **sample} for fixed in combinations for sample in samples
+        ]
+
+    times, batch = load_history(options.history, args["sensors"], options.step)
+    print(
+        f"Replaying {len(times)} samples with {len(combinations)} parameter combinations."
+    )
+    results = sweep(
+        args,
+        times,
+        batch,
+        combinations,
+        options.workers,
+        options.import_price,
+        options.chp_power_w,
+    )
+
+    for rank, result in enumerate(results[: options.top], 1):
+        parameters = ", ".join(
+            f"{path}={value}" for path, value in result.parameters.items()
+        )
+        print(
+            f"{rank:3d}. self-consumption {result.self_consumption:.1%}, import cost {result.grid_import_cost:.2f}, "
+            f"{result.toggles} toggles, {result.power_limit_writes} limit writes: {parameters}"
+        )
+
+    if options.output:
+        paths = sorted({path for result in results for path in result.parameters})
+        with open(options.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "rank",
+                    *paths,
+                    "self_consumption",
+                    "grid_import_kwh",
+                    "grid_import_cost",
+                    "toggles",
+                    "power_limit_writes",
+                    "miner_energy_kwh",
+                ]
+            )
+            for rank, result in enumerate(results, 1):
+                writer.writerow(
+                    [
+                        rank,
+                        *(result.parameters.get(path) for path in paths),
+                        result.self_consumption,
+                        result.grid_import_kwh,
+                        result.grid_import_cost,
+                        result.toggles,
+                        result.power_limit_writes,
+                        result.miner_energy_kwh,
+                    ]
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
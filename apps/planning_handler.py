@@ -0,0 +1,340 @@
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import numpy as np
+from forecast import ProfileSource
+from controller_config import BatteryConfig, ChpConfig, MinerConfig, PlanningConfig
+from system_state import SystemState
+from structured_log import get_log
+
+
+@dataclass(slots=True)
+class Plan:
+    """A schedule over the planning horizon. All arrays have one entry per step."""
+
+    miner_power: np.ndarray
+    chp_on: np.ndarray
+    charge_disabled: np.ndarray
+    battery_energy: np.ndarray
+    cost: float
+    solve_seconds: float
+
+
+class PlanningHandler:
+    """
+    A receding-horizon planner for the miner power level, the CHP and the battery
+    charge-disable switch.
+
+    Every cycle it takes a solar forecast and a consumption profile over the horizon and
+    solves a dynamic program over the battery energy: for each step, all combinations of
+    miner level, CHP state and charge switch are evaluated at once with NumPy, and the
+    cheapest combination per battery level is kept. Only the first step of the plan is
+    applied; the next cycle plans again from the measured state.
+
+    The cost of a step is grid import minus grid export at their prices, plus the CHP
+    fuel cost, minus the value of the miner's heat. The battery follows
+    self-consumption: surplus charges it unless charging is disabled, and deficits
+    discharge it down to `min_soc`.
+
+    The planner runs after the reactive handlers and overrides their intended actions.
+    It respects the miner's minimum write interval and the CHP's minimum wait time.
+    """
+
+    # SystemState fields read and intended actions set by this handler
+    INPUTS = ("battery_soc",)
+    OUTPUTS = (
+        "miner_intended_switch_state",
+        "miner_intended_power_limit",
+        "chp_intended_switch_state",
+        "battery_intended_charge_switch_state",
+    )
+
+    def __init__(
+        self,
+        app,
+        config,
+        clock=None,
+        toggle_index=None,
+        write_ledger=None,
+        miner_config=None,
+        chp_config=None,
+        battery_config=None,
+    ):
+        """
+        Initializes the handler.
+        Args:
+            app: The AppDaemon app instance.
+            config: The PlanningConfig of this handler, or its `planning_handler`
+                section as a dictionary.
+            clock: An optional callable returning the current aware datetime, e.g.
+                simulated time in a replay.
+            toggle_index: An optional shared ToggleIndex used for the CHP's minimum wait
+                time.
+            write_ledger: An optional WriteLedger used for the miner's minimum write
+                interval.
+            miner_config: The MinerConfig of the miner. Without it, the miner is not
+                planned.
+            chp_config: The ChpConfig of the CHP. Without it, the CHP is not planned.
+            battery_config: The BatteryConfig of the battery. Without it, charging is
+                not planned.
+        """
+        self.app = app
+        self.log = get_log(app)
+        self.config = config = PlanningConfig.from_dict(config)
+        self.clock = clock
+        self.toggle_index = toggle_index
+        self.write_ledger = write_ledger
+
+        self.solar_forecast = ProfileSource(config.solar_forecast)
+        self.consumption_profile = ProfileSource(config.consumption_profile)
+        self.step_seconds = config.step_minutes * 60
+        self.steps = int(config.horizon_hours * 3600 // self.step_seconds)
+        self.soc_levels = config.soc_levels
+        self.cpu_budget_seconds = config.cpu_budget_ms / 1000
+
+        self.battery_capacity_wh = config.battery_capacity_wh
+        self.min_energy_wh = self.battery_capacity_wh * config.min_soc / 100
+        self.max_charge_w = config.battery_max_charge_w
+        self.max_discharge_w = config.battery_max_discharge_w
+        self.efficiency = config.battery_efficiency
+        self.import_price = config.grid_import_price
+        self.export_price = config.grid_export_price
+        self.chp_power_w = config.chp_power_w
+        self.chp_cost = config.chp_cost_per_kwh
+        self.miner_value = config.miner_value_per_kwh
+        self.terminal_value = (
+            config.battery_terminal_value_per_kwh
+            if config.battery_terminal_value_per_kwh is not None
+            else self.export_price
+        )
+
+        # Entities and limits of the controlled devices come from their handler sections
+        miner_config = MinerConfig.from_dict(miner_config)
+        chp_config = ChpConfig.from_dict(chp_config)
+        battery_config = BatteryConfig.from_dict(battery_config)
+        self.miner_switch_entity = miner_config.switch_entity
+        self.miner_power_limit_entity = miner_config.power_limit_entity
+        self.miner_min_write_interval_seconds = miner_config.min_write_interval_seconds
+        self.chp_switch_entity = chp_config.switch_entity
+        self.chp_min_wait_seconds = chp_config.min_wait_time * 60
+        self.disable_charge_switch = battery_config.disable_charge_switch
+
+        miner_levels = config.miner_levels
+        if miner_levels is None:
+            threshold = miner_config.activation_threshold
+            miner_levels = [0] + list(
+                np.arange(
+                    threshold, miner_config.max_power + 1, miner_config.power_step
+                )
+            )
+        if not self.miner_switch_entity:
+            miner_levels = [0]
+
+        # All action combinations, flattened. Lower miner levels, CHP off and charging
+        # enabled come first, so they win ties.
+        miner, chp, disabled = np.meshgrid(
+            np.asarray(miner_levels, dtype=float),
+            [0.0, 1.0] if self.chp_switch_entity else [0.0],
+            [0.0, 1.0] if self.disable_charge_switch else [0.0],
+            indexing="ij",
+        )
+        self.action_miner = miner.ravel()
+        self.action_chp = chp.ravel()
+        self.action_disabled = disabled.ravel()
+
+        # Entities whose state changes require a new evaluation
+        self.input_entities = tuple(
+            entity_id
+            for entity_id in (
+                self.solar_forecast.entity,
+                self.consumption_profile.entity,
+                self.chp_switch_entity,
+            )
+            if entity_id
+        )
+        if self.toggle_index is not None:
+            self.toggle_index.track(self.chp_switch_entity)
+        self.plan = None
+
+    def _now(self):
+        """Returns the current time from the configured clock, or the wall clock."""
+        return self.clock() if self.clock else datetime.now(timezone.utc)
+
+    def _step(self, energy, solar, consumption):
+        """
+        Evaluates all actions for one step.
+        Args:
+            energy: Battery energies in Wh, shaped (levels, 1).
+            solar: The solar production of the step in W.
+            consumption: The house consumption of the step in W.
+        Returns:
+            The cost and the battery energy after the step, both shaped (levels,
+                actions).
+        """
+        hours = self.step_seconds / 3600
+        net = (
+            solar + self.action_chp * self.chp_power_w - consumption - self.action_miner
+        )
+        surplus = np.maximum(net, 0.0) * hours
+        deficit = np.maximum(-net, 0.0) * hours
+        max_energy = self.battery_capacity_wh
+
+        charge = np.minimum(
+            np.minimum(surplus, self.max_charge_w * hours),
+            np.maximum(max_energy - energy, 0.0) / self.efficiency,
+        )
+        charge = np.where(self.action_disabled > 0, 0.0, charge)
+        discharge = np.minimum(
+            np.minimum(deficit, self.max_discharge_w * hours),
+            np.maximum(energy - self.min_energy_wh, 0.0) * self.efficiency,
+        )
+
+        next_energy = energy + charge * self.efficiency - discharge / self.efficiency
+        cost = (
+            (deficit - discharge) * self.import_price
+            - (surplus - charge) * self.export_price
+            + self.action_chp * self.chp_power_w * hours * self.chp_cost
+            - self.action_miner * hours * self.miner_value
+        ) / 1000
+        return cost, next_energy
+
+    def solve(self, battery_soc, solar, consumption) -> Plan:
+        """
+        Plans the horizon from the current battery state of charge.
+        Args:
+            battery_soc: The current state of charge in percent.
+            solar: The solar forecast in W, one value per step.
+            consumption: The consumption profile in W, one value per step.
+        Returns:
+            The optimal Plan.
+        """
+        start = time.process_time()
+        levels = np.linspace(
+            self.min_energy_wh, self.battery_capacity_wh, self.soc_levels
+        )
+        grid = levels[:, None]
+
+        # Backward pass: value[t] is the cheapest cost from step t on, per battery level
+        value = np.empty((self.steps + 1, self.soc_levels))
+        value[self.steps] = -levels / 1000 * self.terminal_value
+        for t in range(self.steps - 1, -1, -1):
+            cost, next_energy = self._step(grid, solar[t], consumption[t])
+            total = cost + np.interp(next_energy, levels, value[t + 1])
+            value[t] = total.min(axis=1)
+
+        # Forward pass from the measured battery energy, evaluated exactly rather than
+        # on the grid
+        energy = np.empty(self.steps + 1)
+        energy[0] = self.battery_capacity_wh * battery_soc / 100
+        chosen = np.empty(self.steps, dtype=int)
+        total_cost = 0.0
+        for t in range(self.steps):
+            cost, next_energy = self._step(
+                np.array([[energy[t]]]), solar[t], consumption[t]
+            )
+            total = cost[0] + np.interp(next_energy[0], levels, value[t + 1])
+            chosen[t] = np.argmin(total)
+            energy[t + 1] = next_energy[0, chosen[t]]
+            total_cost += cost[0, chosen[t]]
+
+        return Plan(
+            miner_power=self.action_miner[chosen],
+            chp_on=self.action_chp[chosen] > 0,
+            charge_disabled=self.action_disabled[chosen] > 0,
+            battery_energy=energy,
+            cost=total_cost,
+            solve_seconds=time.process_time() - start,
+        )
+
+    def _can_toggle_chp(self):
+        if self.toggle_index is None:
+            return True
+        seconds = self.toggle_index.seconds_since_change(self.chp_switch_entity)
+        return seconds is None or seconds >= self.chp_min_wait_seconds
+
+    def evaluate_and_act(self, state: SystemState, cache=None):
+        """
+        Plans the horizon and applies the first step to the intended actions.
+        Args:
+            state: The current system state.
+            cache: An optional per-cycle StateCache used for reading entity states.
+        """
+        reader = cache if cache is not None else self.app
+        now = self._now()
+        solar = self.solar_forecast.values(reader, now, self.steps, self.step_seconds)
+        consumption = self.consumption_profile.values(
+            reader, now, self.steps, self.step_seconds
+        )
+        if solar is None or consumption is None:
+            self.log.info(
+                "planning_skipped", reason="no forecast or consumption profile"
+            )
+            return
+
+        plan = self.solve(state.battery_soc, solar, consumption)
+        self.plan = plan
+        if plan.solve_seconds > self.cpu_budget_seconds and self.soc_levels > 5:
+            # Stay within the CPU budget by planning on a coarser battery grid from now
+            # on
+            self.soc_levels = max(5, self.soc_levels * 2 // 3)
+            self.log.warning(
+                "planning_over_budget",
+                solve_ms=round(plan.solve_seconds * 1000),
+                budget_ms=round(self.cpu_budget_seconds * 1000),
+                soc_levels=self.soc_levels,
+            )
+        elif (
+            plan.solve_seconds < self.cpu_budget_seconds / 3
+            and self.soc_levels < self.config.soc_levels
+        ):
+            # A single slow solve, e.g. during a GC pause, must not coarsen the grid for
+            # good. Growing by half keeps the next solve within about half of the
+            # budget.
+            self.soc_levels = min(self.config.soc_levels, self.soc_levels * 3 // 2)
+            self.log.info(
+                "planning_refined",
+                solve_ms=round(plan.solve_seconds * 1000),
+                soc_levels=self.soc_levels,
+            )
+
+        miner_power = float(plan.miner_power[0])
+        if self.miner_switch_entity:
+            state.miner_intended_switch_state = "on" if miner_power > 0 else "off"
+            if miner_power != state.miner_power_limit:
+                since_write = (
+                    self.write_ledger.seconds_since_write(self.miner_power_limit_entity)
+                    if self.write_ledger
+                    else None
+                )
+                if (
+                    since_write is None
+                    or since_write >= self.miner_min_write_interval_seconds
+                ):
+                    state.miner_intended_power_limit = miner_power
+                else:
+                    state.miner_intended_power_limit = None
+
+        if self.chp_switch_entity:
+            intended = "on" if plan.chp_on[0] else "off"
+            if (
+                reader.get_state(self.chp_switch_entity) == intended
+                or self._can_toggle_chp()
+            ):
+                state.chp_intended_switch_state = intended
+            else:
+                state.chp_intended_switch_state = None
+
+        if self.disable_charge_switch:
+            state.battery_intended_charge_switch_state = (
+                "on" if plan.charge_disabled[0] else "off"
+            )
+
+        self.log.info(
+            "plan",
+            miner_power=miner_power,
+            chp="on" if plan.chp_on[0] else "off",
+            charging="disabled" if plan.charge_disabled[0] else "enabled",
+            cost=round(float(plan.cost), 2),
+            steps=self.steps,
+            solve_ms=round(plan.solve_seconds * 1000, 1),
+        )
@@ -0,0 +1,541 @@
+"""
+Closed-loop simulation of the controlled plant, for tuning the controller faster than
+real time.
+
+Usage:
+    python apps/plant_simulator.py --days 7 --set chp_handler.power_draw_threshold=1500
+
+The simulator is a FakeHass whose sensors are driven by a plant model: PV production
+from an irradiance profile, a battery with state of charge dynamics, a CHP with a
+minimum run time, a miner that draws its power limit while switched on, and the house
+load. The real EnergyController runs against it with its own scheduling, and its switch
+and power limit writes act on the plant in the next simulation step.
+"""
+
+import argparse
+import heapq
+import math
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from controller_config import ControllerConfig
+from energy_controller import EnergyController
+from fake_hass import FakeHass
+from forecast import ProfileSource
+from replay import load_app_args
+
+
+@dataclass(slots=True)
+class PlantParameters:
+    """Physical parameters of the simulated plant."""
+
+    # PV production in W at an irradiance of 1000 W/m²
+    pv_peak_w: float = 8000
+    battery_capacity_wh: float = 10000
+    battery_max_charge_w: float = 3000
+    battery_max_discharge_w: float = 3000
+    battery_efficiency: float = 0.95
+    # The battery stops discharging at this state of charge, like an ESS minimum SOC
+    battery_min_soc: float = 10
+    initial_soc: float = 50
+    chp_power_w: float = 1500
+    # Once started, the CHP runs at least this long, even if it is switched off earlier
+    chp_min_run_minutes: float = 30
+    miner_max_power_w: float = 6000
+
+
+class ClearSkyIrradiance:
+    """
+    A daily irradiance profile in W/m²: half a sine wave between sunrise and sunset,
+    optionally dimmed by clouds that change every `cloud_minutes`. Clouds are
+    reproducible for a given seed. Provides the same `values` method as
+    forecast.ProfileSource.
+    """
+
+    def __init__(
+        self,
+        peak=1000.0,
+        sunrise_hour=6.0,
+        sunset_hour=20.0,
+        cloud_cover=0.0,
+        cloud_minutes=10,
+        seed=0,
+    ):
+        self.peak = peak
+        self.sunrise_hour = sunrise_hour
+        self.sunset_hour = sunset_hour
+        self.cloud_cover = cloud_cover
+        self.cloud_minutes = cloud_minutes
+        self.seed = seed
+
+    def values(self, reader, start, steps, step_seconds):
+        seconds = np.arange(steps) * step_seconds
+        hours = (
+            start.hour + start.minute / 60 + start.second / 3600 + seconds / 3600
+        ) % 24
+        phase = (hours - self.sunrise_hour) / (self.sunset_hour - self.sunrise_hour)
+        irradiance = self.peak * np.sin(np.pi * np.clip(phase, 0.0, 1.0))
+        if self.cloud_cover > 0:
+            blocks = (seconds // (self.cloud_minutes * 60)).astype(int)
+            dimming = (
+                np.random.default_rng(self.seed).random(blocks[-1] + 1)
+                * self.cloud_cover
+            )
+            irradiance *= 1.0 - dimming[blocks]
+        return irradiance
+
+
+class DailyLoadProfile:
+    """
+    A daily house load profile in W: a base load plus constant peaks between start and
+    end hours. Provides the same `values` method as forecast.ProfileSource.
+    """
+
+    def __init__(
+        self,
+        base_w=400.0,
+        peaks=((6.5, 8.5, 800.0), (11.5, 13.0, 1500.0), (18.0, 22.0, 1200.0)),
+    ):
+        self.base_w = base_w
+        self.peaks = peaks
+
+    def values(self, reader, start, steps, step_seconds):
+        hours = (
+            start.hour
+            + start.minute / 60
+            + start.second / 3600
+            + np.arange(steps) * step_seconds / 3600
+        ) % 24
+        load = np.full(steps, float(self.base_w))
+        for start_hour, end_hour, power in self.peaks:
+            load += np.where((hours >= start_hour) & (hours < end_hour), power, 0.0)
+        return load
+
+
+@dataclass
+class SimulationSummary:
+    """Totals of a simulation run."""
+
+    simulated_minutes: float = 0.0
+    wall_seconds: float = 0.0
+    control_loops: int = 0
+    pv_kwh: float = 0.0
+    house_kwh: float = 0.0
+    miner_kwh: float = 0.0
+    chp_kwh: float = 0.0
+    chp_starts: int = 0
+    grid_import_kwh: float = 0.0
+    grid_export_kwh: float = 0.0
+    min_soc: float = 100.0
+    max_soc: float = 0.0
+    switch_toggles: dict = field(default_factory=dict)
+    power_limit_writes: int = 0
+
+    @property
+    def self_consumption(self) -> float:
+        """The share of the PV production that was not exported."""
+        return 1.0 - self.grid_export_kwh / self.pv_kwh if self.pv_kwh else 0.0
+
+    @property
+    def minutes_per_second(self) -> float:
+        """Simulated minutes per wall clock second."""
+        return (
+            self.simulated_minutes / self.wall_seconds
+            if self.wall_seconds
+            else math.inf
+        )
+
+
+class PlantSimulator(FakeHass):
+    """
+    A FakeHass whose sensor entities follow a simulated plant, and whose timers fire in
+    simulated time.
+
+    Every step, the plant is integrated over `step_seconds` with the switch and power
+    limit states the controller last wrote, the sensors are updated, and due `run_in`
+    and `run_every` callbacks are run. Sensor states are written as strings in the units
+    Home Assistant reports, e.g. PV production in kW.
+    """
+
+    def __init__(
+        self,
+        args,
+        plant=None,
+        irradiance=None,
+        house_load=None,
+        start=None,
+        step_seconds=10,
+    ):
+        """
+        Initializes the simulator.
+        Args:
+            args: The app arguments, as loaded from apps.yaml. Entity IDs are taken from
+                them.
+            plant: The PlantParameters. Defaults to PlantParameters().
+            irradiance: An irradiance profile in W/m² with a `values(reader, start,
+                steps, step_seconds)` method, e.g. a ProfileSource. Defaults to a clear
+                sky.
+            house_load: A house load profile in W with the same method. Defaults to
+                DailyLoadProfile().
+            start: The aware start time. Defaults to midnight UTC on 2024-06-01.
+            step_seconds: The integration step of the plant.
+        """
+        super().__init__(
+            args,
+            now=start or datetime(2024, 6, 1, tzinfo=timezone.utc),
+            record_actions=False,
+        )
+        self.plant = plant or PlantParameters()
+        self.irradiance = irradiance or ClearSkyIrradiance()
+        self.house_load = house_load or DailyLoadProfile()
+        self.step_seconds = step_seconds
+        self.summary = SimulationSummary()
+
+        config = ControllerConfig.from_args(args)
+        self.sensors = config.sensors
+        miner, chp, battery = (
+            config.miner_heater,
+            config.chp_handler,
+            config.battery_handler,
+        )
+        self.miner_switch = miner.switch_entity if miner else None
+        self.power_limit_entity = miner.power_limit_entity if miner else None
+        self.chp_switch = chp.switch_entity if chp else None
+        self.disable_charge_switch = battery.disable_charge_switch if battery else None
+        self.switches = [
+            entity_id
+            for entity_id in (
+                self.miner_switch,
+                self.chp_switch,
+                self.disable_charge_switch,
+            )
+            if entity_id
+        ]
+
+        self.battery_energy_wh = (
+            self.plant.battery_capacity_wh * self.plant.initial_soc / 100
+        )
+        self.chp_running = False
+        self.chp_started = None
+
+        # Timers as a heap of (due timestamp, handle), with the callbacks by handle.
+        # Handles increase, so ties keep their order
+        self._timer_heap = []
+        self._timer_callbacks = {}
+        self._timer_sequence = 0
+
+        if config.dry_run_switch_entity:
+            self.set_entity(config.dry_run_switch_entity, "off")
+        for entity_id in self.switches:
+            self.set_entity(entity_id, "off")
+        if self.power_limit_entity:
+            self.set_entity(self.power_limit_entity, "0.0")
+        self._set_sensors(0.0, 0.0, 0.0, 0.0, 0.0)
+
+    # Timers run in simulated time
+
+    def _schedule(self, callback, due, interval, kwargs):
+        self._timer_sequence += 1
+        handle = self._timer_sequence
+        self._timer_callbacks[handle] = (callback, interval, kwargs)
+        heapq.heappush(self._timer_heap, (due, handle))
+        return handle
+
+    def run_every(self, callback, start, interval, **kwargs):
+        due = self.now if start == "now" else start
+        return self._schedule(callback, due.timestamp(), interval, kwargs)
+
+    def run_in(self, callback, delay, **kwargs):
+        return self._schedule(callback, self.now.timestamp() + delay, None, kwargs)
+
+    def cancel_timer(self, handle):
+        self._timer_callbacks.pop(handle, None)
+
+    def fire_due_timers(self, settle=None):
+        """
+        Runs the callbacks of all timers that are due at the current simulated time.
+        Args:
+            settle: An optional callable run after every callback, e.g. to wait for
+                dispatched actions.
+        """
+        now = self.now.timestamp()
+        while self._timer_heap and self._timer_heap[0][0] <= now:
+            due, handle = heapq.heappop(self._timer_heap)
+            timer = self._timer_callbacks.pop(handle, None)
+            if timer is None:
+                continue
+            callback, interval, kwargs = timer
+            if interval is not None:
+                self._timer_callbacks[handle] = timer
+                heapq.heappush(self._timer_heap, (due + interval, handle))
+            callback(kwargs)
+            if settle is not None:
+                settle()
+
+    # Plant model
+
+    def _set_sensors(self, grid_power, battery_power, pv_w, miner_w, chp_w):
+        sensors = self.sensors
+        self.set_entity(sensors.grid_power, f"{grid_power:.0f}")
+        self.set_entity(
+            sensors.battery_soc,
+            f"{self.battery_energy_wh / self.plant.battery_capacity_wh * 100:.1f}",
+        )
+        self.set_entity(sensors.battery_power, f"{battery_power:.0f}")
+        self.set_entity(sensors.solar_production, f"{pv_w / 1000:.3f}")
+        self.set_entity(sensors.miner_consumption, f"{miner_w:.0f}")
+        self.set_entity(sensors.chp_production, f"{chp_w:.0f}")
+
+    def _is_on(self, entity_id):
+        return entity_id is not None and self.states[entity_id]["state"] == "on"
+
+    def step(self, irradiance, house_w):
+        """
+        Integrates the plant over one step with the current actuator states, then
+        updates the sensors.
+        Args:
+            irradiance: The irradiance during the step in W/m².
+            house_w: The house load during the step in W.
+        """
+        plant = self.plant
+        summary = self.summary
+        hours = self.step_seconds / 3600
+        now = self.now.timestamp()
+
+        pv_w = plant.pv_peak_w * max(irradiance, 0.0) / 1000
+
+        miner_w = 0.0
+        if self._is_on(self.miner_switch):
+            limit = (
+                self.states[self.power_limit_entity]["state"]
+                if self.power_limit_entity
+                else None
+            )
+            miner_w = (
+                min(float(limit), plant.miner_max_power_w)
+                if limit not in (None, "unknown", "unavailable")
+                else plant.miner_max_power_w
+            )
+
+        chp_commanded = self._is_on(self.chp_switch)
+        if chp_commanded and not self.chp_running:
+            self.chp_running = True
+            self.chp_started = now
+            summary.chp_starts += 1
+        elif (
+            not chp_commanded
+            and self.chp_running
+            and now - self.chp_started >= plant.chp_min_run_minutes * 60
+        ):
+            self.chp_running = False
+        chp_w = plant.chp_power_w if self.chp_running else 0.0
+
+        # Self-consumption: surplus charges the battery unless charging is disabled,
+        # deficits discharge it
+        net = pv_w + chp_w - house_w - miner_w
+        efficiency = plant.battery_efficiency
+        if net >= 0:
+            room_w = (
+                (plant.battery_capacity_wh - self.battery_energy_wh)
+                / efficiency
+                / hours
+            )
+            battery_power = (
+                0.0
+                if self._is_on(self.disable_charge_switch)
+                else min(net, plant.battery_max_charge_w, room_w)
+            )
+            self.battery_energy_wh += battery_power * efficiency * hours
+        else:
+            available_w = (
+                max(
+                    self.battery_energy_wh
+                    - plant.battery_capacity_wh * plant.battery_min_soc / 100,
+                    0.0,
+                )
+                * efficiency
+                / hours
+            )
+            battery_power = -min(-net, plant.battery_max_discharge_w, available_w)
+            self.battery_energy_wh += battery_power / efficiency * hours
+        # Positive grid power is import
+        grid_power = battery_power - net
+
+        summary.pv_kwh += pv_w * hours / 1000
+        summary.house_kwh += house_w * hours / 1000
+        summary.miner_kwh += miner_w * hours / 1000
+        summary.chp_kwh += chp_w * hours / 1000
+        summary.grid_import_kwh += max(grid_power, 0.0) * hours / 1000
+        summary.grid_export_kwh += max(-grid_power, 0.0) * hours / 1000
+        soc = self.battery_energy_wh / plant.battery_capacity_wh * 100
+        summary.min_soc = min(summary.min_soc, soc)
+        summary.max_soc = max(summary.max_soc, soc)
+
+        self.now += timedelta(seconds=self.step_seconds)
+        self._set_sensors(grid_power, battery_power, pv_w, miner_w, chp_w)
+
+    def run(self, duration_seconds, settle=None) -> SimulationSummary:
+        """
+        Simulates the plant and fires the app's timers.
+        Args:
+            duration_seconds: The simulated duration.
+            settle: An optional callable run after every timer callback.
+        Returns:
+            The SimulationSummary, accumulated over all runs so far.
+        """
+        wall_start = time.perf_counter()
+        steps = int(duration_seconds // self.step_seconds)
+        irradiance = self.irradiance.values(self, self.now, steps, self.step_seconds)
+        house_load = self.house_load.values(self, self.now, steps, self.step_seconds)
+        self.fire_due_timers(settle)
+        for index in range(steps):
+            self.step(float(irradiance[index]), float(house_load[index]))
+            self.fire_due_timers(settle)
+
+        summary = self.summary
+        summary.simulated_minutes += steps * self.step_seconds / 60
+        summary.wall_seconds += time.perf_counter() - wall_start
+        summary.switch_toggles = {
+            entity_id: self.action_counts[("turn_on", entity_id)]
+            + self.action_counts[("turn_off", entity_id)]
+            for entity_id in self.switches
+        }
+        summary.power_limit_writes = self.action_counts[
+            ("set_state", self.power_limit_entity)
+        ]
+        return summary
+
+
+def simulate(args, duration_seconds, **kwargs):
+    """
+    Runs the real EnergyController closed-loop against a PlantSimulator.
+    Args:
+        args: The app arguments, as loaded from apps.yaml.
+        duration_seconds: The simulated duration.
+        **kwargs: Passed to PlantSimulator, e.g. `plant` or `irradiance`.
+    Returns:
+        A tuple of the SimulationSummary and the simulator.
+    """
+    args = dict(args)
+    # Keep the write ledger in memory, so simulations do not touch the production file
+    args.setdefault("write_ledger_path", None)
+    simulator = PlantSimulator(args, **kwargs)
+    controller = simulator.create_app(EnergyController)
+    loops = 0
+
+    def settle():
+        # Actions are dispatched on worker threads; wait for them so the plant sees them
+        # in the next step
+        controller.action_executor.wait()
+
+    original_control_loop = controller.control_loop
+
+    def counted_control_loop(kwargs):
+        # Counts the loops the loop guard let through
+        nonlocal loops
+        started = controller.loop_guard.last_started
+        original_control_loop(kwargs)
+        if controller.loop_guard.last_started != started:
+            loops += 1
+
+    controller.control_loop = counted_control_loop
+
+    try:
+        controller.initialize()
+        settle()
+        summary = simulator.run(duration_seconds, settle)
+    finally:
+        controller.terminate()
+    summary.control_loops = loops
+    return summary, simulator
+
+
+def main(argv=None):
+    defaults = PlantParameters()
+    parser = argparse.ArgumentParser(
+        description="Run the energy controller closed-loop against a simulated plant."
+    )
+    parser.add_argument("--config", default="apps/apps.yaml", help="Path to apps.yaml")
+    parser.add_argument(
+        "--app", default="energy_manager", help="App section in apps.yaml"
+    )
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        default=[],
+        help="Override a config value, e.g. chp_handler.power_draw_threshold=1500",
+    )
+    parser.add_argument("--days", type=float, default=1.0, help="Simulated days")
+    parser.add_argument(
+        "--step-seconds", type=float, default=10.0, help="Integration step of the plant"
+    )
+    parser.add_argument(
+        "--irradiance",
+        help="CSV file with an irradiance profile in W/m² (an `hour` or `timestamp` column and a `value` column)",
+    )
+    parser.add_argument(
+        "--load", help="CSV file with a house load profile in W, in the same format"
+    )
+    parser.add_argument(
+        "--cloud-cover",
+        type=float,
+        default=0.0,
+        help="Maximum share of the clear-sky irradiance taken by clouds",
+    )
+    parser.add_argument(
+        "--pv-peak-w",
+        type=float,
+        default=defaults.pv_peak_w,
+        help="PV production at 1000 W/m²",
+    )
+    parser.add_argument(
+        "--initial-soc",
+        type=float,
+        default=defaults.initial_soc,
+        help="Initial battery state of charge",
+    )
+    options = parser.parse_args(argv)
+
+    args = load_app_args(options.config, options.app, options.overrides)
+    irradiance = (
+        ProfileSource({"file": options.irradiance})
+        if options.irradiance
+        else ClearSkyIrradiance(cloud_cover=options.cloud_cover)
+    )
+    house_load = ProfileSource({"file": options.load}) if options.load else None
+    plant = PlantParameters(
+        pv_peak_w=options.pv_peak_w, initial_soc=options.initial_soc
+    )
+    summary, _ = simulate(
+        args,
+        options.days * 86400,
+        plant=plant,
+        irradiance=irradiance,
+        house_load=house_load,
+        step_seconds=options.step_seconds,
+    )
+
+    print(
+        f"Simulated {summary.simulated_minutes:.0f} minutes in {summary.wall_seconds:.2f} s ({summary.minutes_per_second:.0f} minutes/s), {summary.control_loops} control loops"
+    )
+    print(
+        f"PV: {summary.pv_kwh:.1f} kWh, self-consumption {summary.self_consumption:.1%}"
+    )
+    print(
+        f"House: {summary.house_kwh:.1f} kWh, miner: {summary.miner_kwh:.1f} kWh, CHP: {summary.chp_kwh:.1f} kWh in {summary.chp_starts} starts"
+    )
+    print(
+        f"Grid import: {summary.grid_import_kwh:.1f} kWh, grid export: {summary.grid_export_kwh:.1f} kWh"
+    )
+    print(f"Battery SOC: {summary.min_soc:.1f}% to {summary.max_soc:.1f}%")
+    for entity_id, toggles in summary.switch_toggles.items():
+        print(f"Toggles of {entity_id}: {toggles}")
+    print(f"Power limit writes: {summary.power_limit_writes}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
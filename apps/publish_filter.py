@@ -0,0 +1,100 @@
+import time
+from controller_config import DeadbandConfig
+
+
+def parse_deadbands(deadbands, section="deadbands"):
+    """
+    Returns a dictionary of deadbands as DeadbandConfig objects.
+    Args:
+        deadbands: A dictionary mapping keys to DeadbandConfig objects or {"absolute":
+            x, "relative": y} dictionaries, or None.
+        section: The name of the deadbands in error messages.
+    Raises:
+        ConfigError: If a deadband is invalid.
+    """
+    return {
+        key: DeadbandConfig.from_dict(deadband, f"{section}.{key}")
+        for key, deadband in (deadbands or {}).items()
+    }
+
+
+def exceeds_deadband(value, last_value, deadband=None) -> bool:
+    """
+    Returns whether a value differs from the last one by more than a deadband.
+    Args:
+        value: The new value.
+        last_value: The previous value.
+        deadband: An optional DeadbandConfig. A relative deadband is a fraction of the
+            last value. Non-numeric values exceed it whenever they differ.
+    """
+    if value == last_value:
+        return False
+    numeric = isinstance(value, (int, float)) and isinstance(last_value, (int, float))
+    if not numeric or isinstance(value, bool) or deadband is None:
+        return True
+    threshold = max(deadband.absolute, deadband.relative * abs(last_value))
+    return abs(value - last_value) > threshold
+
+
+class PublishFilter:
+    """
+    Suppresses writes of controller sensors whose value has not changed beyond a
+    deadband.
+    """
+
+    def __init__(self, deadbands=None, heartbeat_minutes=10, clock=time.monotonic):
+        """
+        Initializes the filter.
+        Args:
+            deadbands: A dictionary mapping publish entity keys to DeadbandConfig
+                objects or {"absolute": x, "relative": y} dictionaries. A relative
+                deadband is a fraction of the last published value.
+            heartbeat_minutes: Republish an unchanged value after this many minutes.
+                None or 0 disables the heartbeat.
+            clock: A callable returning the current time in seconds.
+        """
+        self.deadbands = parse_deadbands(deadbands, "publish_deadbands")
+        self.heartbeat_seconds = heartbeat_minutes * 60 if heartbeat_minutes else None
+        self.clock = clock
+        self.published = 0
+        self.suppressed = 0
+        self._last_values = {}
+        self._last_times = {}
+
+    def should_publish(self, key, entity_id, value) -> bool:
+        """
+        Decides whether a value differs enough from the last published one to be
+        written.
+        Args:
+            key: The publish entity key, used to look up the deadband.
+            entity_id: The entity the value is published to.
+            value: The value that would be published.
+        Returns:
+            True if the value should be written to Home Assistant.
+        """
+        if entity_id not in self._last_values:
+            return True
+
+        if (
+            self.heartbeat_seconds is not None
+            and self.clock() - self._last_times[entity_id] >= self.heartbeat_seconds
+        ):
+            return True
+
+        if not exceeds_deadband(
+            value, self._last_values[entity_id], self.deadbands.get(key)
+        ):
+            self.suppressed += 1
+            return False
+        return True
+
+    def mark_published(self, entity_id, value):
+        """
+        Records a value as the last one written to an entity.
+        Args:
+            entity_id: The entity that was written.
+            value: The value that was written.
+        """
+        self._last_values[entity_id] = value
+        self._last_times[entity_id] = self.clock()
+        self.published += 1
@@ -0,0 +1,106 @@
+from structured_log import get_log
+
+
+def _format_number(value):
+    return round(value, 2) if isinstance(value, float) else value
+
+
+def _format_boolean(value):
+    return "on" if value else "off"
+
+
+def _format_text(value):
+    return value
+
+
+# SystemState attributes that can be published, with their unit and formatter, in
+# publishing order
+PUBLISHED_ATTRIBUTES = [
+    ("solar_surplus", "W", _format_number),
+    ("total_surplus", "W", _format_number),
+    ("chp_production", "W", _format_number),
+    ("battery_soc", "%", _format_number),
+    ("battery_power", "W", _format_number),
+    ("battery_charging", "W", _format_number),
+    ("battery_discharging", "W", _format_number),
+    ("grid_power", "W", _format_number),
+    ("grid_import", "W", _format_number),
+    ("grid_export", "W", _format_number),
+    ("solar_production", "W", _format_number),
+    ("miner_consumption", "W", _format_number),
+    ("miner_power_limit", "W", _format_number),
+    ("house_consumption", "W", _format_number),
+    ("miner_surplus", "W", _format_number),
+    ("is_dry_run", None, _format_boolean),
+    ("miner_intended_power_limit", "W", _format_number),
+    ("miner_intended_switch_state", None, _format_text),
+    ("battery_intended_charge_switch_state", None, _format_text),
+    ("chp_intended_switch_state", None, _format_text),
+]
+
+
+class PublishPlan:
+    """
+    The resolved list of SystemState attributes to publish, compiled once from
+    `publish_entities`.
+
+    Each entry holds the attribute name, the target entity ID, a prebuilt attributes
+    dictionary and the value formatter, so publishing a state only reads its attributes
+    and writes the changed ones.
+    """
+
+    def __init__(self, publish_entities):
+        """
+        Compiles the plan.
+        Args:
+            publish_entities: A dictionary mapping publish keys to entity IDs.
+                `controller_running` and `last_successful_run` are required.
+        """
+        self.entries = [
+            (
+                attr,
+                publish_entities[attr],
+                {"unit_of_measurement": unit} if unit else {},
+                formatter,
+            )
+            for attr, unit, formatter in PUBLISHED_ATTRIBUTES
+            if attr in publish_entities
+        ]
+        self.running_entity = publish_entities["controller_running"]
+        self.last_run_entity = publish_entities["last_successful_run"]
+
+    def publish(self, hass_app, state, publish_filter=None):
+        """
+        Publishes a SystemState to Home Assistant sensors.
+        Args:
+            hass_app: The AppDaemon app instance.
+            state: The SystemState to publish.
+            publish_filter: An optional PublishFilter. If given, only values that
+                changed beyond their deadband are written.
+        """
+        for attr, entity_id, attributes, formatter in self.entries:
+            value = getattr(state, attr)
+
+            # Skip publishing None values to avoid errors and retain previous state
+            if value is None:
+                continue
+
+            final_state = formatter(value)
+            if publish_filter is not None and not publish_filter.should_publish(
+                attr, entity_id, final_state
+            ):
+                continue
+
+            hass_app.set_state(entity_id, state=final_state, attributes=attributes)
+            if publish_filter is not None:
+                publish_filter.mark_published(entity_id, final_state)
+
+        if publish_filter is None or publish_filter.should_publish(
+            "controller_running", self.running_entity, "on"
+        ):
+            hass_app.set_state(self.running_entity, state="on")
+            if publish_filter is not None:
+                publish_filter.mark_published(self.running_entity, "on")
+        hass_app.set_state(self.last_run_entity, state=state.last_updated)
+
+        get_log(hass_app).debug("published")
@@ -0,0 +1,336 @@
+"""
+Streaming reader for the Home Assistant recorder database.
+
+Usage:
+    python apps/recorder_history.py home-assistant_v2.db --step 60 --start 2024-01-01
+        --output history.csv
+
+Reads the `states` rows of the configured sensors from a recorder SQLite file (schema of
+Home Assistant 2023.3 or later, with `last_updated_ts`) and resamples them onto a common
+time grid. Each sensor is read with its own cursor in index order and fetched in chunks,
+so memory stays bounded by the chunk and block sizes however long the history is. The
+CSV output can be passed to replay.py and parameter_sweep.py, which also read recorder
+files directly.
+"""
+
+import argparse
+import csv
+import math
+import sqlite3
+import sys
+from datetime import datetime, timezone
+import numpy as np
+from replay import load_app_args
+from system_state_batch import SENSOR_KEYS, SystemStateBatch
+
+
+class _SensorStream:
+    """
+    The state changes of one entity, fetched in chunks and sampled onto consecutive grid
+    blocks.
+
+    The recorder only writes a row when the state changes, so a state is forward-filled
+    until the next row. It becomes stale, i.e. NaN, once it is older than `max_age`
+    seconds, counted from the last time Home Assistant reported it (`last_reported_ts`,
+    where the schema has it).
+    """
+
+    def __init__(self, connection, schema, entity_id, start, end, max_age, chunk_size):
+        self.entity_id = entity_id
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        id_column, key = schema.entity_key(connection, entity_id)
+        columns = f"last_updated_ts, {schema.seen_column}, state"
+
+        # The state at the start of the grid, carried into the first block
+        row = connection.execute(
+            f"SELECT {columns} FROM states WHERE {id_column} = ? AND last_updated_ts <= ? "
+            "ORDER BY last_updated_ts DESC LIMIT 1",
+            (key, start),
+        ).fetchone()
+        self.times = np.array([row[0]] if row else [], dtype=np.float64)
+        self.seen = np.array([row[1]] if row else [], dtype=np.float64)
+        self.values = np.array([to_float(row[2])] if row else [], dtype=np.float64)
+
+        self.cursor = connection.execute(
+            f"SELECT {columns} FROM states WHERE {id_column} = ? AND last_updated_ts > ? AND last_updated_ts <= ? "
+            "ORDER BY last_updated_ts",
+            (key, start, end),
+        )
+        self.exhausted = False
+
+    def _fetch(self):
+        rows = self.cursor.fetchmany(self.chunk_size)
+        if len(rows) < self.chunk_size:
+            self.exhausted = True
+        if rows:
+            self.times = np.concatenate(
+                [
+                    self.times,
+                    np.fromiter((row[0] for row in rows), np.float64, len(rows)),
+                ]
+            )
+            self.seen = np.concatenate(
+                [
+                    self.seen,
+                    np.fromiter((row[1] for row in rows), np.float64, len(rows)),
+                ]
+            )
+            self.values = np.concatenate(
+                [
+                    self.values,
+                    np.fromiter(
+                        (to_float(row[2]) for row in rows), np.float64, len(rows)
+                    ),
+                ]
+            )
+
+    def sample(self, grid):
+        """
+        Returns the forward-filled values at the grid times and drops the rows no later
+        block needs.
+        Args:
+            grid: An ascending array of epoch seconds, after the grid of the previous
+                call.
+        Returns:
+            An array of values, with NaN for unavailable, stale or not yet recorded
+                states.
+        """
+        while not self.exhausted and (
+            len(self.times) == 0 or self.times[-1] <= grid[-1]
+        ):
+            self._fetch()
+
+        index = np.searchsorted(self.times, grid, side="right") - 1
+        recorded = index >= 0
+        index = np.maximum(index, 0)
+        values = np.full(len(grid), np.nan)
+        if len(self.times):
+            fresh = recorded & (grid - self.seen[index] <= self.max_age)
+            values[fresh] = self.values[index[fresh]]
+
+        # Keep the state in effect at the end of the block, and everything after it
+        keep = max(int(np.searchsorted(self.times, grid[-1], side="right")) - 1, 0)
+        self.times = self.times[keep:]
+        self.seen = self.seen[keep:]
+        self.values = self.values[keep:]
+        return values
+
+    def close(self):
+        self.cursor.close()
+
+
+class _Schema:
+    """
+    The recorder schema variant: entity lookup through `states_meta`, or the older
+    `entity_id` column.
+    """
+
+    def __init__(self, connection):
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(states)")}
+        if "last_updated_ts" not in columns:
+            raise ValueError(
+                "The recorder database has no `states.last_updated_ts` column. Home Assistant 2023.3 or later is required."
+            )
+        self.uses_meta = (
+            connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'states_meta'"
+            ).fetchone()
+            is not None
+        )
+        self.seen_column = (
+            "COALESCE(last_reported_ts, last_updated_ts)"
+            if "last_reported_ts" in columns
+            else "last_updated_ts"
+        )
+
+    def entity_key(self, connection, entity_id):
+        """Returns the column and value that select the rows of an entity."""
+        if not self.uses_meta:
+            return "entity_id", entity_id
+        row = connection.execute(
+            "SELECT metadata_id FROM states_meta WHERE entity_id = ?", (entity_id,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"No recorder history for {entity_id}.")
+        return "metadata_id", row[0]
+
+
+def to_float(state):
+    """
+    Converts a recorded or raw sensor state to a float, with NaN for unavailable or
+    non-numeric states.
+    """
+    try:
+        return float(state)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _bounds(connection, schema, entity_ids):
+    """Returns the first state change and the last report of any of the entities."""
+    first, last = math.inf, -math.inf
+    for entity_id in entity_ids:
+        id_column, key = schema.entity_key(connection, entity_id)
+        low, high = connection.execute(
+            f"SELECT MIN(last_updated_ts), MAX({schema.seen_column}) FROM states WHERE {id_column} = ?",
+            (key,),
+        ).fetchone()
+        if low is not None:
+            first, last = min(first, low), max(last, high)
+    if first > last:
+        raise ValueError("The recorder database has no history for the sensors.")
+    return first, last
+
+
+def read_recorder_columns(
+    path,
+    sensors: dict,
+    step_seconds=60,
+    block_size=1440,
+    start=None,
+    end=None,
+    max_age_seconds=900,
+    chunk_size=10000,
+):
+    """
+    Yields the recorded sensor states resampled onto a common time grid, in fixed-size
+    blocks.
+    Args:
+        path: The recorder SQLite file, e.g. home-assistant_v2.db. It is opened
+            read-only.
+        sensors: A dictionary mapping sensor keys to entity IDs, i.e. `args["sensors"]`.
+        step_seconds: The grid step. Grid times are multiples of the step.
+        block_size: The number of grid samples per block. Only the last block may be
+            shorter.
+        start: The first grid time as an ISO 8601 string, datetime or epoch seconds.
+            Defaults to the first recorded state.
+        end: The last grid time. Defaults to the last recorded state.
+        max_age_seconds: The age in seconds after which a state is stale, or None for no
+            limit. A dictionary maps sensor keys to their own limits; sensors missing
+            from it are never stale.
+        chunk_size: The number of rows fetched from the database at a time per sensor.
+    Yields:
+        (times, columns) tuples of an array of epoch seconds and a dictionary mapping
+            sensor keys to arrays
+        of raw sensor values, with NaN where a sensor is unavailable or stale.
+    Raises:
+        ValueError: If the schema is not supported or a sensor has no history.
+    """
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    streams = {}
+    try:
+        schema = _Schema(connection)
+        start, end = _epoch(start), _epoch(end)
+        if start is None or end is None:
+            first, last = _bounds(connection, schema, sensors.values())
+            start = first if start is None else start
+            end = last if end is None else end
+        start = math.ceil(start / step_seconds) * step_seconds
+
+        for key, entity_id in sensors.items():
+            max_age = (
+                max_age_seconds.get(key, math.inf)
+                if isinstance(max_age_seconds, dict)
+                else max_age_seconds
+            )
+            streams[key] = _SensorStream(
+                connection,
+                schema,
+                entity_id,
+                start,
+                end,
+                math.inf if max_age is None else max_age,
+                chunk_size,
+            )
+
+        samples = int((end - start) // step_seconds) + 1 if end >= start else 0
+        for offset in range(0, samples, block_size):
+            times = start + step_seconds * np.arange(
+                offset, min(offset + block_size, samples), dtype=np.float64
+            )
+            yield times, {key: stream.sample(times) for key, stream in streams.items()}
+    finally:
+        for stream in streams.values():
+            stream.close()
+        connection.close()
+
+
+def read_recorder_batches(path, sensors: dict, **kwargs):
+    """
+    Yields the recorder history as SystemStateBatch blocks, see `read_recorder_columns`
+    for the arguments.
+
+    The batch timestamps are epoch seconds, so blocks can be passed to
+    `ReplayEngine.run_batches` as `(batch, batch.timestamps)`, or turned into
+    SystemState samples with `batch.states()`.
+    """
+    for times, columns in read_recorder_columns(path, sensors, **kwargs):
+        yield SystemStateBatch.from_sensor_columns(times, columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export Home Assistant recorder history as a resampled history CSV."
+    )
+    parser.add_argument(
+        "database", help="Recorder SQLite file, e.g. home-assistant_v2.db"
+    )
+    parser.add_argument("--config", default="apps/apps.yaml", help="Path to apps.yaml")
+    parser.add_argument(
+        "--app", default="energy_manager", help="App section in apps.yaml"
+    )
+    parser.add_argument("--step", type=float, default=60, help="Grid step in seconds")
+    parser.add_argument("--start", help="First grid time (ISO 8601)")
+    parser.add_argument("--end", help="Last grid time (ISO 8601)")
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=900,
+        help="Seconds after which a sensor state is stale",
+    )
+    parser.add_argument("--output", required=True, help="CSV file to write")
+    options = parser.parse_args(argv)
+
+    sensors = load_app_args(options.config, options.app)["sensors"]
+    keys = [key for key in SENSOR_KEYS if key in sensors]
+    rows = 0
+    with open(options.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp", *keys])
+        for times, columns in read_recorder_columns(
+            options.database,
+            {key: sensors[key] for key in keys},
+            step_seconds=options.step,
+            start=options.start,
+            end=options.end,
+            max_age_seconds=options.max_age,
+        ):
+            for index, epoch in enumerate(times):
+                values = (columns[key][index] for key in keys)
+                writer.writerow(
+                    [
+                        datetime.fromtimestamp(epoch, timezone.utc).isoformat(),
+                        *(
+                            "" if math.isnan(value) else repr(float(value))
+                            for value in values
+                        ),
+                    ]
+                )
+            rows += len(times)
+    print(f"Wrote {rows} samples to {options.output}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
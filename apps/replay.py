@@ -0,0 +1,408 @@
+"""
+Offline replay of recorded sensor history through the real device handlers.
+
+Usage:
+    python apps/replay.py history.csv --config apps/apps.yaml --set
+        miner_heater.activation_threshold=2500
+
+The history CSV has a `timestamp` column (ISO 8601) and one column per key of
+`args["sensors"]`, holding the raw sensor states as Home Assistant reports them (e.g.
+solar production in kW). A Home Assistant recorder database (.db) is streamed and
+resampled with recorder_history.py instead.
+"""
+
+import argparse
+import copy
+import csv
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import numpy as np
+import yaml
+from controller_config import ControllerConfig
+from energy_controller import (
+    create_handler_scheduler,
+    create_handlers,
+    create_signal_stats,
+)
+from fake_hass import FakeHass
+from structured_log import StructuredLog
+from system_state import SystemState
+from toggle_index import ToggleIndex
+from write_ledger import WriteLedger
+
+
+@dataclass
+class ReplaySummary:
+    """Totals of a replay run."""
+
+    ticks: int = 0
+    skipped_ticks: int = 0
+    switch_toggles: dict = field(default_factory=dict)
+    power_limit_writes: int = 0
+    miner_energy_kwh: float = 0.0
+    chp_on_hours: float = 0.0
+    grid_import_kwh: float = 0.0
+    grid_export_kwh: float = 0.0
+    solar_kwh: float = 0.0
+    # The recorded grid exchange, corrected by the difference between the replayed and
+    # the recorded miner and CHP power. Battery behaviour is taken as recorded.
+    estimated_grid_import_kwh: float = 0.0
+    estimated_grid_export_kwh: float = 0.0
+
+    @property
+    def estimated_self_consumption(self) -> float:
+        """The estimated share of the solar production that was not exported."""
+        return (
+            1.0 - self.estimated_grid_export_kwh / self.solar_kwh
+            if self.solar_kwh
+            else 0.0
+        )
+
+
+def read_history_csv(path, sensor_keys):
+    """
+    Yields time-aligned sensor rows from a history CSV file.
+    Args:
+        path: The CSV file path.
+        sensor_keys: The sensor keys to read, i.e. the keys of `args["sensors"]`.
+    Yields:
+        (timestamp, values) tuples, where values maps sensor keys to raw states.
+    """
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            timestamp = datetime.fromisoformat(row["timestamp"])
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            yield timestamp, {key: row[key] for key in sensor_keys if key in row}
+
+
+class ReplayEngine:
+    """
+    Drives the real handlers from recorded history against a FakeHass that records their
+    actions.
+
+    Every tick sets the recorded sensor states, builds a SystemState from them, runs the
+    handlers and executes their intended actions against the fake, whose clock follows
+    the recorded timestamps. Switch and power limit entities are owned by the replay, so
+    they reflect the replayed decisions. The recorded sensors are not affected by those
+    decisions; the summary only estimates their effect on the grid exchange. Use a
+    closed-loop simulation (plant_simulator.py) for the full response of the plant.
+    """
+
+    def __init__(self, args, start_states=None, chp_power_w=1500):
+        """
+        Initializes the engine.
+        Args:
+            args: The app arguments, as loaded from apps.yaml.
+            start_states: Optional initial states of the switch and power limit
+                entities. Defaults to off and 0.
+            chp_power_w: The CHP production assumed for estimates while the replayed CHP
+                runs but the recorded one did not.
+        Raises:
+            ConfigError: If the app arguments are invalid.
+        """
+        self.args = dict(args)
+        self.args.pop("dry_run_switch_entity", None)
+        self.config = ControllerConfig.from_args(self.args)
+        self.chp_power_w = chp_power_w
+        self.app = FakeHass(
+            self.args,
+            now=datetime(1970, 1, 1, tzinfo=timezone.utc),
+            record_actions=False,
+        )
+        # Replays run far more cycles than anyone reads records of, so only warnings
+        # and errors are formatted
+        self.app.structured_log = StructuredLog(
+            self.app, "WARNING", clock=lambda: self.app.now.timestamp()
+        )
+        self.toggle_index = ToggleIndex(self.app, clock=self.app.clock)
+        self.write_ledger = WriteLedger(clock=self.app.clock)
+        self.signal_stats = create_signal_stats(self.config)
+        self.handlers = create_handlers(
+            self.app,
+            self.config,
+            clock=self.app.clock,
+            toggle_index=self.toggle_index,
+            write_ledger=self.write_ledger,
+            signal_stats=self.signal_stats,
+        )
+        self.scheduler = create_handler_scheduler(
+            self.config, self.handlers, clock=lambda: self.app.clock().timestamp()
+        )
+        self.sensors = self.args["sensors"]
+
+        miner_config = self.config.miner_heater
+        battery_config = self.config.battery_handler
+        self.miner_switch = miner_config.switch_entity if miner_config else None
+        self.power_limit_entity = (
+            miner_config.power_limit_entity if miner_config else None
+        )
+        self.chp_switch = (
+            self.config.chp_handler.switch_entity if self.config.chp_handler else None
+        )
+        self.switches = [
+            entity_id
+            for entity_id in (
+                self.miner_switch,
+                self.chp_switch,
+                battery_config.disable_charge_switch if battery_config else None,
+            )
+            if entity_id
+        ]
+        for entity_id in self.switches:
+            self.app.set_entity(entity_id, "off")
+        if self.power_limit_entity:
+            self.app.set_entity(self.power_limit_entity, 0.0)
+        for entity_id, state in (start_states or {}).items():
+            self.app.set_entity(entity_id, state)
+
+    def run(self, rows) -> ReplaySummary:
+        """
+        Replays the given rows.
+        Args:
+            rows: An iterable of (timestamp, values) tuples, e.g. from
+                `read_history_csv`.
+        Returns:
+            A ReplaySummary of the run.
+        """
+        summary = ReplaySummary()
+        app = self.app
+        previous_timestamp = None
+        previous_state = None
+
+        for timestamp, values in rows:
+            if previous_timestamp is not None:
+                self._account(
+                    summary,
+                    previous_state,
+                    (timestamp - previous_timestamp).total_seconds() / 3600,
+                )
+            previous_timestamp = timestamp
+
+            app.now = timestamp
+            for key, value in values.items():
+                app.set_entity(self.sensors[key], value)
+
+            state = SystemState.from_snapshot(
+                app, app.states, now=timestamp, config=self.config
+            )
+            previous_state = state
+            summary.ticks += 1
+            if state is None:
+                summary.skipped_ticks += 1
+                continue
+
+            self._evaluate(state, timestamp)
+
+        self._finish(summary)
+        return summary
+
+    def run_batch(self, batch, times) -> ReplaySummary:
+        """
+        Replays a SystemStateBatch, skipping the conversion of raw sensor states.
+        Args:
+            batch: A SystemStateBatch with the recorded samples.
+            times: The sample times in epoch seconds.
+        Returns:
+            A ReplaySummary of the run.
+        """
+        return self.run_batches([(batch, times)])
+
+    def run_batches(self, blocks) -> ReplaySummary:
+        """
+        Replays consecutive SystemStateBatch blocks as one run.
+        Args:
+            blocks: An iterable of (batch, times) tuples, e.g. from
+                `recorder_history.read_recorder_batches`.
+        Returns:
+            A ReplaySummary of the run.
+        """
+        summary = ReplaySummary()
+        previous_time = None
+        previous_state = None
+
+        for batch, times in blocks:
+            previous_time, previous_state = self._replay_block(
+                summary, batch, times, previous_time, previous_state
+            )
+
+        self._finish(summary)
+        return summary
+
+    def _replay_block(self, summary, batch, times, previous_time, previous_state):
+        """Replays one block and returns the time and state of its last sample."""
+        app = self.app
+        # Samples with a missing sensor are skipped, like those that fail to parse in
+        # `run`
+        usable = (
+            ~(
+                np.isnan(batch.grid_power)
+                | np.isnan(batch.battery_soc)
+                | np.isnan(batch.battery_power)
+                | np.isnan(batch.solar_production)
+                | np.isnan(batch.chp_production)
+            )
+        ).tolist()
+
+        for epoch, sample_usable, state in zip(
+            np.asarray(times, dtype=float).tolist(), usable, batch.states()
+        ):
+            if previous_time is not None:
+                self._account(summary, previous_state, (epoch - previous_time) / 3600)
+            previous_time = epoch
+
+            timestamp = datetime.fromtimestamp(epoch, timezone.utc)
+            app.now = timestamp
+            summary.ticks += 1
+            if not sample_usable:
+                previous_state = None
+                summary.skipped_ticks += 1
+                continue
+
+            # The miner power limit is owned by the replay, like in `run`
+            state.miner_power_limit = self._power_limit()
+            previous_state = state
+            self._evaluate(state, timestamp)
+        return previous_time, previous_state
+
+    def _power_limit(self):
+        if not self.power_limit_entity:
+            return 0.0
+        return float(self.app.states[self.power_limit_entity]["state"])
+
+    def _evaluate(self, state, timestamp):
+        """
+        Runs the handlers on a state and applies their intended actions to the fake.
+        """
+        if self.signal_stats is not None:
+            self.signal_stats.update(state, timestamp.timestamp())
+        self.scheduler.run(state)
+        state.execute_actions(
+            self.app, write_ledger=self.write_ledger, config=self.config
+        )
+
+    def _finish(self, summary):
+        """Adds the action counts to the summary."""
+        app = self.app
+        summary.switch_toggles = {
+            entity_id: app.action_counts[("turn_on", entity_id)]
+            + app.action_counts[("turn_off", entity_id)]
+            for entity_id in self.switches
+        }
+        summary.power_limit_writes = app.action_counts[
+            ("set_state", self.power_limit_entity)
+        ]
+
+    def _account(self, summary, state, hours):
+        """Adds the energy flows of the elapsed tick to the summary."""
+        states = self.app.states
+        miner_w = 0.0
+        if (
+            self.miner_switch
+            and states[self.miner_switch]["state"] == "on"
+            and self.power_limit_entity
+        ):
+            miner_w = float(states[self.power_limit_entity]["state"])
+            summary.miner_energy_kwh += miner_w * hours / 1000
+        chp_on = self.chp_switch and states[self.chp_switch]["state"] == "on"
+        if chp_on:
+            summary.chp_on_hours += hours
+        if state is not None:
+            summary.grid_import_kwh += state.grid_import * hours / 1000
+            summary.grid_export_kwh += state.grid_export * hours / 1000
+            summary.solar_kwh += state.solar_production * hours / 1000
+
+            chp_w = (
+                (state.chp_production if state.chp_production > 0 else self.chp_power_w)
+                if chp_on
+                else 0.0
+            )
+            grid_power = (
+                state.grid_power
+                + (miner_w - state.miner_consumption)
+                - (chp_w - state.chp_production)
+            )
+            summary.estimated_grid_import_kwh += max(grid_power, 0.0) * hours / 1000
+            summary.estimated_grid_export_kwh += max(-grid_power, 0.0) * hours / 1000
+
+
+def load_app_args(config_path, app_name="energy_manager", overrides=()):
+    """
+    Loads the app arguments from an apps.yaml file.
+    Args:
+        config_path: Path to apps.yaml.
+        app_name: The app section to load.
+        overrides: "section.key=value" strings applied on top of the loaded arguments.
+    Returns:
+        The app arguments dictionary.
+    """
+    with open(config_path) as f:
+        args = copy.deepcopy(yaml.safe_load(f)[app_name])
+    for override in overrides:
+        path, value = override.split("=", 1)
+        target = args
+        *sections, key = path.split(".")
+        for section in sections:
+            target = target.setdefault(section, {})
+        target[key] = yaml.safe_load(value)
+    return args
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay recorded sensor history through the energy controller handlers."
+    )
+    parser.add_argument(
+        "history",
+        help="CSV file with a timestamp column and one column per sensor key, or a recorder .db file",
+    )
+    parser.add_argument("--config", default="apps/apps.yaml", help="Path to apps.yaml")
+    parser.add_argument(
+        "--app", default="energy_manager", help="App section in apps.yaml"
+    )
+    parser.add_argument(
+        "--set",
+        dest="overrides",
+        action="append",
+        default=[],
+        help="Override a config value, e.g. miner_heater.power_step=500",
+    )
+    parser.add_argument(
+        "--step",
+        type=float,
+        default=60,
+        help="Resampling step in seconds for recorder files",
+    )
+    options = parser.parse_args(argv)
+
+    args = load_app_args(options.config, options.app, options.overrides)
+    engine = ReplayEngine(args)
+    if options.history.endswith(".db"):
+        from recorder_history import read_recorder_batches
+
+        batches = read_recorder_batches(
+            options.history, args["sensors"], step_seconds=options.step
+        )
+        summary = engine.run_batches((batch, batch.timestamps) for batch in batches)
+    else:
+        summary = engine.run(read_history_csv(options.history, args["sensors"].keys()))
+
+    print(f"Ticks: {summary.ticks} ({summary.skipped_ticks} skipped)")
+    for entity_id, toggles in summary.switch_toggles.items():
+        print(f"Toggles of {entity_id}: {toggles}")
+    print(f"Power limit writes: {summary.power_limit_writes}")
+    print(f"Miner energy: {summary.miner_energy_kwh:.1f} kWh")
+    print(f"CHP on time: {summary.chp_on_hours:.1f} h")
+    print(
+        f"Grid import: {summary.grid_import_kwh:.1f} kWh, grid export: {summary.grid_export_kwh:.1f} kWh"
+    )
+    print(
+        f"Estimated with the replayed decisions: grid import {summary.estimated_grid_import_kwh:.1f} kWh, "
+        f"grid export {summary.estimated_grid_export_kwh:.1f} kWh, self-consumption {summary.estimated_self_consumption:.1%}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
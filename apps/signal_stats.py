@@ -0,0 +1,220 @@
+import math
+from array import array
+from typing import Optional
+
+# SystemState fields tracked when no fields are configured
+DEFAULT_FIELDS = (
+    "miner_surplus",
+    "total_surplus",
+    "solar_surplus",
+    "grid_power",
+    "battery_soc",
+)
+
+# Statistics a handler can ask for
+STATISTICS = ("last", "ewma", "mean", "min", "max", "slope")
+
+
+class RollingWindow:
+    """
+    Rolling statistics over the most recent samples of one signal, with constant-time
+    updates.
+
+    Values and timestamps live in preallocated ring buffers. The window minimum and
+    maximum are kept in monotonic queues of sample numbers, which are ring buffers of
+    the same size. Mean and slope come from running sums, which are recomputed from the
+    buffer once per window to stop floating point drift. The EWMA is time-aware, so
+    irregular sampling intervals are weighted correctly.
+    """
+
+    def __init__(self, size, ewma_seconds=300.0):
+        """
+        Initializes an empty window.
+        Args:
+            size: The number of samples in the window.
+            ewma_seconds: The time constant of the exponentially weighted moving
+                average.
+        """
+        self.size = size
+        self.ewma_seconds = ewma_seconds
+        self.count = 0
+        self._values = array("d", bytes(8 * size))
+        self._times = array("d", bytes(8 * size))
+        self._min_queue = array("q", bytes(8 * size))
+        self._max_queue = array("q", bytes(8 * size))
+        self._min_head = self._min_tail = 0
+        self._max_head = self._max_tail = 0
+        # Running sums of y, x, x*x and x*y with x = time - _origin
+        self._origin = None
+        self._sum_y = self._sum_x = self._sum_xx = self._sum_xy = 0.0
+        self._ewma = None
+        self._last_time = None
+
+    def push(self, value, timestamp):
+        """
+        Adds a sample.
+        Args:
+            value: The sample value.
+            timestamp: The sample time in seconds, e.g. from `time.monotonic()`.
+        """
+        size = self.size
+        sequence = self.count
+        index = sequence % size
+        if self._origin is None:
+            self._origin = timestamp
+
+        if sequence >= size:
+            self._add_to_sums(self._values[index], self._times[index], -1.0)
+        self._values[index] = value
+        self._times[index] = timestamp
+        self._add_to_sums(value, timestamp, 1.0)
+
+        # Drop samples that left the window, then those that can no longer be the
+        # minimum or maximum
+        oldest = sequence - size
+        while (
+            self._min_head < self._min_tail
+            and self._min_queue[self._min_head % size] <= oldest
+        ):
+            self._min_head += 1
+        while (
+            self._min_head < self._min_tail
+            and self._values[self._min_queue[(self._min_tail - 1) % size] % size]
+            >= value
+        ):
+            self._min_tail -= 1
+        self._min_queue[self._min_tail % size] = sequence
+        self._min_tail += 1
+
+        while (
+            self._max_head < self._max_tail
+            and self._max_queue[self._max_head % size] <= oldest
+        ):
+            self._max_head += 1
+        while (
+            self._max_head < self._max_tail
+            and self._values[self._max_queue[(self._max_tail - 1) % size] % size]
+            <= value
+        ):
+            self._max_tail -= 1
+        self._max_queue[self._max_tail % size] = sequence
+        self._max_tail += 1
+
+        if self._ewma is None:
+            self._ewma = value
+        else:
+            alpha = 1.0 - math.exp(
+                -max(timestamp - self._last_time, 0.0) / self.ewma_seconds
+            )
+            self._ewma += alpha * (value - self._ewma)
+        self._last_time = timestamp
+
+        self.count += 1
+        if index == size - 1:
+            self._recompute_sums()
+
+    def _add_to_sums(self, value, timestamp, sign):
+        x = timestamp - self._origin
+        self._sum_y += sign * value
+        self._sum_x += sign * x
+        self._sum_xx += sign * x * x
+        self._sum_xy += sign * x * value
+
+    def _recompute_sums(self):
+        """
+        Recomputes the running sums exactly, relative to the oldest sample in the
+        window.
+        """
+        length = min(self.count, self.size)
+        self._origin = min(self._times[:length])
+        self._sum_y = self._sum_x = self._sum_xx = self._sum_xy = 0.0
+        for index in range(length):
+            self._add_to_sums(self._values[index], self._times[index], 1.0)
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def last(self) -> Optional[float]:
+        """Returns the most recent sample."""
+        return self._values[(self.count - 1) % self.size] if self.count else None
+
+    def ewma(self) -> Optional[float]:
+        """Returns the exponentially weighted moving average."""
+        return self._ewma
+
+    def mean(self) -> Optional[float]:
+        """Returns the mean of the window."""
+        return self._sum_y / len(self) if self.count else None
+
+    def min(self) -> Optional[float]:
+        """Returns the minimum of the window."""
+        return (
+            self._values[self._min_queue[self._min_head % self.size] % self.size]
+            if self.count
+            else None
+        )
+
+    def max(self) -> Optional[float]:
+        """Returns the maximum of the window."""
+        return (
+            self._values[self._max_queue[self._max_head % self.size] % self.size]
+            if self.count
+            else None
+        )
+
+    def slope(self) -> Optional[float]:
+        """
+        Returns the least squares slope of the window in units per second, or None for
+        fewer than two distinct times.
+        """
+        n = len(self)
+        denominator = n * self._sum_xx - self._sum_x * self._sum_x
+        if n < 2 or denominator <= 1e-9 * n * self._sum_xx:
+            return None
+        return (n * self._sum_xy - self._sum_x * self._sum_y) / denominator
+
+
+class SignalStats:
+    """
+    Rolling statistics of selected SystemState fields, updated once per control loop.
+
+    Handlers ask for smoothed signals with `value(field, statistic)` instead of keeping
+    their own history. Memory is fixed by the window size and the number of fields.
+    """
+
+    def __init__(self, fields=DEFAULT_FIELDS, window=30, ewma_seconds=300.0):
+        """
+        Initializes the statistics.
+        Args:
+            fields: The SystemState fields to track.
+            window: The number of recent loops the windowed statistics cover.
+            ewma_seconds: The time constant of the moving averages.
+        """
+        self.windows = {field: RollingWindow(window, ewma_seconds) for field in fields}
+
+    def update(self, state, timestamp):
+        """
+        Adds the tracked fields of a SystemState.
+        Args:
+            state: The current SystemState.
+            timestamp: The time of the state in seconds.
+        """
+        for field, window in self.windows.items():
+            value = getattr(state, field)
+            if value is not None:
+                window.push(float(value), timestamp)
+
+    def value(self, field, statistic="ewma") -> Optional[float]:
+        """
+        Returns a statistic of a tracked field.
+        Args:
+            field: A tracked SystemState field.
+            statistic: One of `STATISTICS`.
+        Returns:
+            The statistic, or None if there are not enough samples yet.
+        """
+        if statistic not in STATISTICS:
+            raise ValueError(
+                f"Unknown statistic '{statistic}'. Expected one of {', '.join(STATISTICS)}."
+            )
+        return getattr(self.windows[field], statistic)()
@@ -0,0 +1,69 @@
+def value_from_full_state(full_state, attribute=None):
+    """
+    Extracts a value from a full state dictionary the same way AppDaemon's get_state
+    does.
+    """
+    if attribute is None:
+        return full_state.get("state")
+    if attribute == "all":
+        return full_state
+    attributes = full_state.get("attributes", {})
+    if attribute in attributes:
+        return attributes[attribute]
+    return full_state.get(attribute)
+
+
+class StateCache:
+    """A read-through cache of entity states that lives for a single control cycle."""
+
+    def __init__(self, app):
+        """
+        Initializes an empty cache.
+        Args:
+            app: The AppDaemon app instance used to read states on a cache miss.
+        """
+        self.app = app
+        self.hits = 0
+        self.misses = 0
+        self._values = {}
+        self._full_states = {}
+
+    def prime(self, snapshot: dict):
+        """
+        Seeds the cache with full entity states, e.g. from `SystemState.read_snapshot`.
+        Args:
+            snapshot: A dictionary mapping entity IDs to full state dictionaries.
+        """
+        self._full_states.update(snapshot)
+
+    def get_state(self, entity_id, attribute=None):
+        """
+        Returns the state of an entity, reading it from Home Assistant only on the first
+        request in this cycle.
+        Args:
+            entity_id: The entity to read.
+            attribute: An optional attribute name, or "all" for the full state
+                dictionary.
+        Returns:
+            The same value `app.get_state` would return.
+        """
+        key = (entity_id, attribute)
+        if key in self._values:
+            self.hits += 1
+            return self._values[key]
+
+        full_state = self._full_states.get(entity_id)
+        if full_state is not None:
+            self.hits += 1
+            value = value_from_full_state(full_state, attribute)
+        else:
+            self.misses += 1
+            if attribute is None:
+                value = self.app.get_state(entity_id)
+            else:
+                value = self.app.get_state(entity_id, attribute=attribute)
+            if attribute == "all" and isinstance(value, dict):
+                self._full_states[entity_id] = value
+
+        self._values[key] = value
+        return value
@@ -0,0 +1,183 @@
+import dataclasses
+import json
+import threading
+import time
+
+# Log levels in increasing severity, as used by AppDaemon
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+# Deduplication entries kept before expired ones are dropped
+MAX_ENTRIES = 1024
+
+# Events recording an actuator write. A repeated record is a repeated write, so they are
+# never deduplicated.
+ACTION_EVENTS = frozenset({"switch", "power_limit", "charge_switch"})
+
+
+class StructuredLog:
+    """
+    Writes log records as an event name followed by key=value fields, e.g.
+    `miner_write_skipped entity=number.miner_power_limit new_limit=4000`.
+
+    Records below the configured level return before anything is formatted, so callers
+    pass the raw values (including whole dataclasses) as fields. An identical DEBUG or
+    INFO record, i.e. the same event with the same fields, is written at most once per
+    `repeat_seconds`. Warnings, errors and the actuator writes in `ACTION_EVENTS` are
+    always written. Events listed in `rate_limits` are written at most once per their
+    interval whatever their level and fields. The next written record of a suppressed
+    event carries a `repeated` field with the number of records that were dropped in
+    between.
+    """
+
+    def __init__(
+        self,
+        app,
+        level="INFO",
+        repeat_seconds=300,
+        rate_limits=None,
+        clock=time.monotonic,
+    ):
+        """
+        Initializes the log.
+        Args:
+            app: The app whose `log` and `error` methods receive the formatted records.
+            level: The lowest level that is written: DEBUG, INFO, WARNING or ERROR.
+            repeat_seconds: The interval within which identical DEBUG and INFO records
+                are dropped. 0 writes every record.
+            rate_limits: An optional dictionary mapping event names to their minimum
+                interval in seconds.
+            clock: A callable returning monotonic seconds.
+        """
+        self.app = app
+        self.level = LEVELS[level.upper()]
+        self.repeat_seconds = repeat_seconds
+        self.rate_limits = rate_limits or {}
+        self.clock = clock
+        self.suppressed = 0
+        # Guards the deduplication entries, since the control loop and the action
+        # executor's worker threads share the log
+        self._lock = threading.Lock()
+        self._recent = {}
+
+    def enabled(self, level) -> bool:
+        """Returns whether records of a level are written."""
+        return LEVELS[level] >= self.level
+
+    def debug(self, event, **fields):
+        if self.level <= 10:
+            self._write("DEBUG", event, fields)
+
+    def info(self, event, **fields):
+        if self.level <= 20:
+            self._write("INFO", event, fields)
+
+    def warning(self, event, **fields):
+        if self.level <= 30:
+            self._write("WARNING", event, fields)
+
+    def error(self, event, **fields):
+        self._write("ERROR", event, fields)
+
+    def _write(self, level, event, fields):
+        if event in self.rate_limits:
+            interval = self.rate_limits[event]
+        elif LEVELS[level] < LEVELS["WARNING"] and event not in ACTION_EVENTS:
+            interval = self.repeat_seconds
+        else:
+            interval = 0
+        if interval > 0:
+            try:
+                key = (
+                    event
+                    if event in self.rate_limits
+                    else (event, tuple(fields.items()))
+                )
+                hash(key)
+            except TypeError:
+                # Records with unhashable fields are always written
+                key = None
+            if key is not None:
+                with self._lock:
+                    now = self.clock()
+                    entry = self._recent.get(key)
+                    if entry is not None and now - entry[0] < interval:
+                        entry[1] += 1
+                        self.suppressed += 1
+                        return
+                    if entry is not None and entry[1]:
+                        fields = {**fields, "repeated": entry[1]}
+                    if len(self._recent) >= MAX_ENTRIES:
+                        self._drop_expired(now)
+                    self._recent[key] = [now, 0]
+
+        record = format_record(event, fields)
+        if level == "ERROR":
+            self.app.error(record)
+        elif level == "INFO":
+            self.app.log(record)
+        else:
+            self.app.log(record, level=level)
+
+    def _drop_expired(self, now):
+        """Drops the expired deduplication entries. The lock must be held."""
+        longest = max([self.repeat_seconds, *self.rate_limits.values()])
+        self._recent = {
+            key: entry
+            for key, entry in self._recent.items()
+            if now - entry[0] < longest
+        }
+
+
+def create_structured_log(app, config=None, clock=time.monotonic) -> StructuredLog:
+    """
+    Creates the StructuredLog configured by a `logging` section, a LoggingConfig, or
+    with the defaults if `config` is None.
+    """
+    if config is None:
+        return StructuredLog(app, clock=clock)
+    return StructuredLog(
+        app, config.level, config.repeat_seconds, config.rate_limits, clock
+    )
+
+
+def get_log(app) -> StructuredLog:
+    """
+    Returns the StructuredLog of an app. Apps without one, e.g. in tests and offline
+    tools, get a log that writes every record of level INFO and up.
+    """
+    log = getattr(app, "structured_log", None)
+    return (
+        log if isinstance(log, StructuredLog) else StructuredLog(app, repeat_seconds=0)
+    )
+
+
+def format_record(event, fields) -> str:
+    """
+    Formats an event and its fields as `event key=value ...`. Dataclass fields are
+    flattened to `key.field=value`.
+    """
+    parts = [event]
+    for key, value in fields.items():
+        _append_field(parts, key, value)
+    return " ".join(parts)
+
+
+def _append_field(parts, key, value):
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        for field in dataclasses.fields(value):
+            _append_field(parts, f"{key}.{field.name}", getattr(value, field.name))
+        return
+    parts.append(f"{key}={_format_value(value)}")
+
+
+def _format_value(value):
+    if value is None:
+        return "none"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    text = str(value)
+    if not text or any(char in text for char in ' "='):
+        return json.dumps(text)
+    return text
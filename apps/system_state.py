@@ -1,11 +1,24 @@
 import appdaemon.plugins.hass.hassapi as hass
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Optional
+from publish_plan import PublishPlan
+from controller_config import ControllerConfig
+from structured_log import get_log
 
-@dataclass(kw_only=True)
+
+def _controller_config(app, config):
+    """
+    Returns the given ControllerConfig, or parses one from the app arguments for callers
+    that have none.
+    """
+    return config if config is not None else ControllerConfig.from_args(app.args)
+
+
+@dataclass(kw_only=True, slots=True)
 class SystemState:
-    """A dataclass to act as a data container for system state."""
+    """A slotted dataclass to act as a lightweight data container for system state."""
+
     # Sensor values
     solar_surplus: float
     total_surplus: float
@@ -34,7 +47,8 @@ class SystemState:
     @classmethod
     def validate_sensors(cls, app: hass.Hass, sensors: dict) -> bool:
         """
-        Validates that all required sensors exist and have valid states in Home Assistant.
+        Validates that all required sensors exist and have valid states in Home
+        Assistant.
 
         Args:
             app: The AppDaemon app instance.
@@ -53,77 +67,209 @@ class SystemState:
                     if state == "unknown":
                         continue
                     else:
-                        float(state) 
+                        float(state)
                 else:
                     float(state)
             except (TypeError, ValueError):
-                app.error(f"Sensor '{sensor_name}' ({entity_id}) has a non-numeric state: {state}")
+                app.error(
+                    f"Sensor '{sensor_name}' ({entity_id}) has a non-numeric state: {state}"
+                )
                 return False
         app.log("All sensors validated successfully.")
         return True
 
     @classmethod
-    def from_home_assistant(cls, app: hass.Hass) -> Optional["SystemState"]:
+    def snapshot_entities(cls, config) -> list:
+        """
+        Returns the entity IDs that are read to build a SystemState.
+
+        Args:
+            config: The ControllerConfig, or the app arguments from apps.yaml.
+
+        Returns:
+            A list of entity IDs, including the dry-run switch and the miner power limit
+                entity if configured.
+        """
+        if not isinstance(config, ControllerConfig):
+            config = ControllerConfig.from_args(config)
+        return list(config.snapshot_entities)
+
+    @classmethod
+    def read_snapshot(
+        cls, app: hass.Hass, config: Optional[ControllerConfig] = None
+    ) -> dict:
+        """
+        Reads all entities needed for one control cycle with a single bulk `get_state`
+        call.
+
+        The namespace is fetched without copying and immediately filtered down to the
+        configured entities, so all values come from the same moment in AppDaemon's
+        state.
+
+        Args:
+            app: The AppDaemon app instance.
+            config: The ControllerConfig. Parsed from the app arguments if not given.
+
+        Returns:
+            A dictionary mapping entity IDs to their full state dictionaries.
+        """
+        config = _controller_config(app, config)
+        all_states = app.get_state(copy=False) or {}
+        snapshot = {}
+        for entity_id in config.snapshot_entities:
+            entity_state = all_states.get(entity_id)
+            if entity_state is not None:
+                snapshot[entity_id] = entity_state
+        return snapshot
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        app: hass.Hass,
+        snapshot: dict,
+        now: Optional[datetime] = None,
+        config: Optional[ControllerConfig] = None,
+    ) -> Optional["SystemState"]:
+        """
+        Factory method to create a SystemState object from a snapshot of entity states.
+
+        Args:
+            app: The AppDaemon app instance.
+            snapshot: A dictionary mapping entity IDs to full state dictionaries, as
+                returned by `read_snapshot`.
+            now: The time of the snapshot. Defaults to the current time.
+            config: The ControllerConfig. Parsed from the app arguments if not given.
+
+        Returns:
+            A populated SystemState object, or None if sensor data is unavailable.
+        """
+
+        def read(entity_id):
+            entity_state = snapshot.get(entity_id)
+            return entity_state.get("state") if entity_state else None
+
+        return cls._from_reader(app, read, now, config)
+
+    @classmethod
+    def from_home_assistant(
+        cls, app: hass.Hass, cache=None, config: Optional[ControllerConfig] = None
+    ) -> Optional["SystemState"]:
         """
         Factory method to create a SystemState object from Home Assistant sensor values.
 
+        If `snapshot_reads` is enabled in the app arguments, all entities are fetched
+        with one bulk read. Otherwise each entity is read with its own `get_state` call.
+
         Args:
             app: The AppDaemon app instance.
+            cache: An optional per-cycle StateCache. It is primed with the snapshot, or
+                used for the individual reads.
+            config: The ControllerConfig. Parsed from the app arguments if not given.
             Returns:
             A populated SystemState object, or None if sensor data is unavailable.
         """
-        dry_run_switch_entity = app.args.get("dry_run_switch_entity")
+        config = _controller_config(app, config)
+        if config.snapshot_reads:
+            snapshot = cls.read_snapshot(app, config)
+            if cache is not None:
+                cache.prime(snapshot)
+            return cls.from_snapshot(app, snapshot, config=config)
+        reader = cache if cache is not None else app
+        return cls._from_reader(app, reader.get_state, config=config)
+
+    @classmethod
+    def _from_reader(
+        cls,
+        app: hass.Hass,
+        read,
+        now: Optional[datetime] = None,
+        config: Optional[ControllerConfig] = None,
+    ) -> Optional["SystemState"]:
+        """
+        Builds a SystemState using `read(entity_id)` to look up raw entity states.
+
+        Args:
+            app: The AppDaemon app instance.
+            read: A callable returning the raw state of an entity.
+            now: The time the state was read. Defaults to the current time.
+            config: The ControllerConfig. Parsed from the app arguments if not given.
+
+        Returns:
+            A populated SystemState object, or None if sensor data is unavailable.
+        """
+        config = _controller_config(app, config)
+        log = get_log(app)
+        sensors = config.sensors
+        dry_run_switch_entity = config.dry_run_switch_entity
         is_dry_run = False
         if dry_run_switch_entity:
-            raw_dry_run_state = app.get_state(dry_run_switch_entity)
-            app.log(f"Raw dry-run switch state: '{raw_dry_run_state}'")
-            is_dry_run = (raw_dry_run_state == "on")
-        grid_power_sensor = app.args["sensors"]["grid_power"]
-        battery_soc_sensor = app.args["sensors"]["battery_soc"]
-        battery_power_sensor = app.args["sensors"]["battery_power"]
-        solar_production_sensor = app.args["sensors"]["solar_production"]
-        miner_consumption_sensor = app.args["sensors"]["miner_consumption"]
-        chp_production_sensor = app.args["sensors"]["chp_production"]
-        miner_power_limit_entity = app.args.get("miner_heater", {}).get("power_limit_entity")
+            raw_dry_run_state = read(dry_run_switch_entity)
+            log.debug(
+                "dry_run_switch", entity=dry_run_switch_entity, state=raw_dry_run_state
+            )
+            is_dry_run = raw_dry_run_state == "on"
+        miner_power_limit_entity = (
+            config.miner_heater.power_limit_entity if config.miner_heater else None
+        )
         try:
-            grid_power = float(app.get_state(grid_power_sensor))
-            battery_soc = float(app.get_state(battery_soc_sensor))
-            battery_power = float(app.get_state(battery_power_sensor))
-            solar_production = float(app.get_state(solar_production_sensor)) * 1000 # convert kW to W
-            chp_production = float(app.get_state(chp_production_sensor))
+            grid_power = float(read(sensors.grid_power))
+            battery_soc = float(read(sensors.battery_soc))
+            battery_power = float(read(sensors.battery_power))
+            solar_production = (
+                float(read(sensors.solar_production)) * 1000
+            )  # convert kW to W
+            chp_production = float(read(sensors.chp_production))
 
-            miner_consumption_value = app.get_state(miner_consumption_sensor)
-            miner_consumption = float(miner_consumption_value) if miner_consumption_value not in ("unknown", "unavailable", None) else 0.0
+            miner_consumption_value = read(sensors.miner_consumption)
+            miner_consumption = (
+                float(miner_consumption_value)
+                if miner_consumption_value not in ("unknown", "unavailable", None)
+                else 0.0
+            )
 
             miner_power_limit = 0.0
             if miner_power_limit_entity:
-                miner_power_limit_value = app.get_state(miner_power_limit_entity)
+                miner_power_limit_value = read(miner_power_limit_entity)
                 if miner_power_limit_value not in ("unknown", "unavailable", None):
                     miner_power_limit = float(miner_power_limit_value)
 
         except (TypeError, ValueError) as e:
-            app.error(f"Error retrieving sensor data: {e}")
+            log.error("sensor_read_failed", error=e)
             return None
-        
+
         # Positive grid power is drawing from grid, negative is sending power to grid
         grid_import = max(0, grid_power)
         grid_export = max(0, -grid_power)
-        # Positive battery power means the battery is charging, negative is supplying power to house
+        # Positive battery power means the battery is charging, negative is supplying
+        # power to house
         battery_charging = max(0, battery_power)
         battery_discharging = max(0, -battery_power)
-        # Solar surplus is the sum of power being sent to the grid and power being used to charge the battery
+        # Solar surplus is the sum of power being sent to the grid and power being used
+        # to charge the battery
         solar_surplus = battery_power - grid_power - chp_production
         # Validate that solar surplus is not greater than solar production
         if solar_surplus > solar_production:
-            app.log(f"Solar surplus ({solar_surplus}W) is greater than solar production ({solar_production}W). Setting surplus to production value.")
+            log.info(
+                "solar_surplus_capped",
+                surplus=solar_surplus,
+                production=solar_production,
+            )
             solar_surplus = solar_production
         # Total surplus is the sum of solar surplus and CHP production
         total_surplus = solar_surplus + chp_production
 
-        # House consumption is the total production plus grid import, excluding the miner and battery charging
-        house_consumption = solar_production + chp_production + grid_import - battery_power - miner_consumption
+        # House consumption is the total production plus grid import, excluding the
+        # miner and battery charging
+        house_consumption = (
+            solar_production
+            + chp_production
+            + grid_import
+            - battery_power
+            - miner_consumption
+        )
 
-        # Miner surplus is the solar power not used by the house, but counting power for mining or battery charging as available
+        # Miner surplus is the solar power not used by the house, but counting power for
+        # mining or battery charging as available
         miner_surplus = solar_production - house_consumption
 
         state = cls(
@@ -142,146 +288,140 @@ class SystemState:
             solar_production=solar_production,
             miner_consumption=miner_consumption,
             miner_power_limit=miner_power_limit,
-            last_updated=datetime.now(timezone.utc).isoformat(),
+            last_updated=(now or datetime.now(timezone.utc)).isoformat(),
             is_dry_run=is_dry_run,
         )
-        app.log(f"Current state: {state}")
+        log.debug("system_state", state=state)
         return state
 
-    def publish_to_ha(self, hass_app, publish_entities):
-        """Publishes the controller's internal state to Home Assistant sensors."""
-        
-        # Mapping from SystemState attributes to HA entity keys
-        attribute_entity_map = {
-            "solar_surplus": "solar_surplus",
-            "total_surplus": "total_surplus",
-            "chp_production": "chp_production",
-            "battery_soc": "battery_soc",
-            "battery_power": "battery_power",
-            "battery_charging": "battery_charging",
-            "battery_discharging": "battery_discharging",
-            "grid_power": "grid_power",
-            "grid_import": "grid_import",
-            "grid_export": "grid_export",
-            "solar_production": "solar_production",
-            "miner_consumption": "miner_consumption",
-            "miner_power_limit": "miner_power_limit",
-            "house_consumption": "house_consumption",
-            "miner_surplus": "miner_surplus",
-            "is_dry_run": "is_dry_run",
-            "miner_intended_power_limit": "miner_intended_power_limit",
-            "miner_intended_switch_state": "miner_intended_switch_state",
-            "battery_intended_charge_switch_state": "battery_intended_charge_switch_state",
-            "chp_intended_switch_state": "chp_intended_switch_state",
-        }
-
-        # Units for the sensors
-        units = {
-            "solar_surplus": "W",
-            "total_surplus": "W",
-            "chp_production": "W",
-            "battery_soc": "%",
-            "battery_power": "W",
-            "battery_charging": "W",
-            "battery_discharging": "W",
-            "grid_power": "W",
-            "grid_import": "W",
-            "grid_export": "W",
-            "solar_production": "W",
-            "miner_consumption": "W",
-            "miner_power_limit": "W",
-            "house_consumption": "W",
-            "miner_surplus": "W",
-            "miner_intended_power_limit": "W",
-        }
-
-        state_dict = asdict(self)
-        for attr, entity_key in attribute_entity_map.items():
-            if entity_key in publish_entities:
-                entity_id = publish_entities[entity_key]
-                value = state_dict[attr]
-
-                # Skip publishing None values to avoid errors and retain previous state
-                if value is None:
-                    continue
-
-                unit = units.get(attr)
-                attributes = {"unit_of_measurement": unit} if unit else {}
-
-                final_state = value
-                if isinstance(value, float):
-                    final_state = round(value, 2)
-                elif isinstance(value, bool):
-                    final_state = "on" if value else "off"
-
-                hass_app.set_state(entity_id, state=final_state, attributes=attributes)
-        
-        hass_app.set_state(publish_entities["controller_running"], state="on")
-        hass_app.set_state(publish_entities["last_successful_run"], state=self.last_updated)
-        
-        hass_app.log("Published controller state to Home Assistant.")
-
-    def execute_actions(self, app: hass.Hass):
+    def publish_to_ha(self, hass_app, publish_entities, publish_filter=None, plan=None):
+        """
+        Publishes the controller's internal state to Home Assistant sensors.
+
+        Args:
+            hass_app: The AppDaemon app instance.
+            publish_entities: A dictionary mapping publish keys to entity IDs.
+            publish_filter: An optional PublishFilter. If given, only values that
+                changed beyond their deadband are written.
+            plan: An optional PublishPlan precompiled from `publish_entities`. Compiled
+                on the fly if not given.
+        """
+        if plan is None:
+            plan = PublishPlan(publish_entities)
+        plan.publish(hass_app, self, publish_filter)
+
+    def execute_actions(
+        self,
+        app: hass.Hass,
+        cache=None,
+        write_ledger=None,
+        config: Optional[ControllerConfig] = None,
+        record_writes=True,
+    ):
         """
         Executes the intended actions from the handlers, respecting the dry run mode.
+
+        Args:
+            app: The AppDaemon app instance.
+            cache: An optional per-cycle StateCache used for reading current entity
+                states.
+            write_ledger: An optional WriteLedger that records power limit writes
+                instead of a `last_write` attribute.
+            config: The ControllerConfig. Parsed from the app arguments if not given.
+            record_writes: Whether power limit writes are recorded in the write ledger
+                right away. False when the writes are only queued and the dispatcher
+                records them once they succeeded.
         """
-        miner_config = app.args.get("miner_heater", {})
-        battery_config = app.args.get("battery_handler", {})
-        chp_config = app.args.get("chp_handler", {})
+        reader = cache if cache is not None else app
+        config = _controller_config(app, config)
+        log = get_log(app)
+        miner_config = config.miner_heater
+        battery_config = config.battery_handler
+        chp_config = config.chp_handler
 
         # Miner Actions
         if self.miner_intended_switch_state is not None:
-            entity = miner_config.get("switch_entity")
-            if entity and app.get_state(entity) != self.miner_intended_switch_state:
-                app.log(f"Intending to turn {self.miner_intended_switch_state} {entity}")
+            entity = miner_config.switch_entity if miner_config else None
+            if entity and reader.get_state(entity) != self.miner_intended_switch_state:
+                log.info(
+                    "switch",
+                    entity=entity,
+                    state=self.miner_intended_switch_state,
+                    dry_run=self.is_dry_run,
+                )
                 if not self.is_dry_run:
-                    if self.miner_intended_switch_state == 'on':
+                    if self.miner_intended_switch_state == "on":
                         app.turn_on(entity)
                     else:
                         app.turn_off(entity)
-                else:
-                    app.log(f"[DRY RUN] Would have turned {self.miner_intended_switch_state} {entity}")
 
-        if self.miner_intended_power_limit is not None:
-            entity = miner_config.get("power_limit_entity")
+        if (
+            self.miner_intended_power_limit is not None
+            and self.miner_intended_power_limit != self.miner_power_limit
+        ):
+            entity = miner_config.power_limit_entity if miner_config else None
             if entity:
-                app.log(f"Intending to set miner power limit for {entity} to {self.miner_intended_power_limit} W.")
+                log.info(
+                    "power_limit",
+                    entity=entity,
+                    limit=self.miner_intended_power_limit,
+                    dry_run=self.is_dry_run,
+                )
                 if not self.is_dry_run:
-                    power_limit_entity_state = app.get_state(entity, attribute="all") or {}
-                    current_attributes = power_limit_entity_state.get("attributes", {})
-                    new_attributes = current_attributes.copy()
-                    new_attributes["last_write"] = datetime.now(timezone.utc).isoformat()
-                    app.set_state(entity, state=self.miner_intended_power_limit, attributes=new_attributes)
-                else:
-                    app.log(f"[DRY RUN] Would have set power limit for {entity} to {self.miner_intended_power_limit} W.")
+                    if write_ledger is not None:
+                        # Attributes are kept by set_state, so the entity does not need
+                        # to be read back
+                        app.set_state(entity, state=self.miner_intended_power_limit)
+                        if record_writes:
+                            write_ledger.record(entity, self.miner_intended_power_limit)
+                    else:
+                        power_limit_entity_state = (
+                            reader.get_state(entity, attribute="all") or {}
+                        )
+                        current_attributes = power_limit_entity_state.get(
+                            "attributes", {}
+                        )
+                        new_attributes = current_attributes.copy()
+                        new_attributes["last_write"] = self.last_updated
+                        app.set_state(
+                            entity,
+                            state=self.miner_intended_power_limit,
+                            attributes=new_attributes,
+                        )
 
         # Battery Actions
         if self.battery_intended_charge_switch_state is not None:
-            entity = battery_config.get("disable_charge_switch")
+            entity = battery_config.disable_charge_switch if battery_config else None
             if entity:
                 # Note: 'on' means disabled, 'off' means enabled.
-                current_state_is_on = app.get_state(entity) == 'on'
-                intend_to_be_on = self.battery_intended_charge_switch_state == 'on'
+                current_state_is_on = reader.get_state(entity) == "on"
+                intend_to_be_on = self.battery_intended_charge_switch_state == "on"
                 if current_state_is_on != intend_to_be_on:
-                    action = "ON to disable" if intend_to_be_on else "OFF to enable"
-                    app.log(f"Intending to turn {action} charging for {entity}")
+                    log.info(
+                        "charge_switch",
+                        entity=entity,
+                        state=self.battery_intended_charge_switch_state,
+                        charging="disabled" if intend_to_be_on else "enabled",
+                        dry_run=self.is_dry_run,
+                    )
                     if not self.is_dry_run:
                         if intend_to_be_on:
                             app.turn_on(entity)
                         else:
                             app.turn_off(entity)
-                    else:
-                        app.log(f"[DRY RUN] Would have turned {action} charging for {entity}")
 
         # CHP Actions
         if self.chp_intended_switch_state is not None:
-            entity = chp_config.get("switch_entity")
-            if entity and app.get_state(entity) != self.chp_intended_switch_state:
-                app.log(f"Intending to turn {self.chp_intended_switch_state} {entity}")
+            entity = chp_config.switch_entity if chp_config else None
+            if entity and reader.get_state(entity) != self.chp_intended_switch_state:
+                log.info(
+                    "switch",
+                    entity=entity,
+                    state=self.chp_intended_switch_state,
+                    dry_run=self.is_dry_run,
+                )
                 if not self.is_dry_run:
-                    if self.chp_intended_switch_state == 'on':
+                    if self.chp_intended_switch_state == "on":
                         app.turn_on(entity)
                     else:
                         app.turn_off(entity)
-                else:
-                    app.log(f"[DRY RUN] Would have turned {self.chp_intended_switch_state} {entity}")
@@ -0,0 +1,163 @@
+from datetime import datetime, timezone
+import numpy as np
+from system_state import SystemState
+
+# Sensor keys of args["sensors"] that a batch is built from
+SENSOR_KEYS = [
+    "grid_power",
+    "battery_soc",
+    "battery_power",
+    "solar_production",
+    "miner_consumption",
+    "chp_production",
+]
+
+# SystemState sensor fields held as columns
+FIELDS = [
+    "solar_surplus",
+    "total_surplus",
+    "chp_production",
+    "battery_soc",
+    "battery_power",
+    "battery_charging",
+    "battery_discharging",
+    "grid_power",
+    "grid_import",
+    "grid_export",
+    "solar_production",
+    "miner_consumption",
+    "miner_power_limit",
+    "house_consumption",
+    "miner_surplus",
+]
+
+
+class SystemStateBatch:
+    """
+    A columnar batch of system states, holding every SystemState sensor field as a NumPy
+    array.
+
+    The derived fields are computed in one vectorized pass with the same operations, in
+    the same order, as `SystemState.from_home_assistant`, so every sample equals the
+    scalar result exactly.
+    """
+
+    def __init__(self, timestamps, **columns):
+        """
+        Initializes the batch from complete columns.
+        Args:
+            timestamps: A sequence of ISO 8601 strings, datetimes or epoch seconds, one
+                per sample.
+            **columns: One float64 array per name in FIELDS.
+        """
+        self.timestamps = timestamps
+        for name in FIELDS:
+            setattr(self, name, columns[name])
+
+    @classmethod
+    def from_sensor_columns(
+        cls, timestamps, columns: dict, miner_power_limit=None
+    ) -> "SystemStateBatch":
+        """
+        Builds a batch from raw sensor columns and computes the derived fields.
+        Args:
+            timestamps: A sequence of ISO 8601 strings, datetimes or epoch seconds, one
+                per sample.
+            columns: A dictionary mapping the keys in SENSOR_KEYS to arrays of raw
+                sensor values, with solar production in kW as reported by Home
+                Assistant.
+            miner_power_limit: An optional array of miner power limits. Defaults to 0.
+        Returns:
+            A SystemStateBatch.
+        """
+        grid_power = np.asarray(columns["grid_power"], dtype=np.float64)
+        battery_soc = np.asarray(columns["battery_soc"], dtype=np.float64)
+        battery_power = np.asarray(columns["battery_power"], dtype=np.float64)
+        solar_production = (
+            np.asarray(columns["solar_production"], dtype=np.float64) * 1000
+        )  # convert kW to W
+        chp_production = np.asarray(columns["chp_production"], dtype=np.float64)
+        miner_consumption = np.nan_to_num(
+            np.asarray(columns["miner_consumption"], dtype=np.float64), nan=0.0
+        )
+        if miner_power_limit is None:
+            miner_power_limit = np.zeros_like(grid_power)
+        else:
+            miner_power_limit = np.nan_to_num(
+                np.asarray(miner_power_limit, dtype=np.float64), nan=0.0
+            )
+
+        grid_import = np.maximum(grid_power, 0.0)
+        grid_export = np.maximum(-grid_power, 0.0)
+        battery_charging = np.maximum(battery_power, 0.0)
+        battery_discharging = np.maximum(-battery_power, 0.0)
+        solar_surplus = battery_power - grid_power - chp_production
+        solar_surplus = np.where(
+            solar_surplus > solar_production, solar_production, solar_surplus
+        )
+        total_surplus = solar_surplus + chp_production
+        house_consumption = (
+            solar_production
+            + chp_production
+            + grid_import
+            - battery_power
+            - miner_consumption
+        )
+        miner_surplus = solar_production - house_consumption
+
+        return cls(
+            timestamps,
+            solar_surplus=solar_surplus,
+            total_surplus=total_surplus,
+            chp_production=chp_production,
+            battery_soc=battery_soc,
+            battery_power=battery_power,
+            battery_charging=battery_charging,
+            battery_discharging=battery_discharging,
+            grid_power=grid_power,
+            grid_import=grid_import,
+            grid_export=grid_export,
+            solar_production=solar_production,
+            miner_consumption=miner_consumption,
+            miner_power_limit=miner_power_limit,
+            house_consumption=house_consumption,
+            miner_surplus=miner_surplus,
+        )
+
+    def __len__(self):
+        return len(self.grid_power)
+
+    def state(self, index, is_dry_run=False) -> SystemState:
+        """
+        Returns one sample as a SystemState.
+        Args:
+            index: The sample index.
+            is_dry_run: The dry-run flag of the returned state.
+        """
+        return SystemState(
+            **{name: float(getattr(self, name)[index]) for name in FIELDS},
+            last_updated=self._last_updated(index),
+            is_dry_run=is_dry_run,
+        )
+
+    def states(self, is_dry_run=False):
+        """
+        Yields every sample as a SystemState. The columns are converted to lists once,
+        which is much faster than indexing the arrays per sample.
+        """
+        columns = [getattr(self, name).tolist() for name in FIELDS]
+        for index, values in enumerate(zip(*columns)):
+            yield SystemState(
+                **dict(zip(FIELDS, values)),
+                last_updated=self._last_updated(index),
+                is_dry_run=is_dry_run,
+            )
+
+    def _last_updated(self, index) -> str:
+        """Returns the timestamp of a sample as an ISO 8601 string."""
+        timestamp = self.timestamps[index]
+        if isinstance(timestamp, str):
+            return timestamp
+        if isinstance(timestamp, datetime):
+            return timestamp.isoformat()
+        return datetime.fromtimestamp(float(timestamp), timezone.utc).isoformat()
@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def parse_last_changed(value) -> Optional[datetime]:
+    """
+    Converts a `last_changed` value from AppDaemon into an aware datetime.
+    Appdaemon 4.x returns a datetime object, 3.x returns a string.
+    """
+    if not value:
+        return None
+    last_changed = (
+        value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    )
+    # Ensure the datetime is timezone-aware for comparison
+    if last_changed.tzinfo is None:
+        last_changed = last_changed.astimezone()
+    return last_changed
+
+
+class ToggleIndex:
+    """
+    An in-memory index of when switch entities last changed state.
+
+    Each tracked entity is seeded once from its `last_changed` attribute and then kept
+    current by a `listen_state` callback, so dwell time checks need no Home Assistant
+    call and no timestamp parsing.
+    """
+
+    def __init__(self, app, clock=None):
+        """
+        Initializes an empty index.
+        Args:
+            app: The AppDaemon app instance used for seeding and listening.
+            clock: An optional callable returning the current aware datetime, e.g.
+                simulated time in a replay.
+        """
+        self.app = app
+        self.clock = clock
+        self._last_changed = {}
+
+    def _now(self):
+        return self.clock() if self.clock else datetime.now(timezone.utc)
+
+    def track(self, entity_id):
+        """
+        Starts tracking an entity. Tracking the same entity again has no effect.
+        Args:
+            entity_id: The switch entity to track.
+        """
+        if not entity_id or entity_id in self._last_changed:
+            return
+        self._last_changed[entity_id] = parse_last_changed(
+            self.app.get_state(entity_id, attribute="last_changed")
+        )
+        self.app.listen_state(self._on_state_change, entity_id)
+
+    def _on_state_change(self, entity, attribute, old, new, kwargs):
+        """Records the time of a state change."""
+        if old != new:
+            self._last_changed[entity] = self._now()
+
+    def seconds_since_change(self, entity_id) -> Optional[float]:
+        """
+        Returns the seconds since an entity last changed, or None if it is unknown.
+        Args:
+            entity_id: A tracked entity.
+        """
+        last_changed = self._last_changed.get(entity_id)
+        if last_changed is None:
+            return None
+        return (self._now() - last_changed).total_seconds()
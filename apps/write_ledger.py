@@ -0,0 +1,96 @@
+import json
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class WriteLedger:
+    """
+    A controller-owned record of the last write time and value of each actuator.
+
+    Rate limits are checked against this ledger instead of reading attributes back from
+    Home Assistant. If a path is given, the ledger is persisted to a small JSON file
+    after every write so it survives restarts.
+    """
+
+    def __init__(self, path=None, clock=None, log=None):
+        """
+        Initializes an empty ledger.
+        Args:
+            path: An optional JSON file to persist the ledger to.
+            clock: An optional callable returning the current aware datetime, e.g.
+                simulated time in a replay.
+            log: An optional StructuredLog that failed saves are reported to.
+        """
+        self.path = path
+        self.clock = clock
+        self.log = log
+        self.save_failures = 0
+        self._entries = {}
+
+    def _now(self):
+        return self.clock() if self.clock else datetime.now(timezone.utc)
+
+    def load(self) -> bool:
+        """
+        Loads the ledger from its file.
+        Returns:
+            True if the file was read, False if there is no file or it could not be
+                parsed.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            self._entries = {
+                entity_id: (datetime.fromisoformat(entry["time"]), entry["value"])
+                for entity_id, entry in entries.items()
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            self._entries = {}
+            return False
+        return True
+
+    def _save(self):
+        """Atomically writes the ledger to its file."""
+        entries = {
+            entity_id: {"time": time.isoformat(), "value": value}
+            for entity_id, (time, value) in self._entries.items()
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(temp_path, self.path)
+
+    def record(self, entity_id, value):
+        """
+        Records a write to an actuator at the current time. If the file cannot be
+        written, the write is still recorded in memory and the failure is reported.
+        Args:
+            entity_id: The entity that was written.
+            value: The value that was written.
+        """
+        self._entries[entity_id] = (self._now(), value)
+        if self.path:
+            try:
+                self._save()
+            except OSError as e:
+                self.save_failures += 1
+                if self.log is not None:
+                    self.log.error("write_ledger_failed", path=self.path, error=e)
+
+    def last_value(self, entity_id):
+        """Returns the last written value of an entity, or None."""
+        entry = self._entries.get(entity_id)
+        return entry[1] if entry else None
+
+    def seconds_since_write(self, entity_id) -> Optional[float]:
+        """
+        Returns the seconds since the last write to an entity, or None if it was never
+        written.
+        """
+        entry = self._entries.get(entity_id)
+        if entry is None:
+            return None
+        return (self._now() - entry[0]).total_seconds()
@@ -0,0 +1,242 @@
+"""
+Benchmarks one control loop and each of its phases against an in-memory Home Assistant.
+
+Usage:
+    python benchmarks/bench_control_loop.py [--latency-ms 1] [--iterations 50]
+        [--save-baseline]
+
+Reports the number of Home Assistant calls and the mean wall time per phase, and
+compares them against benchmarks/baseline.json. Exits with a non-zero status if a phase
+makes more calls than the baseline, or is slower by more than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "apps"))
+
+from energy_controller import EnergyController
+from fake_hass import FakeHass
+from replay import load_app_args
+from state_cache import StateCache
+from system_state import SystemState
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "apps", "apps.yaml")
+
+
+def create_controller(args, latency):
+    """
+    Creates an initialized EnergyController served by a FakeHass with a surplus
+    scenario.
+    """
+    fake = FakeHass(args, latency=latency, record_actions=False)
+    sensors = args["sensors"]
+    fake.set_entity(args["dry_run_switch_entity"], "off")
+    fake.set_entity(sensors["grid_power"], "-2500.0")
+    fake.set_entity(sensors["battery_soc"], "80.0")
+    fake.set_entity(sensors["battery_power"], "1500.0")
+    fake.set_entity(sensors["solar_production"], "5.0")
+    fake.set_entity(sensors["miner_consumption"], "0.0")
+    fake.set_entity(sensors["chp_production"], "0.0")
+    fake.set_entity(args["miner_heater"]["switch_entity"], "off")
+    fake.set_entity(args["miner_heater"]["power_limit_entity"], "0.0")
+    fake.set_entity(args["chp_handler"]["switch_entity"], "off")
+    fake.set_entity(args["battery_handler"]["disable_charge_switch"], "off")
+
+    controller = fake.create_app(EnergyController)
+    latency, fake.latency = fake.latency, 0.0
+    controller.initialize()
+    controller.action_executor.wait()
+    fake.latency = latency
+    return fake, controller
+
+
+def vary_sensors(fake, iteration):
+    """Alternates the grid power so that published values change between iterations."""
+    fake.set_entity(
+        fake.args["sensors"]["grid_power"], "-2500.0" if iteration % 2 else "-2600.0"
+    )
+
+
+def run_control_loop(controller):
+    """Runs one control loop and waits for its actions to be dispatched."""
+    # Back-to-back loops would be skipped by the loop guard's interval check
+    controller.loop_guard.last_started = None
+    controller.control_loop(None)
+    controller.action_executor.wait()
+
+
+class PhaseTimer:
+    """Accumulates wall time and Home Assistant calls per phase."""
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.wall = Counter()
+        self.calls = Counter()
+
+    def measure(self, phase, function, *args):
+        calls_before = sum(self.fake.call_counts.values())
+        start = time.perf_counter()
+        result = function(*args)
+        self.wall[phase] += time.perf_counter() - start
+        self.calls[phase] += sum(self.fake.call_counts.values()) - calls_before
+        return result
+
+
+def run_benchmark(latency_ms=1.0, iterations=50, config_path=CONFIG_PATH):
+    """
+    Runs the benchmark.
+    Args:
+        latency_ms: Emulated latency of every Home Assistant call in milliseconds.
+        iterations: Number of control loops per measurement.
+        config_path: Path to the apps.yaml to benchmark.
+    Returns:
+        A dictionary mapping phase names to {"calls": calls per loop, "wall_ms": mean
+            milliseconds per loop}.
+    """
+    args = load_app_args(config_path)
+    args["write_ledger_path"] = os.path.join(tempfile.mkdtemp(), "write_ledger.json")
+    fake, controller = create_controller(args, latency_ms / 1000)
+    timer = PhaseTimer(fake)
+
+    for iteration in range(iterations):
+        vary_sensors(fake, iteration)
+        cache = StateCache(controller)
+        state = timer.measure(
+            "from_home_assistant",
+            SystemState.from_home_assistant,
+            controller,
+            cache,
+            controller.controller_config,
+        )
+        for handler in controller.device_handlers:
+            timer.measure(
+                f"{type(handler).__name__}.evaluate_and_act",
+                handler.evaluate_and_act,
+                state,
+                cache,
+            )
+        timer.measure(
+            "publish_to_ha",
+            state.publish_to_ha,
+            controller,
+            args["publish_entities"],
+            controller.publish_filter,
+            controller.publish_plan,
+        )
+        timer.measure(
+            "execute_actions",
+            state.execute_actions,
+            controller,
+            cache,
+            controller.write_ledger,
+            controller.controller_config,
+        )
+
+    for iteration in range(iterations):
+        vary_sensors(fake, iteration)
+        # Includes the background dispatch of the loop's actions, so that all of its
+        # calls are counted
+        timer.measure("control_loop", run_control_loop, controller)
+
+    return {
+        phase: {
+            "calls": timer.calls[phase] / iterations,
+            "wall_ms": timer.wall[phase] * 1000 / iterations,
+        }
+        for phase in timer.wall
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results against a baseline.
+    Returns:
+        A list of regression messages.
+    """
+    regressions = []
+    for phase, result in results.items():
+        expected = baseline.get("phases", {}).get(phase)
+        if expected is None:
+            continue
+        if result["calls"] > expected["calls"]:
+            regressions.append(
+                f"{phase}: {result['calls']:.1f} calls, baseline {expected['calls']:.1f}"
+            )
+        if result["wall_ms"] > expected["wall_ms"] * tolerance:
+            regressions.append(
+                f"{phase}: {result['wall_ms']:.3f} ms, baseline {expected['wall_ms']:.3f} ms"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the energy controller loop against a fake Home Assistant."
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=1.0,
+        help="Latency of every Home Assistant call",
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=50, help="Control loops per measurement"
+    )
+    parser.add_argument("--config", default=CONFIG_PATH, help="Path to apps.yaml")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="Allowed wall time ratio against the baseline",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the new baseline",
+    )
+    options = parser.parse_args(argv)
+
+    results = run_benchmark(options.latency_ms, options.iterations, options.config)
+
+    print(f"{'phase':<40} {'calls':>8} {'wall ms':>10}")
+    for phase, result in results.items():
+        print(f"{phase:<40} {result['calls']:>8.1f} {result['wall_ms']:>10.3f}")
+
+    if options.save_baseline:
+        with open(options.baseline, "w") as f:
+            json.dump(
+                {"latency_ms": options.latency_ms, "phases": results}, f, indent=2
+            )
+            f.write("\n")
+        print(f"Saved baseline to {options.baseline}")
+        return 0
+
+    if not os.path.exists(options.baseline):
+        print("No baseline found. Run with --save-baseline to create one.")
+        return 0
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("latency_ms") != options.latency_ms:
+        print(
+            f"Baseline was recorded with {baseline.get('latency_ms')} ms latency. Skipping comparison."
+        )
+        return 0
+
+    regressions = compare(results, baseline, options.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("No regressions against the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Benchmarks how the multi-site mode scales with the number of sites, against one
+EnergyController per site.
+
+Usage:
+    python benchmarks/bench_multi_site.py [--sites 1,10,100,500] [--latency-ms 0]
+        [--no-standalone]
+
+For each number of sites, the sites are started on one in-memory Home Assistant and run
+for one control interval after a warm-up interval. Reports per site the memory allocated
+at startup and the wall time per loop, and per interval the Home Assistant reads, the
+longest timer callback and the number of threads.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "apps"))
+
+from energy_controller import EnergyController
+from fake_hass import FakeHass, site_entities
+from multi_site import MultiSiteController, site_args
+from replay import load_app_args
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "apps", "apps.yaml")
+INTERVAL_SECONDS = 60
+
+
+def create_fake(defaults, count, latency):
+    """
+    Creates a FakeHass holding the entities of `count` sites with a surplus scenario.
+    """
+    sites = {
+        f"site{index}": site_entities(defaults, f"site{index}")
+        for index in range(count)
+    }
+    fake = FakeHass(
+        {"site_defaults": defaults, "sites": sites},
+        latency=latency,
+        record_actions=False,
+    )
+    for name, overrides in sites.items():
+        args = site_args(name, defaults, overrides)
+        sensors = args["sensors"]
+        fake.set_entity(args["dry_run_switch_entity"], "off")
+        fake.set_entity(sensors["grid_power"], "-2500.0")
+        fake.set_entity(sensors["battery_soc"], "80.0")
+        fake.set_entity(sensors["battery_power"], "4000.0")
+        fake.set_entity(sensors["solar_production"], "5.0")
+        fake.set_entity(sensors["miner_consumption"], "0.0")
+        fake.set_entity(sensors["chp_production"], "0.0")
+        fake.set_entity(args["miner_heater"]["switch_entity"], "off")
+        fake.set_entity(args["miner_heater"]["power_limit_entity"], "0.0")
+        fake.set_entity(args["chp_handler"]["switch_entity"], "off")
+        fake.set_entity(args["battery_handler"]["disable_charge_switch"], "off")
+    return fake
+
+
+def vary_sensors(fake, interval):
+    """
+    Changes the grid power of every site, so that published values change between
+    intervals.
+    """
+    value = "-2500.0" if interval % 2 else "-2600.0"
+    for name, overrides in fake.args["sites"].items():
+        fake.set_entity(overrides["sensors"]["grid_power"], value)
+
+
+def start_multi_site(fake):
+    """Starts a MultiSiteController hosting all sites."""
+    host = fake.create_app(MultiSiteController)
+    host.initialize()
+    return host
+
+
+def run_multi_site_interval(fake, host):
+    """
+    Advances one control interval in one-second ticks. Returns the longest tick in
+    seconds.
+    """
+    longest = 0.0
+    for _ in range(INTERVAL_SECONDS):
+        fake.now += timedelta(seconds=1)
+        start = time.perf_counter()
+        host.tick(None)
+        longest = max(longest, time.perf_counter() - start)
+    host.action_executor.wait()
+    return longest
+
+
+def start_standalone(fake):
+    """Starts one EnergyController per site, as separate AppDaemon apps would be."""
+    defaults = fake.args["site_defaults"]
+    controllers = []
+    for name, overrides in fake.args["sites"].items():
+        controller = fake.create_app(EnergyController)
+        controller.args = site_args(name, defaults, overrides)
+        controller.initialize()
+        controllers.append(controller)
+    return controllers
+
+
+def run_standalone_interval(fake, controllers):
+    """
+    Runs every controller's loop once, as their own timers would within one interval.
+    Unstaggered controllers started together all run in the same second, so the longest
+    callback is the sum.
+    """
+    fake.now += timedelta(seconds=INTERVAL_SECONDS)
+    start = time.perf_counter()
+    for controller in controllers:
+        controller.control_loop(None)
+    longest = time.perf_counter() - start
+    for controller in controllers:
+        controller.action_executor.wait()
+    return longest
+
+
+def measure(mode, count, defaults, latency):
+    """
+    Measures one mode with `count` sites.
+    Returns:
+        A dictionary with the per-site startup memory and loop time, and the reads,
+            longest callback and threads per interval.
+    """
+    fake = create_fake(defaults, count, latency)
+    threads_before = threading.active_count()
+    start, run = (
+        (start_multi_site, run_multi_site_interval)
+        if mode == "multi_site"
+        else (start_standalone, run_standalone_interval)
+    )
+
+    tracemalloc.start()
+    app = start(fake)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    vary_sensors(fake, 0)
+    run(fake, app)
+    vary_sensors(fake, 1)
+    reads = fake.call_counts["get_state"]
+    wall = time.perf_counter()
+    longest = run(fake, app)
+    wall = time.perf_counter() - wall
+    result = {
+        "kib_per_site": memory / 1024 / count,
+        "ms_per_loop": wall * 1000 / count,
+        "reads": fake.call_counts["get_state"] - reads,
+        "longest_ms": longest * 1000,
+        "threads": threading.active_count() - threads_before,
+    }
+
+    for controller in [app] if mode == "multi_site" else app:
+        controller.terminate()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the multi-site mode against one controller per site."
+    )
+    parser.add_argument(
+        "--sites", default="1,10,100,500", help="Comma-separated numbers of sites"
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0.0,
+        help="Latency of every Home Assistant call",
+    )
+    parser.add_argument("--config", default=CONFIG_PATH, help="Path to apps.yaml")
+    parser.add_argument(
+        "--no-standalone", action="store_true", help="Only measure the multi-site mode"
+    )
+    options = parser.parse_args(argv)
+
+    defaults = load_app_args(options.config)
+    # Sites run on the periodic schedule, and each writes its own ledger
+    defaults.pop("event_driven", None)
+    defaults["write_ledger_path"] = os.path.join(
+        tempfile.mkdtemp(), "write_ledger.json"
+    )
+
+    modes = ["multi_site"] if options.no_standalone else ["multi_site", "standalone"]
+    print(
+        f"{'mode':<12} {'sites':>6} {'KiB/site':>9} {'ms/loop':>8} {'reads/interval':>15} {'longest ms':>11} {'threads':>8}"
+    )
+    for count in (int(value) for value in options.sites.split(",")):
+        for mode in modes:
+            result = measure(mode, count, defaults, options.latency_ms / 1000)
+            print(
+                f"{mode:<12} {count:>6} {result['kib_per_site']:>9.1f} {result['ms_per_loop']:>8.3f} "
+                f"{result['reads']:>15} {result['longest_ms']:>11.1f} {result['threads']:>8}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Benchmarks the offline replay of a year of minute data.
+
+Usage:
+    python benchmarks/bench_replay.py [--days 365] [--csv] [--target-seconds 25]
+
+Replays a synthetic year with a daily solar curve and a varying house load through the
+handlers configured in apps.yaml, from a SystemStateBatch and optionally from a history
+CSV file as `python apps/replay.py` reads it. Reports the wall time and the replayed
+minutes per second, and exits with a non-zero status if a replay takes longer than the
+target.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "apps"))
+
+from replay import ReplayEngine, load_app_args, read_history_csv
+from system_state_batch import SystemStateBatch
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "apps", "apps.yaml")
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def synthetic_columns(days, seed=0):
+    """
+    Returns the epoch times and raw sensor columns of `days` days of minute samples.
+    Solar production follows a daily curve scaled by a random cloud factor, the house
+    load varies around 600 W and the battery absorbs half of any surplus.
+    """
+    rng = np.random.default_rng(seed)
+    minutes = days * 1440
+    times = START.timestamp() + 60.0 * np.arange(minutes)
+    hour = (np.arange(minutes) % 1440) / 60
+    daylight = np.clip(np.sin((hour - 6) / 12 * np.pi), 0, None)
+    clouds = np.repeat(rng.uniform(0.3, 1.0, minutes // 30 + 1), 30)[:minutes]
+    solar_kw = 8.0 * daylight * clouds
+    house_w = 600 + 400 * rng.random(minutes)
+    surplus_w = solar_kw * 1000 - house_w
+    battery_power = np.where(surplus_w > 0, surplus_w / 2, -house_w / 2)
+    columns = {
+        "grid_power": np.round(battery_power - surplus_w, 1),
+        "battery_soc": np.round(50 + 40 * daylight, 1),
+        "battery_power": np.round(battery_power, 1),
+        "solar_production": np.round(solar_kw, 3),
+        "miner_consumption": np.zeros(minutes),
+        "chp_production": np.zeros(minutes),
+    }
+    return times, columns
+
+
+def write_csv(path, times, columns):
+    """Writes the columns as a history CSV file in the format of `read_history_csv`."""
+    keys = list(columns)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["timestamp", *keys])
+        for index, epoch in enumerate(times):
+            timestamp = datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+            writer.writerow([timestamp, *(columns[key][index] for key in keys)])
+
+
+def measure(replay):
+    """Runs a replay and returns its wall time in seconds and its summary."""
+    start = time.perf_counter()
+    summary = replay()
+    return time.perf_counter() - start, summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the replay of a year of minute data."
+    )
+    parser.add_argument("--days", type=int, default=365, help="Days of minute data")
+    parser.add_argument("--config", default=CONFIG_PATH, help="Path to apps.yaml")
+    parser.add_argument(
+        "--csv", action="store_true", help="Also replay the data from a CSV file"
+    )
+    parser.add_argument(
+        "--target-seconds",
+        type=float,
+        default=25.0,
+        help="Maximum wall time of one replay of 365 days, scaled to --days",
+    )
+    options = parser.parse_args(argv)
+
+    args = load_app_args(options.config)
+    times, columns = synthetic_columns(options.days)
+    target = options.target_seconds * options.days / 365
+    runs = {
+        "batch": lambda: ReplayEngine(args).run_batch(
+            SystemStateBatch.from_sensor_columns(times, columns), times
+        )
+    }
+    if options.csv:
+        path = os.path.join(tempfile.mkdtemp(), "history.csv")
+        write_csv(path, times, columns)
+        runs["csv"] = lambda: ReplayEngine(args).run(
+            read_history_csv(path, args["sensors"].keys())
+        )
+
+    print(f"{'mode':<8} {'minutes':>9} {'seconds':>9} {'minutes/s':>10} {'toggles':>8}")
+    slow = []
+    for mode, replay in runs.items():
+        seconds, summary = measure(replay)
+        toggles = sum(summary.switch_toggles.values())
+        print(
+            f"{mode:<8} {summary.ticks:>9} {seconds:>9.2f} "
+            f"{summary.ticks / seconds:>10.0f} {toggles:>8}"
+        )
+        if seconds > target:
+            slow.append(f"{mode}: {seconds:.2f} s, target {target:.2f} s")
+    for message in slow:
+        print(f"TOO SLOW {message}")
+    return 1 if slow else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
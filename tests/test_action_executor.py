@@ -0,0 +1,329 @@
+import pytest
+import asyncio
+import threading
+import time
+from unittest.mock import Mock
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from action_executor import ActionExecutor
+
+
+class SlowApp:
+    """
+    An app whose service calls take a configurable time and can fail a number of times.
+    """
+
+    def __init__(self, delays=None, failures=None):
+        self.delays = delays or {}
+        self.failures = dict(failures or {})
+        self.calls = []
+        self.log = Mock()
+        self.error = Mock()
+        self._lock = threading.Lock()
+
+    def turn_on(self, entity_id, **kwargs):
+        time.sleep(self.delays.get(entity_id, 0))
+        with self._lock:
+            self.calls.append(("turn_on", entity_id))
+            if self.failures.get(entity_id):
+                self.failures[entity_id] -= 1
+                raise RuntimeError("integration unavailable")
+
+    def turn_off(self, entity_id, **kwargs):
+        with self._lock:
+            self.calls.append(("turn_off", entity_id))
+
+    def call_service(self, service, **kwargs):
+        time.sleep(self.delays.get(service, 0))
+        with self._lock:
+            self.calls.append(("call_service", service, kwargs["entity_id"]))
+
+    def set_state(self, entity_id, **kwargs):
+        with self._lock:
+            self.calls.append(("set_state", entity_id, kwargs.get("state")))
+
+
+class TestActionExecutor:
+    def test_submit_does_not_block_and_dispatches_devices_concurrently(self):
+        """
+        Tests that submitting returns immediately and devices are dispatched in
+        parallel.
+        """
+        app = SlowApp(delays={"switch.miner": 0.2, "switch.chp": 0.2})
+        executor = ActionExecutor(app)
+
+        start = time.monotonic()
+        executor.submit(
+            [("turn_on", ("switch.miner",), {}), ("turn_on", ("switch.chp",), {})]
+        )
+        assert time.monotonic() - start < 0.1
+
+        assert executor.wait(timeout=5)
+        assert time.monotonic() - start < 0.35
+        assert executor.succeeded == 2
+        assert sorted(app.calls) == [
+            ("turn_on", "switch.chp"),
+            ("turn_on", "switch.miner"),
+        ]
+
+    def test_retries_with_backoff(self):
+        """
+        Tests that a failing call is retried with exponential backoff and reported as
+        succeeded.
+        """
+        app = SlowApp(failures={"switch.miner": 2})
+        sleeps = []
+        executor = ActionExecutor(
+            app, retries=2, backoff_seconds=1, sleep=sleeps.append
+        )
+
+        executor.submit([("turn_on", ("switch.miner",), {})])
+        executor.wait(timeout=5)
+
+        assert sleeps == [1, 2]
+        outcome = executor.outcomes[-1]
+        assert outcome.succeeded and outcome.attempts == 3
+        app.error.assert_not_called()
+
+    def test_timeout_is_reported_as_failure(self):
+        """
+        Tests that a hung call fails after its timeout without blocking other devices.
+        """
+        app = SlowApp(delays={"switch.miner": 1.0})
+        executor = ActionExecutor(app, timeout_seconds=0.05, retries=0)
+
+        executor.submit(
+            [
+                ("turn_on", ("switch.miner",), {}),
+                ("set_state", ("number.limit",), {"state": 1000}),
+            ]
+        )
+        executor.wait(timeout=5)
+
+        failed = [outcome for outcome in executor.outcomes if not outcome.succeeded]
+        assert [outcome.entity_id for outcome in failed] == ["switch.miner"]
+        assert "timed out" in failed[0].error
+        assert ("set_state", "number.limit", 1000) in app.calls
+        app.error.assert_called_once()
+        executor.shutdown()
+
+    def test_timed_out_call_is_not_retried_or_overlapped(self):
+        """
+        Tests that a call blocking past its timeout runs once, and no call to its entity
+        starts until it returns.
+        """
+        release = threading.Event()
+        app = SlowApp()
+        blocking_turn_on = app.turn_on
+
+        def turn_on(entity_id, **kwargs):
+            if entity_id == "switch.miner":
+                release.wait(5)
+            blocking_turn_on(entity_id, **kwargs)
+
+        app.turn_on = turn_on
+        executor = ActionExecutor(
+            app,
+            max_workers=1,
+            timeout_seconds=0.05,
+            retries=2,
+            sleep=lambda seconds: None,
+        )
+
+        executor.submit([("turn_on", ("switch.miner",), {})])
+        assert executor.wait(timeout=5)
+        executor.submit(
+            [("turn_on", ("switch.miner",), {}), ("turn_on", ("switch.chp",), {})]
+        )
+        assert executor.wait(timeout=5)
+
+        assert app.calls == [("turn_on", "switch.chp")]
+        assert [outcome.succeeded for outcome in executor.outcomes] == [
+            False,
+            False,
+            True,
+        ]
+        assert "still running" in executor.outcomes[1].error
+        release.set()
+        for _ in range(100):
+            if all(future.done() for future in executor._hung.values()):
+                break
+            time.sleep(0.01)
+        executor.submit([("turn_on", ("switch.miner",), {})])
+        assert executor.wait(timeout=5)
+
+        assert app.calls == [
+            ("turn_on", "switch.chp"),
+            ("turn_on", "switch.miner"),
+            ("turn_on", "switch.miner"),
+        ]
+        assert executor.outcomes[-1].succeeded
+
+    def test_busy_device_keeps_only_newest_actions(self):
+        """Tests that actions queued for a busy device are replaced by newer ones."""
+        app = SlowApp(delays={"switch.miner": 0.1})
+        executor = ActionExecutor(app)
+
+        executor.submit([("turn_on", ("switch.miner",), {})])
+        executor.submit([("turn_on", ("switch.miner",), {})])
+        executor.submit([("turn_on", ("switch.miner",), {})])
+        executor.wait(timeout=5)
+
+        assert len(app.calls) == 2
+        assert executor.superseded == 1
+
+    def test_merged_call_runs_in_order_with_calls_to_its_entities(self):
+        """
+        Tests that a single call to a switch waits for a running merged call that
+        includes it.
+        """
+        app = SlowApp(delays={"switch/turn_on": 0.1})
+        executor = ActionExecutor(app)
+
+        executor.submit(
+            [
+                (
+                    "call_service",
+                    ("switch/turn_on",),
+                    {"entity_id": ["switch.a", "switch.b"]},
+                )
+            ]
+        )
+        executor.submit(
+            [("turn_off", ("switch.a",), {}), ("turn_on", ("switch.c",), {})]
+        )
+        executor.wait(timeout=5)
+
+        assert app.calls.index(
+            ("call_service", "switch/turn_on", ["switch.a", "switch.b"])
+        ) < app.calls.index(("turn_off", "switch.a"))
+        assert app.calls[0] == ("turn_on", "switch.c")
+
+    def test_merged_call_is_split_when_its_entities_are_busy_on_different_devices(self):
+        app = SlowApp(delays={"switch.a": 0.1, "switch.b": 0.1})
+        executor = ActionExecutor(app)
+
+        executor.submit(
+            [("turn_on", ("switch.a",), {}), ("turn_on", ("switch.b",), {})]
+        )
+        executor.submit(
+            [
+                (
+                    "call_service",
+                    ("switch/turn_off",),
+                    {"entity_id": ["switch.a", "switch.b"]},
+                )
+            ]
+        )
+        executor.wait(timeout=5)
+
+        for entity_id in ("switch.a", "switch.b"):
+            assert app.calls.index(("turn_on", entity_id)) < app.calls.index(
+                ("call_service", "switch/turn_off", entity_id)
+            )
+        assert len(app.calls) == executor.succeeded == 4
+
+    def test_on_success_is_called_for_succeeded_calls_only(self):
+        app = SlowApp(failures={"switch.miner": 1})
+        succeeded = []
+        executor = ActionExecutor(app, retries=0)
+
+        executor.submit(
+            [
+                ("turn_on", ("switch.miner",), {}),
+                ("set_state", ("number.limit",), {"state": 1000}),
+            ],
+            on_success=lambda method, args, kwargs: succeeded.append(
+                (method, args, kwargs)
+            ),
+        )
+        executor.wait(timeout=5)
+
+        assert succeeded == [("set_state", ("number.limit",), {"state": 1000})]
+
+    def test_failing_on_success_is_logged_and_does_not_block_the_entity(self):
+        """
+        Tests that a raising success callback is logged, and later calls to the same
+        entity are still sent.
+        """
+        app = SlowApp()
+        executor = ActionExecutor(app)
+
+        def fail(method, args, kwargs):
+            raise OSError("read-only file system")
+
+        executor.submit(
+            [("set_state", ("number.limit",), {"state": 1000})], on_success=fail
+        )
+        assert executor.wait(timeout=5)
+        executor.submit([("set_state", ("number.limit",), {"state": 2000})])
+        assert executor.wait(timeout=5)
+
+        assert app.calls == [
+            ("set_state", "number.limit", 1000),
+            ("set_state", "number.limit", 2000),
+        ]
+        assert "action_callback_failed" in app.error.call_args.args[0]
+        assert executor._owners == {} and executor._running == {}
+
+    def test_dispatch_async_retries_failed_calls(self):
+        """Tests that async dispatch retries a failing call with backoff."""
+        calls = []
+
+        async def turn_on(entity_id, **kwargs):
+            calls.append(entity_id)
+            if entity_id == "switch.miner" and calls.count(entity_id) == 1:
+                raise RuntimeError("integration unavailable")
+
+        app = Mock()
+        app.turn_on = turn_on
+        executor = ActionExecutor(app, retries=1, backoff_seconds=0.01)
+
+        asyncio.run(
+            executor.dispatch_async(
+                [("turn_on", ("switch.miner",), {}), ("turn_on", ("switch.chp",), {})]
+            )
+        )
+
+        assert calls.count("switch.miner") == 2
+        assert executor.succeeded == 2
+        assert executor.outcomes[-1].attempts == 2
+
+    def test_dispatch_async_does_not_retry_or_overlap_timed_out_calls(self):
+        """
+        Tests that an async call past its timeout runs once, and no call to its entity
+        starts until it returns.
+        """
+        calls = []
+        release = asyncio.Event()
+
+        async def turn_on(entity_id, **kwargs):
+            calls.append(entity_id)
+            if entity_id == "switch.miner" and calls.count(entity_id) == 1:
+                await release.wait()
+
+        app = Mock()
+        app.turn_on = turn_on
+        executor = ActionExecutor(
+            app, timeout_seconds=0.05, retries=2, backoff_seconds=0.01
+        )
+        miner = [("turn_on", ("switch.miner",), {})]
+
+        async def run():
+            await executor.dispatch_async(miner + [("turn_on", ("switch.chp",), {})])
+            await executor.dispatch_async(miner)
+            release.set()
+            await asyncio.sleep(0)
+            await executor.dispatch_async(miner)
+
+        asyncio.run(run())
+
+        assert calls == ["switch.miner", "switch.chp", "switch.miner"]
+        miner_outcomes = [o for o in executor.outcomes if o.entity_id == "switch.miner"]
+        assert [outcome.succeeded for outcome in miner_outcomes] == [False, False, True]
+        assert "timed out" in miner_outcomes[0].error
+        assert miner_outcomes[0].attempts == 1
+        assert "still running" in miner_outcomes[1].error
@@ -0,0 +1,59 @@
+from unittest.mock import Mock
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from action_recorder import ActionRecorder
+from fake_hass import FakeHass
+
+
+def test_batched_calls_merge_switches_sharing_a_service():
+    """
+    Tests that switch actions of the same domain and direction become one service call.
+    """
+    recorder = ActionRecorder(Mock(args={}))
+    recorder.turn_on("switch.miner")
+    recorder.set_state("number.miner_power_limit", state=2000)
+    recorder.turn_on("switch.victron_disable_charge")
+    recorder.turn_off("switch.heat_pump")
+    recorder.turn_on("input_boolean.chp")
+
+    assert recorder.batched_calls() == [
+        (
+            "call_service",
+            ("switch/turn_on",),
+            {"entity_id": ["switch.miner", "switch.victron_disable_charge"]},
+        ),
+        ("set_state", ("number.miner_power_limit",), {"state": 2000}),
+        ("turn_off", ("switch.heat_pump",), {}),
+        ("turn_on", ("input_boolean.chp",), {}),
+    ]
+
+
+def test_batched_calls_keep_calls_with_arguments():
+    """Tests that switch actions with extra arguments are not merged."""
+    recorder = ActionRecorder(Mock(args={}))
+    recorder.turn_on("switch.miner")
+    recorder.turn_on("switch.chp", brightness=10)
+
+    assert recorder.batched_calls() == recorder.calls
+
+
+def test_batched_call_applies_to_all_entities():
+    """
+    Tests that a merged service call switches every listed entity of the fake with one
+    request.
+    """
+    fake = FakeHass({})
+    recorder = ActionRecorder(fake)
+    recorder.turn_on("switch.miner")
+    recorder.turn_on("switch.chp")
+
+    for method, args, kwargs in recorder.batched_calls():
+        getattr(fake, method)(*args, **kwargs)
+
+    assert fake.get_state("switch.miner") == "on"
+    assert fake.get_state("switch.chp") == "on"
+    assert fake.call_counts["call_service"] == 1
+    assert fake.action_counts[("turn_on", "switch.chp")] == 1
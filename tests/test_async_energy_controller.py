@@ -0,0 +1,196 @@
+import pytest
+import asyncio
+import time
+from unittest.mock import Mock
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from async_energy_controller import AsyncEnergyController
+from miner_heater_handler import MinerHeaterHandler
+from publish_filter import PublishFilter
+from publish_plan import PublishPlan
+from write_ledger import WriteLedger
+from action_executor import ActionExecutor
+from loop_guard import LoopGuard
+from signal_stats import SignalStats
+from handler_graph import HandlerScheduler
+from controller_config import ControllerConfig
+from structured_log import StructuredLog
+from planning_handler import PlanningHandler
+
+LATENCY = 0.02
+
+STATES = {
+    "input_boolean.dry_run": "off",
+    "sensor.grid_power": "0.0",
+    "sensor.battery_soc": "80.0",
+    "sensor.battery_power": "3000.0",
+    "sensor.solar_production": "4.0",
+    "sensor.miner_consumption": "0.0",
+    "sensor.chp_production": "0.0",
+    "switch.miner": "off",
+    "number.miner_power_limit": "0.0",
+    "sensor.forecast": "6000",
+}
+
+ATTRIBUTES = {
+    "sensor.forecast": {"forecast": [6000] * 24},
+}
+
+
+@pytest.fixture
+def controller():
+    """Fixture for an AsyncEnergyController with an async in-memory Home Assistant."""
+    controller = AsyncEnergyController.__new__(AsyncEnergyController)
+    controller.args = {
+        "dry_run_switch_entity": "input_boolean.dry_run",
+        "sensors": {
+            "grid_power": "sensor.grid_power",
+            "battery_soc": "sensor.battery_soc",
+            "battery_power": "sensor.battery_power",
+            "solar_production": "sensor.solar_production",
+            "miner_consumption": "sensor.miner_consumption",
+            "chp_production": "sensor.chp_production",
+        },
+        "miner_heater": {
+            "switch_entity": "switch.miner",
+            "power_limit_entity": "number.miner_power_limit",
+        },
+        "publish_entities": {
+            "grid_power": "sensor.controller_grid_power",
+            "controller_running": "binary_sensor.controller_running",
+            "last_successful_run": "sensor.controller_last_successful_run",
+        },
+    }
+    controller.calls = []
+
+    async def get_state(entity_id, attribute=None, copy=True):
+        await asyncio.sleep(LATENCY)
+        return {"state": STATES[entity_id], "attributes": ATTRIBUTES.get(entity_id, {})}
+
+    async def record(method, entity_id, **kwargs):
+        await asyncio.sleep(LATENCY)
+        controller.calls.append((method, entity_id))
+
+    controller.get_state = get_state
+    controller.turn_on = lambda entity_id, **kwargs: record("turn_on", entity_id)
+    controller.turn_off = lambda entity_id, **kwargs: record("turn_off", entity_id)
+    controller.set_state = lambda entity_id, **kwargs: record("set_state", entity_id)
+    controller.log = Mock()
+    controller.error = Mock()
+    controller.controller_config = ControllerConfig.from_args(controller.args)
+    controller.publish_filter = PublishFilter()
+    controller.publish_plan = PublishPlan(controller.args["publish_entities"])
+    controller.write_ledger = WriteLedger()
+    controller.cycle_log = None
+    controller.structured_log = StructuredLog(controller, repeat_seconds=0)
+    controller.action_executor = ActionExecutor(controller)
+    controller.loop_guard = LoopGuard(60)
+    controller.signal_stats = SignalStats()
+    controller.device_handlers = [
+        MinerHeaterHandler(
+            controller,
+            controller.controller_config.miner_heater,
+            write_ledger=controller.write_ledger,
+        )
+    ]
+    controller.handler_scheduler = HandlerScheduler(controller.device_handlers)
+    return controller
+
+
+class TestAsyncEnergyController:
+    def test_control_loop_reads_and_writes(self, controller):
+        """
+        Tests that an async cycle reads all entities and dispatches the handler actions.
+        """
+        asyncio.run(controller.async_control_loop(None))
+
+        assert ("turn_on", "switch.miner") in controller.calls
+        assert ("set_state", "number.miner_power_limit") in controller.calls
+        assert ("set_state", "binary_sensor.controller_running") in controller.calls
+        controller.error.assert_not_called()
+        assert (
+            controller.write_ledger.last_value("number.miner_power_limit") is not None
+        )
+
+    def test_failed_power_limit_write_is_not_recorded(self, controller):
+        """
+        Tests that the write ledger only records power limit writes that succeeded, so
+        the next cycle can retry them.
+        """
+        controller.action_executor = ActionExecutor(controller, retries=0)
+        record_call = controller.set_state
+
+        def set_state(entity_id, **kwargs):
+            if entity_id == "number.miner_power_limit":
+                raise RuntimeError("integration unavailable")
+            return record_call(entity_id, **kwargs)
+
+        controller.set_state = set_state
+
+        asyncio.run(controller.async_control_loop(None))
+
+        assert ("turn_on", "switch.miner") in controller.calls
+        assert controller.write_ledger.last_value("number.miner_power_limit") is None
+
+    def test_control_loop_runs_io_concurrently(self, controller):
+        """
+        Tests that the loop wall time is bounded by the slowest call, not the sum of
+        calls.
+        """
+        start = time.perf_counter()
+        asyncio.run(controller.async_control_loop(None))
+        elapsed = time.perf_counter() - start
+
+        total_calls = len(controller._entities_to_read()) + len(controller.calls)
+        assert total_calls >= 10
+        assert elapsed < total_calls * LATENCY / 2
+
+    def test_control_loop_failure(self, controller):
+        """Tests that a missing sensor marks the controller as not running."""
+        controller.args["sensors"]["grid_power"] = "sensor.missing"
+        controller.controller_config = ControllerConfig.from_args(controller.args)
+        original_get_state = controller.get_state
+
+        async def get_state(entity_id, attribute=None, copy=True):
+            if entity_id == "sensor.missing":
+                return None
+            return await original_get_state(entity_id, attribute, copy)
+
+        controller.get_state = get_state
+
+        asyncio.run(controller.async_control_loop(None))
+
+        assert controller.calls == [("set_state", "binary_sensor.controller_running")]
+
+    def test_planner_reads_entity_forecast_from_snapshot(self, controller, tmp_path):
+        """
+        Tests that the forecast entity of the planner is gathered with the other
+        entities of the cycle.
+        """
+        profile = tmp_path / "consumption.csv"
+        profile.write_text(
+            "hour,value\n" + "".join(f"{hour},500\n" for hour in range(24))
+        )
+        config = ControllerConfig.from_args(
+            {
+                **controller.args,
+                "planning_handler": {
+                    "solar_forecast": {"entity": "sensor.forecast"},
+                    "consumption_profile": {"file": str(profile)},
+                },
+            }
+        )
+        planner = PlanningHandler(
+            controller, config.planning_handler, miner_config=config.miner_heater
+        )
+        controller.device_handlers.append(planner)
+        controller.handler_scheduler = HandlerScheduler(controller.device_handlers)
+
+        asyncio.run(controller.async_control_loop(None))
+
+        assert "sensor.forecast" in controller._entities_to_read()
+        assert planner.plan is not None
+        assert ("turn_on", "switch.miner") in controller.calls
@@ -0,0 +1,172 @@
+import pytest
+import dataclasses
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from controller_config import ConfigError, ControllerConfig, MinerConfig, PlanningConfig
+from replay import load_app_args
+
+SENSORS = {
+    "grid_power": "sensor.grid_power",
+    "battery_soc": "sensor.battery_soc",
+    "battery_power": "sensor.battery_power",
+    "solar_production": "sensor.solar_production",
+    "miner_consumption": "sensor.miner_consumption",
+    "chp_production": "sensor.chp_production",
+}
+
+
+class TestControllerConfig:
+    def test_parses_apps_yaml(self):
+        """
+        Tests that the shipped configuration parses and precomputes the entity lists.
+        """
+        config = ControllerConfig.from_args(load_app_args("apps/apps.yaml"))
+
+        assert config.miner_heater.activation_threshold == 2000
+        assert config.action_executor.retries == 2
+        assert config.snapshot_entities[0] == "input_boolean.energy_controller_dry_run"
+        assert config.snapshot_entities[-1] == "number.deiner_power_limit"
+        assert "switch.victron_vebus_disablecharge_227" in config.actuator_entities
+
+    def test_parses_the_runtime_sections(self):
+        """
+        Tests that the signal statistics, deadbands, event-driven and logging sections
+        are parsed into typed sections.
+        """
+        config = ControllerConfig.from_args(load_app_args("apps/apps.yaml"))
+
+        assert config.signal_stats.fields[0] == "miner_surplus"
+        assert config.handler_deadbands["miner_surplus"].absolute == 100
+        assert config.publish_deadbands["solar_production"].relative == 0.01
+        assert config.publish_entities["controller_running"]
+        assert config.event_driven.fallback_interval_seconds == 300
+        assert config.logging.rate_limits["toggle_blocked"] == 300
+
+    def test_is_frozen_and_slotted(self):
+        config = ControllerConfig.from_args({"sensors": SENSORS})
+
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            config.snapshot_reads = True
+        assert not hasattr(config.sensors, "__dict__")
+
+    def test_defaults_for_optional_sections(self):
+        config = ControllerConfig.from_args({"sensors": SENSORS, "miner_heater": {}})
+
+        assert config.miner_heater == MinerConfig()
+        assert config.chp_handler is None
+        assert config.snapshot_entities == tuple(SENSORS.values())
+        assert config.actuator_entities == ()
+
+    @pytest.mark.parametrize(
+        "args, message",
+        [
+            ({}, "`sensors` is required"),
+            (
+                {"sensors": {**SENSORS, "grid_power": None}},
+                "`sensors.grid_power` must be a string",
+            ),
+            (
+                {"sensors": SENSORS, "miner_heater": {"activation_treshold": 2000}},
+                "Unknown keys in `miner_heater`: activation_treshold",
+            ),
+            (
+                {"sensors": SENSORS, "miner_heater": {"max_power": "6000"}},
+                "`miner_heater.max_power` must be a number",
+            ),
+            (
+                {"sensors": SENSORS, "miner_heater": {"power_step": 0}},
+                "`miner_heater.power_step` must be positive",
+            ),
+            (
+                {"sensors": SENSORS, "miner_heater": {"surplus_statistic": "median"}},
+                "must be one of",
+            ),
+            (
+                {
+                    "sensors": SENSORS,
+                    "miner_heater": {"surplus_statistic": "ewma"},
+                    "signal_stats": {"fields": ["grid_power"]},
+                },
+                "`miner_heater.surplus_statistic` 'ewma' needs `miner_surplus` in `signal_stats.fields`",
+            ),
+            (
+                {"sensors": SENSORS, "snapshot_reads": "yes"},
+                "`snapshot_reads` must be true or false",
+            ),
+            (
+                {"sensors": SENSORS, "action_executor": {"max_workers": 2.5}},
+                "`action_executor.max_workers` must be an integer",
+            ),
+            (
+                {"sensors": SENSORS, "chp_handler": ["switch.chp"]},
+                "`chp_handler` must be a mapping",
+            ),
+            (
+                {"sensors": SENSORS, "signal_stats": {"fields": ["grid_pwer"]}},
+                "Unknown SystemState fields in `signal_stats.fields`: grid_pwer",
+            ),
+            (
+                {"sensors": SENSORS, "signal_stats": {"window": 0}},
+                "`signal_stats.window` must be at least 1",
+            ),
+            (
+                {
+                    "sensors": SENSORS,
+                    "handler_deadbands": {"grid_import": {"absolut": 50}},
+                },
+                "Unknown keys in `handler_deadbands.grid_import`: absolut",
+            ),
+            (
+                {
+                    "sensors": SENSORS,
+                    "handler_deadbands": {"grid_imprt": {"absolute": 50}},
+                },
+                "Unknown SystemState fields in `handler_deadbands`: grid_imprt",
+            ),
+            (
+                {
+                    "sensors": SENSORS,
+                    "publish_entities": {"grid_power": "sensor.controller_grid_power"},
+                    "publish_deadbands": {"grid_powr": {"absolute": 20}},
+                },
+                "Unknown keys in `publish_deadbands`: grid_powr",
+            ),
+            (
+                {"sensors": SENSORS, "event_driven": {"debounce_seconds": "5s"}},
+                "`event_driven.debounce_seconds` must be a number",
+            ),
+            (
+                {"sensors": SENSORS, "logging": {"level": "verbose"}},
+                "`logging.level` must be one of",
+            ),
+        ],
+    )
+    def test_invalid_config_fails_at_load_time(self, args, message):
+        with pytest.raises(ConfigError, match=message):
+            ControllerConfig.from_args(args)
+
+    def test_nested_sections_report_their_path(self):
+        with pytest.raises(
+            ConfigError,
+            match="`planning_handler.solar_forecast.scale` must be a number",
+        ):
+            PlanningConfig.from_dict(
+                {
+                    "solar_forecast": {"entity": "sensor.forecast", "scale": "kW"},
+                    "consumption_profile": {"file": "profile.csv"},
+                }
+            )
+
+    def test_miner_levels_become_a_tuple(self):
+        config = PlanningConfig.from_dict(
+            {
+                "solar_forecast": {"entity": "sensor.forecast"},
+                "consumption_profile": {"file": "profile.csv"},
+                "miner_levels": [0, 2000, 4000],
+            }
+        )
+
+        assert config.miner_levels == (0, 2000, 4000)
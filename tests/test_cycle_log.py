@@ -0,0 +1,213 @@
+import pytest
+import os
+import struct
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+import numpy as np
+from cycle_log import (
+    HEADER,
+    RECORD,
+    CycleLog,
+    cycle_batch,
+    read_cycle_log,
+    read_cycle_logs,
+)
+from energy_controller import EnergyController
+from fake_hass import FakeHass
+from replay import load_app_args
+from system_state import SystemState
+
+START = datetime(2024, 6, 1, 23, 58, tzinfo=timezone.utc)
+
+
+def make_state(grid_power=-500.0, **kwargs):
+    values = dict(
+        solar_surplus=1500.0,
+        total_surplus=1500.0,
+        chp_production=0.0,
+        battery_soc=55.5,
+        battery_power=1000.0,
+        battery_charging=1000.0,
+        battery_discharging=0.0,
+        grid_power=grid_power,
+        grid_import=0.0,
+        grid_export=500.0,
+        solar_production=2500.0,
+        miner_consumption=0.0,
+        miner_power_limit=0.0,
+        house_consumption=1500.0,
+        miner_surplus=1000.0,
+        last_updated="2024-06-01T23:58:00+00:00",
+        is_dry_run=False,
+    )
+    values.update(kwargs)
+    return SystemState(**values)
+
+
+class TestCycleLog:
+    def test_records_round_trip_through_memory_map(self, tmp_path):
+        """
+        Tests that appended records read back as a structured array without parsing.
+        """
+        log = CycleLog(tmp_path)
+        state = make_state(
+            miner_intended_switch_state="on",
+            miner_intended_power_limit=3000,
+            chp_intended_switch_state="off",
+        )
+        log.append(state, duration=0.002, timestamp=START.timestamp())
+        log.append(
+            make_state(grid_power=-400.0, is_dry_run=True),
+            timestamp=START.timestamp() + 60,
+        )
+        log.close()
+
+        records = read_cycle_log(tmp_path / "cycles-20240601.bin")
+
+        assert isinstance(records, np.memmap)
+        assert len(records) == 2
+        assert list(records["time"]) == [START.timestamp(), START.timestamp() + 60]
+        assert list(records["grid_power"]) == [-500, -400]
+        assert records["battery_soc"][0] == pytest.approx(55.5)
+        assert records["duration"][0] == pytest.approx(0.002)
+        assert np.isnan(records["duration"][1])
+        assert list(records["miner_intended_switch_state"]) == [1, -1]
+        assert list(records["chp_intended_switch_state"]) == [0, -1]
+        assert records["miner_intended_power_limit"][0] == 3000
+        assert np.isnan(records["miner_intended_power_limit"][1])
+        assert list(records["is_dry_run"]) == [0, 1]
+
+    def test_rotates_daily(self, tmp_path):
+        log = CycleLog(tmp_path)
+        for minute in range(4):
+            log.append(
+                make_state(), timestamp=(START + timedelta(minutes=minute)).timestamp()
+            )
+        log.close()
+
+        assert sorted(os.listdir(tmp_path)) == [
+            "cycles-20240601.bin",
+            "cycles-20240602.bin",
+        ]
+        assert [len(records) for records in read_cycle_logs(tmp_path)] == [2, 2]
+        assert [
+            len(records)
+            for records in read_cycle_logs(tmp_path, start=START + timedelta(days=1))
+        ] == [2]
+
+    def test_reopening_appends_and_drops_partial_record(self, tmp_path):
+        """
+        Tests that a partial record left by a crash is cut off when the log is reopened.
+        """
+        log = CycleLog(tmp_path)
+        log.append(make_state(), timestamp=START.timestamp())
+        log.close()
+        path = tmp_path / "cycles-20240601.bin"
+        with open(path, "ab") as f:
+            f.write(b"\x00" * 10)
+
+        assert len(read_cycle_log(path)) == 1
+        log = CycleLog(tmp_path)
+        log.append(make_state(grid_power=-100.0), timestamp=START.timestamp() + 60)
+        log.close()
+
+        assert os.path.getsize(path) == HEADER.size + 2 * RECORD.size
+        assert list(read_cycle_log(path)["grid_power"]) == [-500, -100]
+
+    def test_rejects_foreign_files(self, tmp_path):
+        """
+        Tests that a foreign file cannot be read, and is moved aside instead of being
+        appended to.
+        """
+        path = tmp_path / "cycles-20240601.bin"
+        path.write_bytes(b"not a cycle log at all")
+
+        with pytest.raises(ValueError, match="not a version 1 cycle log"):
+            read_cycle_log(path)
+        log = CycleLog(tmp_path)
+        log.append(make_state(), timestamp=START.timestamp())
+        log.append(make_state(), timestamp=START.timestamp() + 60)
+        log.close()
+
+        assert len(read_cycle_log(path)) == 2
+        assert (tmp_path / "cycles-20240601.bin.invalid").read_bytes() == (
+            b"not a cycle log at all"
+        )
+
+    def test_batch_matches_states(self, tmp_path):
+        log = CycleLog(tmp_path)
+        log.append(make_state(), timestamp=START.timestamp())
+        log.close()
+
+        state = cycle_batch(read_cycle_log(tmp_path / "cycles-20240601.bin")).state(0)
+
+        assert state.grid_power == -500
+        assert state.last_updated == START.isoformat()
+
+    def test_append_takes_microseconds(self, tmp_path):
+        log = CycleLog(tmp_path, clock=lambda: START)
+        state = make_state()
+        log.append(state)
+
+        seconds = (
+            min(timeit.repeat(lambda: log.append(state), number=1000, repeat=3)) / 1000
+        )
+        log.close()
+
+        assert seconds < 100e-6
+
+
+def test_controller_appends_a_record_per_cycle(tmp_path):
+    """
+    Tests that the EnergyController logs its cycles with the intended actions when
+    `cycle_log_dir` is set.
+    """
+    args = load_app_args("apps/apps.yaml")
+    args["write_ledger_path"] = str(tmp_path / "write_ledger.json")
+    args["cycle_log_dir"] = str(tmp_path / "cycles")
+    fake = FakeHass(args, now=START)
+    for entity_id in args["sensors"].values():
+        fake.set_entity(entity_id, "0.0")
+    fake.set_entity(args["sensors"]["solar_production"], "5.0")
+    fake.set_entity(args["sensors"]["battery_power"], "4000.0")
+
+    controller = fake.create_app(EnergyController)
+    controller.initialize()
+    controller.terminate()
+
+    records = read_cycle_log(tmp_path / "cycles" / "cycles-20240601.bin")
+    assert len(records) == 1
+    assert records["time"][0] == START.timestamp()
+    assert records["battery_power"][0] == 4000
+    assert records["miner_intended_switch_state"][0] == 1
+    assert records["duration"][0] > 0
+
+
+def test_failing_cycle_log_does_not_stop_the_loop(tmp_path):
+    """Tests that an error of the cycle log is logged and the loop still finishes."""
+    args = load_app_args("apps/apps.yaml")
+    args["write_ledger_path"] = None
+    args["cycle_log_dir"] = str(tmp_path / "cycles")
+    fake = FakeHass(args, now=START)
+    for entity_id in args["sensors"].values():
+        fake.set_entity(entity_id, "0.0")
+    controller = fake.create_app(EnergyController)
+    controller.initialize()
+    errors = []
+    controller.error = errors.append
+
+    def fail(state, duration=None):
+        raise struct.error("required argument is not a float")
+
+    controller.cycle_log.append = fail
+    fake.now += timedelta(minutes=1)
+    controller.control_loop(None)
+    controller.terminate()
+
+    assert [error.split()[0] for error in errors] == ["cycle_log_failed"]
+    assert controller.loop_metrics.api_calls.count == 2
@@ -1,15 +1,17 @@
-
 import pytest
 from unittest.mock import Mock, call
 import sys
 from datetime import datetime, timezone, timedelta
 
 # Add the apps directory to the python path to allow for imports
-sys.path.append('apps')
+sys.path.append("apps")
 
 from miner_heater_handler import MinerHeaterHandler
 from energy_controller import EnergyController
 from system_state import SystemState
+from loop_metrics import CallCounter
+from state_cache import StateCache
+from action_recorder import ActionRecorder
 
 
 @pytest.fixture
@@ -19,22 +21,23 @@ def mock_app():
     app.get_state.return_value = "off"
     return app
 
+
 @pytest.fixture
 def miner_heater_handler(mock_app):
     """Fixture for a MinerHeaterHandler instance."""
     config = {
         "switch_entity": "switch.miner_heater",
         "power_limit_entity": "number.miner_power_limit",
-        "power_draw": 1000,
-        "min_battery_soc": 50,
     }
     return MinerHeaterHandler(mock_app, config)
 
+
 @pytest.fixture
-def energy_controller(monkeypatch):
+def energy_controller(monkeypatch, tmp_path):
     """Fixture for an EnergyController instance."""
 
-    # Prevent initialize from running validation by patching SystemState.validate_sensors
+    # Prevent initialize from running validation by patching
+    # SystemState.validate_sensors
     monkeypatch.setattr(SystemState, "validate_sensors", Mock(return_value=True))
 
     controller = Mock()
@@ -59,21 +62,39 @@ def energy_controller(monkeypatch):
         "miner_heater": {
             "switch_entity": "switch.miner_heater",
             "power_limit_entity": "number.miner_power_limit",
-            "power_draw": 1000,
-            "min_battery_soc": 50
         },
-        "dry_run_switch_entity": "input_boolean.energy_controller_dry_run"
+        "dry_run_switch_entity": "input_boolean.energy_controller_dry_run",
     }
     controller.log = Mock()
+    controller.clock = None
+    controller.cycle_log = None
+    controller.config_dir = str(tmp_path)
+    controller._monotonic = lambda: EnergyController._monotonic(controller)
+    controller._default_ledger_path = lambda: EnergyController._default_ledger_path(
+        controller
+    )
+    controller._create_action_executor = (
+        lambda: EnergyController._create_action_executor(controller)
+    )
+    controller._schedule_control_loop = (
+        lambda interval: EnergyController._schedule_control_loop(controller, interval)
+    )
+    controller._record_write = (
+        lambda method, args, kwargs: EnergyController._record_write(
+            controller, method, args, kwargs
+        )
+    )
     controller.error = Mock()
+
     def mock_get_state(entity_id, **kwargs):
         if entity_id == "input_boolean.energy_controller_dry_run":
             return "off"
         if entity_id == "switch.miner_heater":
             return "on"
         if entity_id == "number.miner_power_limit":
-            return { "state": "2000.0", "attributes": {} }
-        return "off" # default
+            return {"state": "2000.0", "attributes": {}}
+        return "off"  # default
+
     controller.get_state = Mock(side_effect=mock_get_state)
     controller.set_state = Mock()
     controller.run_every = Mock()
@@ -83,124 +104,225 @@ def energy_controller(monkeypatch):
 
     yield controller
 
+
 class TestMinerHeaterHandler:
     def test_evaluate_and_act_turn_on(self, miner_heater_handler, mock_app):
         """Test turning the miner heater on."""
         state = SystemState(
             solar_production=5000,
-            grid_power=-4000, grid_export=4000, grid_import=0,
-            solar_surplus=4000, total_surplus=4000, chp_production=0,
-            battery_soc=60, battery_power=0, battery_charging=0, battery_discharging=0,
-            miner_consumption=0, miner_power_limit=0.0, last_updated="now", is_dry_run=False,
-            house_consumption=1000, miner_surplus=4000
+            grid_power=-4000,
+            grid_export=4000,
+            grid_import=0,
+            solar_surplus=4000,
+            total_surplus=4000,
+            chp_production=0,
+            battery_soc=60,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            miner_consumption=0,
+            miner_power_limit=0.0,
+            last_updated="now",
+            is_dry_run=False,
+            house_consumption=1000,
+            miner_surplus=4000,
         )
-        mock_app.get_state.side_effect = [ "off", { "state": "0.0", "attributes": {} } ]
+        mock_app.get_state.side_effect = ["off", {"state": "0.0", "attributes": {}}]
 
         miner_heater_handler.evaluate_and_act(state)
 
-        assert state.miner_intended_switch_state == 'on'
+        assert state.miner_intended_switch_state == "on"
         assert state.miner_intended_power_limit == 4000.0
 
-    def test_evaluate_and_act_turn_off_low_surplus(self, miner_heater_handler, mock_app):
+    def test_evaluate_and_act_turn_off_low_surplus(
+        self, miner_heater_handler, mock_app
+    ):
         """Test turning the miner heater off when PV surplus is low."""
         state = SystemState(
-            solar_surplus=700, total_surplus=700, chp_production=0, battery_soc=60, battery_power=-200,
-            battery_charging=0, battery_discharging=200, grid_power=0, grid_import=0, grid_export=0,
-            solar_production=900, miner_consumption=0, miner_power_limit=2000.0, last_updated="now", is_dry_run=False,
-            house_consumption=1100, miner_surplus=-200
+            solar_surplus=700,
+            total_surplus=700,
+            chp_production=0,
+            battery_soc=60,
+            battery_power=-200,
+            battery_charging=0,
+            battery_discharging=200,
+            grid_power=0,
+            grid_import=0,
+            grid_export=0,
+            solar_production=900,
+            miner_consumption=0,
+            miner_power_limit=2000.0,
+            last_updated="now",
+            is_dry_run=False,
+            house_consumption=1100,
+            miner_surplus=-200,
         )
         mock_app.get_state.return_value = "on"
 
         miner_heater_handler.evaluate_and_act(state)
 
-        assert state.miner_intended_switch_state == 'off'
+        assert state.miner_intended_switch_state == "off"
 
-    def test_evaluate_and_act_skip_write_if_limit_unchanged(self, miner_heater_handler, mock_app):
+    def test_evaluate_and_act_skip_write_if_limit_unchanged(
+        self, miner_heater_handler, mock_app
+    ):
         """Test that a write is skipped if the power limit is unchanged."""
         state = SystemState(
             solar_production=3000,
-            grid_power=-2500, grid_export=2500, grid_import=0,
-            solar_surplus=2500, total_surplus=2500, chp_production=0,
-            battery_soc=60, battery_power=0, battery_charging=0, battery_discharging=0,
-            miner_consumption=0, miner_power_limit=2000.0, last_updated="now", is_dry_run=False,
-            house_consumption=500, miner_surplus=2500
+            grid_power=-2500,
+            grid_export=2500,
+            grid_import=0,
+            solar_surplus=2500,
+            total_surplus=2500,
+            chp_production=0,
+            battery_soc=60,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            miner_consumption=0,
+            miner_power_limit=2000.0,
+            last_updated="now",
+            is_dry_run=False,
+            house_consumption=500,
+            miner_surplus=2500,
         )
         mock_app.get_state.return_value = "on"
 
         miner_heater_handler.evaluate_and_act(state)
 
-        assert state.miner_intended_switch_state == 'on'
+        assert state.miner_intended_switch_state == "on"
         assert state.miner_intended_power_limit is None
 
-    def test_evaluate_and_act_skip_write_if_interval_not_passed(self, miner_heater_handler, mock_app, monkeypatch):
+    def test_evaluate_and_act_skip_write_if_interval_not_passed(
+        self, miner_heater_handler, mock_app, monkeypatch
+    ):
         """Test that a write is skipped if the minimum interval has not passed."""
         state = SystemState(
             solar_production=3000,
-            grid_power=-2500, grid_export=2500, grid_import=0,
-            solar_surplus=2500, total_surplus=2500, chp_production=0,
-            battery_soc=60, battery_power=0, battery_charging=0, battery_discharging=0,
-            miner_consumption=0, miner_power_limit=2000.0, last_updated="now", is_dry_run=False,
-            house_consumption=500, miner_surplus=2500
+            grid_power=-2500,
+            grid_export=2500,
+            grid_import=0,
+            solar_surplus=2500,
+            total_surplus=2500,
+            chp_production=0,
+            battery_soc=60,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            miner_consumption=0,
+            miner_power_limit=2000.0,
+            last_updated="now",
+            is_dry_run=False,
+            house_consumption=500,
+            miner_surplus=2500,
         )
 
         now = datetime.now(timezone.utc)
+
         class MockDateTime(datetime):
             @classmethod
-            def now(cls, tz=None): return now
-        monkeypatch.setattr('miner_heater_handler.datetime', MockDateTime)
+            def now(cls, tz=None):
+                return now
+
+        monkeypatch.setattr("miner_heater_handler.datetime", MockDateTime)
 
         last_write_time = (now - timedelta(seconds=30)).isoformat()
-        mock_app.get_state.side_effect = [ "on", { "state": "2000.0", "attributes": {"last_write": last_write_time} } ]
+        mock_app.get_state.side_effect = [
+            "on",
+            {"state": "2000.0", "attributes": {"last_write": last_write_time}},
+        ]
 
         miner_heater_handler.evaluate_and_act(state)
 
         assert state.miner_intended_power_limit is None
 
-    def test_evaluate_and_act_performs_write_when_conditions_met(self, miner_heater_handler, mock_app, monkeypatch):
-        """Test that a write is performed when the limit changes and the interval has passed."""
+    def test_evaluate_and_act_performs_write_when_conditions_met(
+        self, miner_heater_handler, mock_app, monkeypatch
+    ):
+        """
+        Test that a write is performed when the limit changes and the interval has
+        passed.
+        """
         state = SystemState(
             solar_production=4000,
-            grid_power=-3500, grid_export=3500, grid_import=0,
-            solar_surplus=3500, total_surplus=3500, chp_production=0,
-            battery_soc=60, battery_power=0, battery_charging=0, battery_discharging=0,
-            miner_consumption=0, miner_power_limit=2000.0, last_updated="now", is_dry_run=False,
-            house_consumption=500, miner_surplus=3500
+            grid_power=-3500,
+            grid_export=3500,
+            grid_import=0,
+            solar_surplus=3500,
+            total_surplus=3500,
+            chp_production=0,
+            battery_soc=60,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            miner_consumption=0,
+            miner_power_limit=2000.0,
+            last_updated="now",
+            is_dry_run=False,
+            house_consumption=500,
+            miner_surplus=3500,
         )
-        # Mock get_state to return 'off' for the switch, and a state with no last_write for the power limit
-        mock_app.get_state.side_effect = [
-            "off",
-            { "state": "2000.0", "attributes": {} }
-        ]
+        # Mock get_state to return 'off' for the switch, and a state with no last_write
+        # for the power limit
+        mock_app.get_state.side_effect = ["off", {"state": "2000.0", "attributes": {}}]
 
         now = datetime.now(timezone.utc)
+
         class MockDateTime(datetime):
             @classmethod
-            def now(cls, tz=None): return now
-        monkeypatch.setattr('miner_heater_handler.datetime', MockDateTime)
+            def now(cls, tz=None):
+                return now
+
+        monkeypatch.setattr("miner_heater_handler.datetime", MockDateTime)
 
         last_write_time = (now - timedelta(seconds=90)).isoformat()
-        mock_app.get_state.side_effect = [ "on", { "state": "2000.0", "attributes": {"last_write": last_write_time} } ]
+        mock_app.get_state.side_effect = [
+            "on",
+            {"state": "2000.0", "attributes": {"last_write": last_write_time}},
+        ]
 
         miner_heater_handler.evaluate_and_act(state)
 
         assert state.miner_intended_power_limit == 3000.0
 
-    def test_evaluate_and_act_with_miner_consumption(self, miner_heater_handler, mock_app):
+    def test_evaluate_and_act_with_miner_consumption(
+        self, miner_heater_handler, mock_app
+    ):
         """Test that the handler correctly uses adjusted_surplus."""
         state = SystemState(
-            solar_surplus=1000, total_surplus=1000, chp_production=0, battery_soc=60, battery_power=0,
-            battery_charging=0, battery_discharging=0, grid_power=-1000, grid_import=0, grid_export=1000,
-            solar_production=2500, miner_consumption=1000.0, miner_power_limit=1000.0, last_updated="now", is_dry_run=False,
-            house_consumption=500, miner_surplus=2000
+            solar_surplus=1000,
+            total_surplus=1000,
+            chp_production=0,
+            battery_soc=60,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            grid_power=-1000,
+            grid_import=0,
+            grid_export=1000,
+            solar_production=2500,
+            miner_consumption=1000.0,
+            miner_power_limit=1000.0,
+            last_updated="now",
+            is_dry_run=False,
+            house_consumption=500,
+            miner_surplus=2000,
         )
-        mock_app.get_state.side_effect = [ "on", { "state": "1000.0", "attributes": {} } ]
+        mock_app.get_state.side_effect = ["on", {"state": "1000.0", "attributes": {}}]
 
         miner_heater_handler.evaluate_and_act(state)
 
         assert state.miner_intended_power_limit == 2000.0
 
+
 class TestEnergyController:
 
+    def test_write_ledger_defaults_to_the_config_dir(self, energy_controller, tmp_path):
+        """Tests that runtime state is kept in AppDaemon's config dir, not in apps/."""
+        assert energy_controller.write_ledger.path == str(
+            tmp_path / "energy_controller_write_ledger.json"
+        )
+
     def test_control_loop_success(self, energy_controller, monkeypatch):
         """Tests a successful run of the control loop."""
         mock_state = Mock()
@@ -208,14 +330,33 @@ class TestEnergyController:
         mock_state.miner_surplus = 2100
         mock_state.miner_consumption = 0
         mock_state.miner_power_limit = 0.0
+        # Attributes tracked by the signal statistics
+        mock_state.total_surplus = 2100
+        mock_state.solar_surplus = 2100
+        mock_state.grid_power = -2100
+        mock_state.battery_soc = 80
         mock_from_ha = Mock(return_value=mock_state)
         monkeypatch.setattr(SystemState, "from_home_assistant", mock_from_ha)
 
         EnergyController.control_loop(energy_controller, None)
 
-        mock_from_ha.assert_called_once_with(energy_controller)
+        api = mock_from_ha.call_args.args[0]
+        cache = mock_from_ha.call_args.kwargs["cache"]
+        assert isinstance(api, CallCounter) and api.app is energy_controller
+        assert isinstance(cache, StateCache) and cache.app is api
+        mock_from_ha.assert_called_once_with(
+            api, cache=cache, config=energy_controller.controller_config
+        )
         mock_state.publish_to_ha.assert_called_once()
-        mock_state.execute_actions.assert_called_once_with(energy_controller)
+        recorder = mock_state.execute_actions.call_args.args[0]
+        assert isinstance(recorder, ActionRecorder) and recorder.app is api
+        mock_state.execute_actions.assert_called_once_with(
+            recorder,
+            cache,
+            energy_controller.write_ledger,
+            energy_controller.controller_config,
+            record_writes=False,
+        )
 
     def test_control_loop_failure(self, energy_controller, monkeypatch):
         """Tests a failed run of the control loop."""
@@ -224,5 +365,162 @@ class TestEnergyController:
 
         EnergyController.control_loop(energy_controller, None)
 
-        mock_from_ha.assert_called_once_with(energy_controller)
-        energy_controller.set_state.assert_called_with(energy_controller.args["publish_entities"]["controller_running"], state="off")
+        api = mock_from_ha.call_args.args[0]
+        assert isinstance(api, CallCounter) and api.app is energy_controller
+        mock_from_ha.assert_called_once_with(
+            api,
+            cache=mock_from_ha.call_args.kwargs["cache"],
+            config=energy_controller.controller_config,
+        )
+        energy_controller.set_state.assert_called_with(
+            energy_controller.args["publish_entities"]["controller_running"],
+            state="off",
+        )
+
+    @pytest.mark.parametrize("state_available", [True, False])
+    def test_control_loop_does_not_read_the_app_arguments(
+        self, energy_controller, monkeypatch, state_available
+    ):
+        """Tests that the loop only uses the configuration parsed at initialization."""
+        publish_entities = energy_controller.args["publish_entities"]
+        energy_controller.args = {}
+        mock_state = Mock(miner_surplus=0, miner_consumption=0, miner_power_limit=0.0)
+        monkeypatch.setattr(
+            SystemState,
+            "from_home_assistant",
+            Mock(return_value=mock_state if state_available else None),
+        )
+
+        EnergyController.control_loop(energy_controller, None)
+
+        energy_controller.error.assert_not_called()
+        if state_available:
+            assert mock_state.publish_to_ha.call_args.args[1] == publish_entities
+        else:
+            energy_controller.set_state.assert_called_with(
+                publish_entities["controller_running"], state="off"
+            )
+
+    def test_control_loop_shares_state_cache(self, energy_controller, monkeypatch):
+        """Tests that handlers and the executor read each entity only once per loop."""
+        state = SystemState(
+            solar_surplus=0,
+            total_surplus=0,
+            chp_production=0,
+            battery_soc=60,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            grid_power=0,
+            grid_import=0,
+            grid_export=0,
+            solar_production=0,
+            miner_consumption=0,
+            miner_power_limit=0.0,
+            last_updated="now",
+            is_dry_run=True,
+            house_consumption=0,
+            miner_surplus=0,
+        )
+        monkeypatch.setattr(
+            SystemState, "from_home_assistant", Mock(return_value=state)
+        )
+        energy_controller.get_state.reset_mock()
+
+        EnergyController.control_loop(energy_controller, None)
+
+        miner_reads = [
+            c
+            for c in energy_controller.get_state.call_args_list
+            if c.args == ("switch.miner_heater",)
+        ]
+        assert len(miner_reads) == 1
+
+    def test_control_loop_coalesces_overlapping_triggers(
+        self, energy_controller, monkeypatch
+    ):
+        """
+        Tests that a trigger during a running loop is not run concurrently but leads to
+        one follow-up run.
+        """
+        mock_from_ha = Mock(return_value=None)
+        monkeypatch.setattr(SystemState, "from_home_assistant", mock_from_ha)
+        energy_controller.run_in = Mock()
+        energy_controller.control_loop = lambda kwargs: EnergyController.control_loop(
+            energy_controller, kwargs
+        )
+
+        def overlapping_trigger(*args, **kwargs):
+            energy_controller.control_loop(None)
+
+        energy_controller.set_state.side_effect = overlapping_trigger
+
+        EnergyController.control_loop(energy_controller, None)
+
+        mock_from_ha.assert_called_once()
+        energy_controller.run_in.assert_called_once()
+        assert energy_controller.loop_guard.coalesced_triggers == 1
+
+
+class TestEventDrivenControlLoop:
+
+    @pytest.fixture
+    def event_controller(self, energy_controller):
+        """Re-initializes the controller fixture in event-driven mode."""
+        energy_controller.args["event_driven"] = {
+            "debounce_seconds": 5,
+            "min_interval_seconds": 30,
+            "fallback_interval_seconds": 300,
+        }
+        energy_controller.run_every.reset_mock()
+        energy_controller.listen_state = Mock()
+        energy_controller.run_in = Mock(return_value="timer")
+        EnergyController.initialize(energy_controller)
+        energy_controller._on_sensor_change = (
+            lambda *args: EnergyController._on_sensor_change(energy_controller, *args)
+        )
+        energy_controller._run_triggered_loop = (
+            lambda kwargs: EnergyController._run_triggered_loop(
+                energy_controller, kwargs
+            )
+        )
+        energy_controller.control_loop = Mock()
+        return energy_controller
+
+    def test_subscribes_to_sensors_with_fallback(self, event_controller):
+        """Tests that every input sensor is listened to and the periodic run is kept."""
+        listened = [c.args[1] for c in event_controller.listen_state.call_args_list]
+        assert listened == list(event_controller.args["sensors"].values())
+        event_controller.run_every.assert_called_once()
+        assert event_controller.run_every.call_args.args[1:] == ("now", 300)
+
+    def test_burst_is_coalesced(self, event_controller):
+        """Tests that a burst of sensor updates schedules a single run."""
+        event_controller._on_sensor_change(
+            "sensor.grid_power", "state", "100", "200", {}
+        )
+        event_controller._on_sensor_change(
+            "sensor.battery_soc", "state", "50", "51", {}
+        )
+
+        event_controller.run_in.assert_called_once()
+        event_controller.run_in.reset_mock()
+
+        event_controller._run_triggered_loop({})
+        event_controller.control_loop.assert_called_once()
+
+        event_controller._on_sensor_change(
+            "sensor.grid_power", "state", "200", "300", {}
+        )
+        event_controller.run_in.assert_called_once()
+
+    def test_min_interval_delays_run(self, event_controller, monkeypatch):
+        """Tests that a change shortly after a run waits for the minimum interval."""
+        event_controller.loop_guard.clock = lambda: 110.0
+        event_controller.loop_guard.last_started = 100.0
+
+        event_controller._on_sensor_change(
+            "sensor.grid_power", "state", "100", "200", {}
+        )
+
+        assert event_controller.run_in.call_args.args[1] == 20.0
@@ -0,0 +1,102 @@
+import pytest
+import sys
+from datetime import datetime, timezone
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from fake_hass import FakeHass
+from energy_controller import EnergyController
+from replay import load_app_args
+
+
+@pytest.fixture
+def fake():
+    """Fixture for a FakeHass with a few entities."""
+    fake = FakeHass({}, now=datetime(2024, 1, 1, tzinfo=timezone.utc))
+    fake.set_entity("switch.miner", "off")
+    fake.set_entity("number.miner_power_limit", "0.0", {"last_write": "earlier"})
+    return fake
+
+
+class TestFakeHass:
+    def test_get_state_variants(self, fake):
+        """Test that reads behave like AppDaemon's get_state."""
+        assert fake.get_state("switch.miner") == "off"
+        assert (
+            fake.get_state("number.miner_power_limit", attribute="last_write")
+            == "earlier"
+        )
+        assert (
+            fake.get_state("number.miner_power_limit", attribute="all")["state"]
+            == "0.0"
+        )
+        assert fake.get_state("switch.miner", attribute="last_changed") == datetime(
+            2024, 1, 1, tzinfo=timezone.utc
+        )
+        assert fake.get_state("switch.missing") is None
+        assert set(fake.get_state()) == {"switch.miner", "number.miner_power_limit"}
+        assert fake.call_counts["get_state"] == 6
+
+    def test_actions_are_applied_and_recorded(self, fake):
+        """Test that service calls change the state and are recorded."""
+        fake.turn_on("switch.miner")
+        fake.set_state("number.miner_power_limit", state=3000.0, attributes={})
+
+        assert fake.get_state("switch.miner") == "on"
+        assert fake.get_state("number.miner_power_limit") == 3000.0
+        assert [action[1:] for action in fake.actions] == [
+            ("turn_on", "switch.miner", "on"),
+            ("set_state", "number.miner_power_limit", 3000.0),
+        ]
+        assert fake.action_counts[("turn_on", "switch.miner")] == 1
+
+    def test_state_listeners_are_called_on_change(self, fake):
+        """
+        Test that listeners fire when an entity changes state, but not when it is set to
+        the same state.
+        """
+        changes = []
+        fake.listen_state(
+            lambda entity, attribute, old, new, kwargs: changes.append(
+                (entity, old, new)
+            ),
+            "switch.miner",
+        )
+
+        fake.turn_on("switch.miner")
+        fake.turn_on("switch.miner")
+
+        assert changes == [("switch.miner", "off", "on")]
+
+    def test_create_app_runs_energy_controller(self, tmp_path):
+        """Test that the real EnergyController runs a control loop against the fake."""
+        args = load_app_args("apps/apps.yaml")
+        args["write_ledger_path"] = str(tmp_path / "write_ledger.json")
+        fake = FakeHass(args)
+        for entity_id in args["sensors"].values():
+            fake.set_entity(entity_id, "0.0")
+        fake.set_entity(args["sensors"]["solar_production"], "5.0")
+        fake.set_entity(args["sensors"]["battery_power"], "4000.0")
+
+        controller = fake.create_app(EnergyController)
+        controller.initialize()
+        assert controller.action_executor.wait(timeout=5)
+
+        assert fake.get_state(args["miner_heater"]["switch_entity"]) == "on"
+        assert fake.get_state(args["publish_entities"]["controller_running"]) == "on"
+        assert len(fake.timers) == 1
+        sensor_listeners = [
+            listener
+            for listener in fake.listeners
+            if listener[1] in args["sensors"].values()
+        ]
+        assert len(sensor_listeners) == len(args["sensors"])
+        assert fake.get_state(args["publish_entities"]["loop_total_p50"]) > 0
+        assert controller.loop_metrics.summary()["loop_api_calls_p50"] > 0
+        assert (
+            controller.write_ledger.last_value(
+                args["miner_heater"]["power_limit_entity"]
+            )
+            is not None
+        )
@@ -0,0 +1,170 @@
+import pytest
+from unittest.mock import Mock
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from handler_graph import HandlerScheduler, order_handlers
+from miner_heater_handler import MinerHeaterHandler
+from signal_stats import SignalStats
+from write_ledger import WriteLedger
+from system_state import SystemState
+
+
+class FakeHandler:
+    """A handler that records its evaluations and sets a fixed intended action."""
+
+    def __init__(self, inputs, outputs, input_entities=(), value="on"):
+        self.INPUTS = inputs
+        self.OUTPUTS = outputs
+        self.input_entities = input_entities
+        self.app = Mock()
+        self.value = value
+        self.evaluations = 0
+
+    def evaluate_and_act(self, state, cache=None):
+        self.evaluations += 1
+        for field in self.OUTPUTS:
+            setattr(state, field, self.value)
+
+
+def make_state(miner_surplus=3000.0, battery_soc=80.0):
+    return SystemState(
+        solar_surplus=0,
+        total_surplus=0,
+        chp_production=0,
+        battery_soc=battery_soc,
+        battery_power=0,
+        battery_charging=0,
+        battery_discharging=0,
+        grid_power=0,
+        grid_import=0,
+        grid_export=0,
+        solar_production=0,
+        miner_consumption=0,
+        miner_power_limit=0.0,
+        house_consumption=0,
+        miner_surplus=miner_surplus,
+        last_updated="now",
+        is_dry_run=False,
+    )
+
+
+class TestOrderHandlers:
+    def test_consumer_runs_after_producer(self):
+        """
+        Tests that a handler reading another handler's output runs after it, whatever
+        the configured order.
+        """
+        consumer = FakeHandler(
+            ("miner_intended_switch_state",), ("chp_intended_switch_state",)
+        )
+        producer = FakeHandler(("miner_surplus",), ("miner_intended_switch_state",))
+
+        assert order_handlers([consumer, producer]) == [producer, consumer]
+
+    def test_overriding_handlers_keep_configured_order(self):
+        """Tests that handlers setting the same output run in configuration order."""
+        first = FakeHandler(("miner_surplus",), ("miner_intended_switch_state",))
+        second = FakeHandler(("battery_soc",), ("miner_intended_switch_state",))
+
+        assert order_handlers([first, second]) == [first, second]
+
+    def test_cycle_is_rejected(self):
+        """Tests that cyclic dependencies fail when the handlers are loaded."""
+        first = FakeHandler(
+            ("chp_intended_switch_state",), ("miner_intended_switch_state",)
+        )
+        second = FakeHandler(
+            ("miner_intended_switch_state",), ("chp_intended_switch_state",)
+        )
+
+        with pytest.raises(ValueError, match="cycle"):
+            order_handlers([first, second])
+
+
+class TestHandlerScheduler:
+    def test_unchanged_inputs_restore_previous_actions(self):
+        """
+        Tests that a handler is skipped within its deadband and its intended actions are
+        kept.
+        """
+        clock = Mock(return_value=0.0)
+        handler = FakeHandler(("miner_surplus",), ("miner_intended_switch_state",))
+        scheduler = HandlerScheduler(
+            [handler], deadbands={"miner_surplus": {"absolute": 100}}, clock=clock
+        )
+
+        scheduler.run(make_state(3000))
+        state = make_state(3050)
+        scheduler.run(state)
+
+        assert handler.evaluations == 1
+        assert state.miner_intended_switch_state == "on"
+        assert scheduler.skipped == 1
+
+    def test_changed_input_reevaluates(self):
+        """
+        Tests that an input change beyond the deadband, an entity change or age leads to
+        a new evaluation.
+        """
+        clock = Mock(return_value=0.0)
+        reader = Mock()
+        reader.get_state.return_value = "off"
+        handler = FakeHandler(
+            ("miner_surplus",),
+            ("miner_intended_switch_state",),
+            input_entities=("switch.chp",),
+        )
+        scheduler = HandlerScheduler(
+            [handler],
+            deadbands={"miner_surplus": {"absolute": 100}},
+            max_age_seconds=60,
+            clock=clock,
+        )
+
+        scheduler.run(make_state(3000), reader)
+        scheduler.run(make_state(3200), reader)
+        assert handler.evaluations == 2
+
+        reader.get_state.return_value = "on"
+        scheduler.run(make_state(3200), reader)
+        assert handler.evaluations == 3
+
+        clock.return_value = 60.0
+        scheduler.run(make_state(3200), reader)
+        assert handler.evaluations == 4
+
+    def test_smoothed_statistic_is_compared_instead_of_latest_value(self):
+        """
+        Tests that a handler deciding on a statistic is re-evaluated when the statistic
+        moves, even if the latest value does not.
+        """
+        app = Mock()
+        app.get_state.return_value = "off"
+        stats = SignalStats(fields=["miner_surplus"], window=3)
+        handler = MinerHeaterHandler(
+            app,
+            {
+                "switch_entity": "switch.miner",
+                "power_limit_entity": "number.miner_power_limit",
+                "activation_threshold": 2000,
+                "surplus_statistic": "mean",
+            },
+            write_ledger=WriteLedger(),
+            signal_stats=stats,
+        )
+        scheduler = HandlerScheduler(
+            [handler],
+            deadbands={"miner_surplus": {"absolute": 100}},
+            clock=Mock(return_value=0.0),
+        )
+
+        for timestamp, surplus in enumerate([0.0, 0.0, 2050.0, 2050.0, 2050.0]):
+            state = make_state(surplus)
+            stats.update(state, timestamp)
+            scheduler.run(state)
+
+        assert state.miner_intended_switch_state == "on"
+        assert scheduler.evaluated == 4
@@ -0,0 +1,68 @@
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from loop_guard import LoopGuard
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLoopGuard:
+    def test_triggers_during_a_run_are_coalesced(self):
+        """
+        Tests that triggers arriving during a run are refused and lead to one follow-up
+        run.
+        """
+        clock = FakeClock()
+        guard = LoopGuard(60, clock=clock)
+
+        assert guard.try_enter()
+        assert not guard.try_enter()
+        assert not guard.try_enter()
+        clock.now += 5
+
+        assert guard.exit()
+        assert guard.coalesced_triggers == 2
+        assert guard.seconds_until_due() == 55
+
+    def test_run_is_not_due_before_the_interval(self):
+        """Tests that a trigger shortly after a run is skipped without a follow-up."""
+        clock = FakeClock()
+        guard = LoopGuard(60, clock=clock)
+        assert guard.try_enter()
+        assert not guard.exit()
+
+        clock.now += 10
+        assert not guard.try_enter()
+        clock.now += 45
+        assert guard.try_enter()
+        assert not guard.exit()
+
+    def test_overruns_back_off_the_interval(self):
+        """
+        Tests that overruns are counted and stretch the effective interval up to the
+        limit.
+        """
+        clock = FakeClock()
+        guard = LoopGuard(60, max_backoff_factor=4, clock=clock)
+
+        for expected_interval in (120, 240, 240):
+            assert guard.try_enter()
+            clock.now += 90
+            guard.exit()
+            assert guard.effective_interval == expected_interval
+            clock.now += guard.seconds_until_due()
+        assert guard.overruns == 3
+
+        assert guard.try_enter()
+        clock.now += 10
+        guard.exit()
+        assert guard.effective_interval == 120
+        assert guard.summary() == {"loop_overruns": 3, "loop_coalesced_triggers": 0}
@@ -0,0 +1,80 @@
+import pytest
+from unittest.mock import Mock, call
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from loop_metrics import LoopMetrics, RingBuffer, CallCounter
+
+
+class TestRingBuffer:
+    def test_keeps_only_latest_samples(self):
+        buffer = RingBuffer(3)
+        for value in range(5):
+            buffer.append(value)
+
+        assert sorted(buffer.values()) == [2.0, 3.0, 4.0]
+        assert buffer.count == 3
+
+
+class TestLoopMetrics:
+    def test_summary_percentiles(self):
+        """Test p50, p95 and max over the window in milliseconds."""
+        metrics = LoopMetrics(window=100)
+        for i in range(1, 101):
+            metrics.record({"total": i / 1000}, api_calls=5)
+
+        summary = metrics.summary()
+
+        assert summary["loop_total_p50"] == pytest.approx(51.0)
+        assert summary["loop_total_p95"] == pytest.approx(95.0)
+        assert summary["loop_total_max"] == pytest.approx(100.0)
+        assert summary["loop_api_calls_max"] == 5
+        assert "loop_read_state_p50" not in summary
+
+    def test_publish_configured_metrics(self):
+        """Test that only metrics listed in publish_entities are published."""
+        metrics = LoopMetrics()
+        metrics.record({"total": 0.0123, "publish": 0.002}, api_calls=7)
+        app = Mock()
+
+        metrics.publish(
+            app,
+            {
+                "loop_total_max": "sensor.loop_max",
+                "loop_api_calls_p50": "sensor.loop_calls",
+            },
+        )
+
+        app.set_state.assert_has_calls(
+            [
+                call(
+                    "sensor.loop_max",
+                    state=12.3,
+                    attributes={"unit_of_measurement": "ms"},
+                ),
+                call("sensor.loop_calls", state=7.0, attributes={}),
+            ],
+            any_order=True,
+        )
+        assert app.set_state.call_count == 2
+
+
+class TestCallCounter:
+    def test_counts_only_ha_calls(self):
+        """
+        Test that reads and writes are counted and passed through, and other calls are
+        not counted.
+        """
+        app = Mock()
+        app.get_state.return_value = "on"
+        counter = CallCounter(app)
+
+        assert counter.get_state("switch.miner") == "on"
+        counter.turn_off("switch.miner")
+        counter.log("message")
+
+        app.turn_off.assert_called_once_with("switch.miner")
+        app.log.assert_called_once_with("message")
+        assert counter.calls == 2
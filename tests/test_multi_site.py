@@ -0,0 +1,182 @@
+import pytest
+import sys
+from datetime import datetime, timedelta, timezone
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from fake_hass import FakeHass, site_entities
+from multi_site import (
+    MultiSiteController,
+    SharedStateCache,
+    StaggeredScheduler,
+    site_args,
+)
+from replay import load_app_args
+
+START = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def set_site_sensors(fake, site, battery_power):
+    for entity_id in site["sensors"].values():
+        fake.set_entity(entity_id, "0.0")
+    fake.set_entity(site["sensors"]["solar_production"], "5.0")
+    fake.set_entity(site["sensors"]["battery_power"], str(battery_power))
+    fake.set_entity(site["dry_run_switch_entity"], "off")
+    fake.set_entity(site["miner_heater"]["switch_entity"], "off")
+
+
+@pytest.fixture
+def defaults(tmp_path):
+    args = load_app_args("apps/apps.yaml")
+    del args["event_driven"]
+    args["write_ledger_path"] = str(tmp_path / "write_ledger.json")
+    return args
+
+
+def create_host(defaults, battery_powers):
+    """
+    Creates a MultiSiteController on a FakeHass with one site per battery power. Sites
+    without one have no sensors.
+    """
+    sites = {
+        f"site{index}": site_entities(defaults, f"site{index}")
+        for index in range(len(battery_powers))
+    }
+    fake = FakeHass({"site_defaults": defaults, "sites": sites}, now=START)
+    for name, battery_power in zip(sites, battery_powers):
+        if battery_power is not None:
+            set_site_sensors(
+                fake, site_args(name, defaults, sites[name]), battery_power
+            )
+    host = fake.create_app(MultiSiteController)
+    host.initialize()
+    return fake, host
+
+
+class TestStaggeredScheduler:
+    def test_loops_are_spread_over_the_interval(self):
+        scheduler = StaggeredScheduler(clock=lambda: 0.0)
+        for index in range(20):
+            scheduler.add(lambda kwargs: None, 60, f"site{index}")
+
+        due_times = sorted(entry[0] for entry in scheduler._queue)
+
+        assert due_times[0] == 0 and due_times[-1] < 60
+        gaps = [later - earlier for earlier, later in zip(due_times, due_times[1:])]
+        assert max(gaps) < 2.5 * 60 / 20
+
+    def test_due_loops_keep_their_phase_and_skip_missed_runs(self):
+        now = [0.0]
+        scheduler = StaggeredScheduler(clock=lambda: now[0])
+        scheduler.add("a", 60, "a")
+        scheduler.add("b", 60, "b")
+
+        assert scheduler.pop_due(0.0) == [("a", "a")]
+        phase_b = scheduler.next_due()
+        assert 0 < phase_b < 60
+        assert scheduler.pop_due(phase_b) == [("b", "b")]
+        assert scheduler.pop_due(59.0) == []
+        # Both are late by several intervals and run once
+        assert scheduler.pop_due(200.0) == [("a", "a"), ("b", "b")]
+        assert sorted(entry[0] for entry in scheduler._queue) == [
+            pytest.approx(phase_b + 180),
+            240.0,
+        ]
+
+
+def test_site_args_merge_sections_and_separate_files(tmp_path):
+    defaults = {
+        "miner_heater": {"max_power": 6000, "power_step": 1000},
+        "write_ledger_path": str(tmp_path / "ledger.json"),
+        "cycle_log_dir": str(tmp_path / "cycles"),
+    }
+
+    args = site_args("north", defaults, {"miner_heater": {"power_step": 500}})
+
+    assert args["miner_heater"] == {"max_power": 6000, "power_step": 500}
+    assert args["write_ledger_path"] == str(tmp_path / "ledger_north.json")
+    assert args["cycle_log_dir"] == str(tmp_path / "cycles" / "north")
+    assert defaults["miner_heater"]["power_step"] == 1000
+
+
+def test_site_args_keep_in_memory_ledger(defaults):
+    defaults["write_ledger_path"] = None
+    defaults["cycle_log_dir"] = None
+
+    assert site_args("north", defaults, {})["write_ledger_path"] is None
+    assert site_args("north", defaults, {})["cycle_log_dir"] is None
+    fake, host = create_host(defaults, [4000.0])
+    assert host.sites["site0"].write_ledger.path is None
+    host.terminate()
+
+
+def test_shared_state_cache_reads_all_states_once_per_max_age():
+    fake = FakeHass({}, now=START)
+    fake.set_entity("sensor.a", "1.0", {"unit": "W"})
+    now = [0.0]
+    cache = SharedStateCache(fake, max_age_seconds=1.0, clock=lambda: now[0])
+
+    assert cache.get_state("sensor.a") == "1.0"
+    assert cache.get_state("sensor.a", attribute="unit") == "W"
+    assert cache.get_state("sensor.missing", default="x") == "x"
+    now[0] = 2.0
+    assert cache.get_state("sensor.a", attribute="all")["state"] == "1.0"
+    assert fake.call_counts["get_state"] == cache.refreshes == 2
+
+
+class TestMultiSiteController:
+    def test_sites_run_staggered_with_one_read_per_tick(self, defaults):
+        """
+        Tests that each site runs once per interval on its own entities, with one bulk
+        read per tick.
+        """
+        fake, host = create_host(defaults, [4000.0, 0.0, 4000.0])
+
+        assert list(host.sites) == ["site0", "site1", "site2"]
+        assert len(fake.timers) == 1
+        # The first loops run at their phase, not during initialization
+        assert fake.action_counts == {}
+
+        reads = fake.call_counts["get_state"]
+        fake.now += timedelta(seconds=60)
+        host.tick(None)
+        host.action_executor.wait()
+
+        assert fake.call_counts["get_state"] - reads == 1
+        assert fake.get_state("switch.deiner_active_site0") == "on"
+        assert fake.get_state("switch.deiner_active_site1") == "off"
+        assert fake.get_state("switch.deiner_active_site2") == "on"
+        assert fake.get_state("binary_sensor.controller_running_site1") == "on"
+        assert fake.get_state("binary_sensor.controller_running") is None
+        assert host.sites["site0"].write_ledger is not host.sites["site2"].write_ledger
+        assert host.sites["site0"].action_executor is host.action_executor
+        host.terminate()
+
+    def test_failing_site_does_not_stop_the_others(self, defaults):
+        fake, host = create_host(defaults, [4000.0, 4000.0])
+
+        def fail(state, cache):
+            raise RuntimeError("broken handler")
+
+        host.sites["site0"].handler_scheduler.run = fail
+        errors = []
+        host.error = errors.append
+        host.structured_log.app = host
+
+        fake.now += timedelta(seconds=60)
+        host.tick(None)
+        host.action_executor.wait()
+
+        assert fake.get_state("switch.deiner_active_site1") == "on"
+        assert errors == [
+            "site_loop_failed site=site0 error=\"RuntimeError('broken handler')\""
+        ]
+        host.terminate()
+
+    def test_sites_with_invalid_configuration_are_skipped(self, defaults):
+        fake, host = create_host(defaults, [4000.0, None])
+
+        assert list(host.sites) == ["site0"]
+        assert len(host.scheduler) == 1
+        host.terminate()
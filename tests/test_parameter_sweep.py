@@ -0,0 +1,137 @@
+import pytest
+import sys
+import warnings
+from datetime import datetime, timedelta, timezone
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from parameter_sweep import (
+    apply_parameters,
+    grid_combinations,
+    load_history,
+    main,
+    random_combinations,
+    sweep,
+)
+from replay import ReplayEngine, read_history_csv
+
+START = datetime(2024, 6, 1, 10, 0, tzinfo=timezone.utc)
+
+ARGS = {
+    "sensors": {
+        "grid_power": "sensor.grid_power",
+        "battery_soc": "sensor.battery_soc",
+        "battery_power": "sensor.battery_power",
+        "solar_production": "sensor.solar_production",
+        "miner_consumption": "sensor.miner_consumption",
+        "chp_production": "sensor.chp_production",
+    },
+    "miner_heater": {
+        "switch_entity": "switch.miner",
+        "power_limit_entity": "number.miner_power_limit",
+    },
+    "chp_handler": {"switch_entity": "switch.chp"},
+    "battery_handler": {"disable_charge_switch": "switch.disable_charge"},
+}
+
+
+@pytest.fixture
+def history(tmp_path):
+    """
+    A history CSV with two hours of a full battery exporting a PV surplus of 1.5 to 3.5
+    kW.
+    """
+    path = tmp_path / "history.csv"
+    lines = [
+        "timestamp,grid_power,battery_soc,battery_power,solar_production,miner_consumption,chp_production"
+    ]
+    for minute in range(120):
+        surplus = 1500 + 2000 * (minute % 60) / 60
+        lines.append(
+            f"{(START + timedelta(minutes=minute)).isoformat()},{-surplus},100,{surplus},{surplus / 1000 + 0.5},0,0"
+        )
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def test_grid_and_random_combinations():
+    assert grid_combinations({"a.x": [1, 2], "b.y": [3]}) == [
+        {"a.x": 1, "b.y": 3},
+        {"a.x": 2, "b.y": 3},
+    ]
+
+    samples = random_combinations({"a.x": (0, 10), "b.y": (0.0, 1.0)}, 5, seed=1)
+    assert samples == random_combinations(
+        {"a.x": (0, 10), "b.y": (0.0, 1.0)}, 5, seed=1
+    )
+    assert all(
+        isinstance(sample["a.x"], int) and 0 <= sample["a.x"] <= 10
+        for sample in samples
+    )
+    assert all(isinstance(sample["b.y"], float) for sample in samples)
+
+
+def test_apply_parameters_does_not_modify_base_args():
+    args = apply_parameters(ARGS, {"miner_heater.power_step": 500})
+
+    assert args["miner_heater"]["power_step"] == 500
+    assert "power_step" not in ARGS["miner_heater"]
+
+
+def test_sweep_matches_serial_replay_and_ranks_results(history):
+    """
+    Tests that the pooled runs over shared memory agree with a serial replay and are
+    ranked best first.
+    """
+    times, batch = load_history(history)
+    combinations = grid_combinations(
+        {"miner_heater.activation_threshold": [1000, 2000, 3000]}
+    )
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        results = sweep(ARGS, times, batch, combinations, workers=2)
+
+    assert [
+        result.parameters["miner_heater.activation_threshold"] for result in results
+    ] == [1000, 2000, 3000]
+    assert results[0].self_consumption > results[-1].self_consumption
+    for result in results:
+        args = apply_parameters(ARGS, result.parameters)
+        summary = ReplayEngine(args).run(read_history_csv(history, args["sensors"]))
+        assert result.self_consumption == pytest.approx(
+            summary.estimated_self_consumption
+        )
+        assert result.toggles == sum(summary.switch_toggles.values())
+        assert result.power_limit_writes == summary.power_limit_writes
+
+
+def test_main_writes_ranked_csv(history, tmp_path, capsys):
+    output = tmp_path / "results.csv"
+
+    main(
+        [
+            str(history),
+            "--grid",
+            "miner_heater.power_step=500,1000",
+            "--random",
+            "chp_handler.power_draw_threshold=500:2000",
+            "--samples",
+            "2",
+            "--workers",
+            "2",
+            "--output",
+            str(output),
+        ]
+    )
+
+    assert (
+        "Replaying 120 samples with 4 parameter combinations."
+        in capsys.readouterr().out
+    )
+    lines = output.read_text().splitlines()
+    assert lines[0].startswith(
+        "rank,chp_handler.power_draw_threshold,miner_heater.power_step,self_consumption"
+    )
+    assert len(lines) == 5
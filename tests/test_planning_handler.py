@@ -0,0 +1,238 @@
+import pytest
+import numpy as np
+from datetime import datetime, timezone
+from unittest.mock import Mock
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from controller_config import ConfigError
+from forecast import ProfileSource
+from planning_handler import PlanningHandler
+from system_state import SystemState
+
+NOON = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+# The device sections the planner takes its entities and limits from
+DEVICE_CONFIGS = {
+    "miner_config": {
+        "switch_entity": "switch.miner",
+        "power_limit_entity": "number.miner_power_limit",
+    },
+    "chp_config": {"switch_entity": "switch.chp"},
+    "battery_config": {"disable_charge_switch": "switch.disable_charge"},
+}
+
+
+def make_app(forecast):
+    app = Mock()
+
+    def get_state(entity_id, attribute=None):
+        if entity_id == "sensor.forecast":
+            return forecast
+        return "off"
+
+    app.get_state = Mock(side_effect=get_state)
+    return app
+
+
+def make_state(battery_soc):
+    return SystemState(
+        solar_surplus=0,
+        total_surplus=0,
+        chp_production=0,
+        battery_soc=battery_soc,
+        battery_power=0,
+        battery_charging=0,
+        battery_discharging=0,
+        grid_power=0,
+        grid_import=0,
+        grid_export=0,
+        solar_production=0,
+        miner_consumption=0,
+        miner_power_limit=0.0,
+        house_consumption=0,
+        miner_surplus=0,
+        last_updated="now",
+        is_dry_run=False,
+    )
+
+
+@pytest.fixture
+def profile_file(tmp_path):
+    path = tmp_path / "consumption.csv"
+    path.write_text(
+        "hour,consumption\n" + "".join(f"{hour},500\n" for hour in range(24))
+    )
+    return str(path)
+
+
+class TestProfileSource:
+    def test_hourly_file_starts_at_current_hour(self, tmp_path):
+        """Tests that a daily profile is rotated to start at the current hour."""
+        path = tmp_path / "profile.csv"
+        path.write_text(
+            "hour,value\n" + "".join(f"{hour},{hour * 10}\n" for hour in range(24))
+        )
+        source = ProfileSource({"file": str(path), "time_zone": "UTC"})
+
+        values = source.values(None, NOON, 24, 3600)
+
+        assert values[0] == 120 and values[12] == 0 and values[-1] == 110
+
+    def test_hourly_file_is_in_local_hours(self, tmp_path):
+        """
+        Tests that the hours of a daily profile are taken in the configured time zone,
+        not in UTC.
+        """
+        path = tmp_path / "profile.csv"
+        path.write_text(
+            "hour,value\n" + "".join(f"{hour},{hour * 10}\n" for hour in range(24))
+        )
+        source = ProfileSource({"file": str(path), "time_zone": "Europe/Berlin"})
+
+        values = source.values(None, NOON, 24, 3600)
+
+        # Noon UTC is 14:00 in Berlin in summer
+        assert values[0] == 140 and values[10] == 0
+
+    def test_unknown_time_zone_is_rejected(self, tmp_path):
+        with pytest.raises(ConfigError, match="time_zone"):
+            ProfileSource({"file": "profile.csv", "time_zone": "Mars/Olympus"})
+
+    def test_attribute_series_is_forward_filled(self):
+        """
+        Tests that timestamped forecast entries are resampled onto the planning steps.
+        """
+        reader = Mock()
+        reader.get_state.return_value = [
+            {"period_start": "2024-06-01T12:00:00+00:00", "pv_estimate": 4.0},
+            {"period_start": "2024-06-01T14:00:00+00:00", "pv_estimate": 1.0},
+        ]
+        source = ProfileSource(
+            {
+                "entity": "sensor.forecast",
+                "attribute": "forecast",
+                "value_key": "pv_estimate",
+                "scale": 1000,
+            }
+        )
+
+        values = source.values(reader, NOON, 4, 3600)
+
+        assert list(values) == [4000, 4000, 1000, 1000]
+
+
+class TestPlanningHandler:
+    def test_runs_miner_on_surplus_and_chp_on_deficit(self, profile_file):
+        """
+        Tests that the plan uses surplus for the miner and covers an expensive deficit
+        with the CHP.
+        """
+        app = make_app([6000] * 4 + [0] * 20)
+        handler = PlanningHandler(
+            app,
+            {
+                "solar_forecast": {"entity": "sensor.forecast"},
+                "consumption_profile": {"file": profile_file, "column": "consumption"},
+                "battery_capacity_wh": 2000,
+                "grid_import_price": 0.30,
+                "grid_export_price": 0.0,
+                "chp_cost_per_kwh": 0.05,
+                "miner_value_per_kwh": 0.05,
+                "battery_terminal_value_per_kwh": 0.0,
+            },
+            clock=lambda: NOON,
+            **DEVICE_CONFIGS,
+        )
+
+        state = make_state(battery_soc=100)
+        handler.evaluate_and_act(state)
+
+        plan = handler.plan
+        assert state.miner_intended_switch_state == "on"
+        assert state.miner_intended_power_limit == plan.miner_power[0] > 0
+        assert not plan.chp_on[0]
+        # Without solar, the CHP covers the house and recharges the battery instead of
+        # expensive grid import
+        assert plan.chp_on[4:].any()
+        assert not plan.miner_power[4:].any()
+        assert state.battery_intended_charge_switch_state == "off"
+
+    def test_solves_within_cpu_budget(self, profile_file):
+        """Tests that a 24 hour plan with 15 minute steps solves well within 200 ms."""
+        app = make_app(list(np.clip(np.sin(np.linspace(0, np.pi, 96)) * 8000, 0, None)))
+        handler = PlanningHandler(
+            app,
+            {
+                "solar_forecast": {"entity": "sensor.forecast"},
+                "consumption_profile": {"file": profile_file, "column": "consumption"},
+                "step_minutes": 15,
+            },
+            clock=lambda: NOON,
+            **DEVICE_CONFIGS,
+        )
+
+        handler.evaluate_and_act(make_state(battery_soc=50))
+
+        assert handler.plan.solve_seconds < 0.2
+        assert len(handler.plan.miner_power) == 96
+
+    def test_battery_grid_is_coarsened_over_budget_and_refined_again(
+        self, profile_file
+    ):
+        """
+        Tests that one slow solve coarsens the battery grid only until solves are fast
+        again.
+        """
+        app = make_app([6000] * 24)
+        handler = PlanningHandler(
+            app,
+            {
+                "solar_forecast": {"entity": "sensor.forecast"},
+                "consumption_profile": {"file": profile_file, "column": "consumption"},
+            },
+            clock=lambda: NOON,
+            **DEVICE_CONFIGS,
+        )
+        solve = handler.solve
+
+        def slow_solve(*args):
+            plan = solve(*args)
+            plan.solve_seconds = 1.0
+            return plan
+
+        handler.solve = slow_solve
+        handler.evaluate_and_act(make_state(battery_soc=50))
+        assert handler.soc_levels == 27
+
+        handler.solve = solve
+        levels = []
+        for _ in range(3):
+            handler.evaluate_and_act(make_state(battery_soc=50))
+            levels.append(handler.soc_levels)
+
+        assert levels == [40, 41, 41]
+
+    def test_missing_forecast_keeps_reactive_decisions(self, profile_file):
+        """
+        Tests that the planner leaves the intended actions alone without a forecast.
+        """
+        app = make_app(None)
+        handler = PlanningHandler(
+            app,
+            {
+                "solar_forecast": {"entity": "sensor.forecast"},
+                "consumption_profile": {"file": profile_file, "column": "consumption"},
+            },
+            clock=lambda: NOON,
+            **DEVICE_CONFIGS,
+        )
+        state = make_state(battery_soc=50)
+        state.miner_intended_switch_state = "on"
+
+        handler.evaluate_and_act(state)
+
+        assert state.miner_intended_switch_state == "on"
+        assert handler.plan is None
@@ -0,0 +1,168 @@
+import pytest
+import sys
+from datetime import datetime, timedelta, timezone
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from plant_simulator import (
+    PlantSimulator,
+    PlantParameters,
+    ClearSkyIrradiance,
+    DailyLoadProfile,
+    simulate,
+)
+from replay import load_app_args
+
+
+@pytest.fixture
+def args():
+    return load_app_args("apps/apps.yaml")
+
+
+def entity(args, section, key):
+    return args[section][key]
+
+
+class TestPlantModel:
+    def test_surplus_charges_battery_unless_disabled(self, args):
+        """
+        Tests that PV surplus charges the battery, and is exported while charging is
+        disabled.
+        """
+        simulator = PlantSimulator(args, plant=PlantParameters(initial_soc=50))
+        simulator.step(irradiance=500, house_w=1000)
+        assert float(simulator.get_state(args["sensors"]["battery_power"])) == 3000
+        assert float(simulator.get_state(args["sensors"]["grid_power"])) == 0
+        assert float(simulator.get_state(args["sensors"]["solar_production"])) == 4.0
+
+        simulator.set_entity(
+            entity(args, "battery_handler", "disable_charge_switch"), "on"
+        )
+        simulator.step(irradiance=500, house_w=1000)
+        assert float(simulator.get_state(args["sensors"]["battery_power"])) == 0
+        assert float(simulator.get_state(args["sensors"]["grid_power"])) == -3000
+
+    def test_battery_stops_at_min_soc(self, args):
+        simulator = PlantSimulator(args, plant=PlantParameters(initial_soc=10))
+        simulator.step(irradiance=0, house_w=800)
+        assert float(simulator.get_state(args["sensors"]["battery_power"])) == 0
+        assert float(simulator.get_state(args["sensors"]["grid_power"])) == 800
+
+    def test_miner_draws_its_power_limit(self, args):
+        simulator = PlantSimulator(args, plant=PlantParameters(initial_soc=10))
+        simulator.set_entity(entity(args, "miner_heater", "switch_entity"), "on")
+        simulator.set_entity(
+            entity(args, "miner_heater", "power_limit_entity"), "3000.0"
+        )
+        simulator.step(irradiance=0, house_w=0)
+        assert float(simulator.get_state(args["sensors"]["miner_consumption"])) == 3000
+        assert float(simulator.get_state(args["sensors"]["grid_power"])) == 3000
+
+    def test_chp_keeps_running_for_min_run_time(self, args):
+        """
+        Tests that a CHP switched off early keeps producing until its minimum run time
+        has passed.
+        """
+        simulator = PlantSimulator(
+            args, plant=PlantParameters(chp_min_run_minutes=1), step_seconds=10
+        )
+        chp_switch = entity(args, "chp_handler", "switch_entity")
+        simulator.set_entity(chp_switch, "on")
+        simulator.step(irradiance=0, house_w=0)
+        simulator.set_entity(chp_switch, "off")
+        for _ in range(5):
+            simulator.step(irradiance=0, house_w=0)
+            assert float(simulator.get_state(args["sensors"]["chp_production"])) == 1500
+        simulator.step(irradiance=0, house_w=0)
+        simulator.step(irradiance=0, house_w=0)
+        assert float(simulator.get_state(args["sensors"]["chp_production"])) == 0
+        assert simulator.summary.chp_starts == 1
+
+    def test_timers_fire_in_simulated_time(self, args):
+        simulator = PlantSimulator(args)
+        fired = []
+        simulator.run_every(
+            lambda kwargs: fired.append(("every", simulator.now)), "now", 60
+        )
+        handle = simulator.run_in(
+            lambda kwargs: fired.append(("cancelled", simulator.now)), 30
+        )
+        simulator.run_in(lambda kwargs: fired.append(("in", simulator.now)), 30)
+        simulator.cancel_timer(handle)
+
+        simulator.run(120)
+
+        start = datetime(2024, 6, 1, tzinfo=timezone.utc)
+        assert fired == [
+            ("every", start),
+            ("in", start + timedelta(seconds=30)),
+            ("every", start + timedelta(seconds=60)),
+            ("every", start + timedelta(seconds=120)),
+        ]
+
+
+class TestProfiles:
+    def test_clear_sky_peaks_at_midday(self):
+        values = ClearSkyIrradiance(sunrise_hour=6, sunset_hour=18).values(
+            None, datetime(2024, 6, 1, tzinfo=timezone.utc), 24, 3600
+        )
+        assert values[0] == 0
+        assert values[12] == pytest.approx(1000)
+        assert values[20] == pytest.approx(0, abs=1e-6)
+
+    def test_load_profile_adds_peaks(self):
+        values = DailyLoadProfile(base_w=300, peaks=((18, 20, 1000),)).values(
+            None, datetime(2024, 6, 1, tzinfo=timezone.utc), 24, 3600
+        )
+        assert values[12] == 300
+        assert values[19] == 1300
+
+
+class TestClosedLoop:
+    def test_controller_runs_faster_than_real_time(self, args):
+        """
+        Tests that the real controller runs closed-loop for a day and uses the PV
+        surplus for the miner.
+        """
+        summary, simulator = simulate(args, 86400)
+
+        assert summary.simulated_minutes == 1440
+        assert summary.miner_kwh > 0
+        assert (
+            summary.switch_toggles[entity(args, "miner_heater", "switch_entity")] >= 2
+        )
+        assert summary.minutes_per_second > 100
+        # No miner at night
+        assert (
+            simulator.get_state(entity(args, "miner_heater", "switch_entity")) == "off"
+        )
+
+    def test_event_driven_loops_do_not_exceed_polling(self, args):
+        """
+        Tests that with sensors changing every plant step, the event-driven loop runs no
+        more often than the 60 s poll and takes the same decisions.
+        """
+        event_driven, _ = simulate(args, 86400)
+        args.pop("event_driven")
+        polling, _ = simulate(args, 86400)
+
+        assert 1000 < event_driven.control_loops <= polling.control_loops
+        assert event_driven.switch_toggles == polling.switch_toggles
+        assert event_driven.power_limit_writes == polling.power_limit_writes
+
+    def test_threshold_changes_chp_behaviour(self, args):
+        """
+        Tests that a lower power draw threshold lets the CHP cover the night load of an
+        empty battery.
+        """
+        plant = PlantParameters(initial_soc=10)
+        default, _ = simulate(args, 6 * 3600, plant=plant)
+        args["chp_handler"]["power_draw_threshold"] = 100
+        low_threshold, _ = simulate(
+            args, 6 * 3600, plant=PlantParameters(initial_soc=10)
+        )
+
+        assert default.chp_starts == 0
+        assert low_threshold.chp_starts > 0
+        assert low_threshold.grid_import_kwh < default.grid_import_kwh
@@ -0,0 +1,63 @@
+import pytest
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from publish_filter import PublishFilter
+
+
+class FakeClock:
+    """A controllable clock returning seconds."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class TestPublishFilter:
+    def test_first_value_is_published(self, clock):
+        publish_filter = PublishFilter(clock=clock)
+        assert publish_filter.should_publish("grid_power", "sensor.grid", 100.0)
+
+    def test_unchanged_value_is_suppressed(self, clock):
+        publish_filter = PublishFilter(clock=clock)
+        publish_filter.mark_published("sensor.mode", "on")
+
+        assert not publish_filter.should_publish("mode", "sensor.mode", "on")
+        assert publish_filter.should_publish("mode", "sensor.mode", "off")
+        assert publish_filter.suppressed == 1
+
+    def test_absolute_deadband(self, clock):
+        publish_filter = PublishFilter({"grid_power": {"absolute": 20}}, clock=clock)
+        publish_filter.mark_published("sensor.grid", 100.0)
+
+        assert not publish_filter.should_publish("grid_power", "sensor.grid", 115.0)
+        assert publish_filter.should_publish("grid_power", "sensor.grid", 125.0)
+
+    def test_relative_deadband(self, clock):
+        publish_filter = PublishFilter(
+            {"solar_production": {"relative": 0.01}}, clock=clock
+        )
+        publish_filter.mark_published("sensor.solar", 5000.0)
+
+        assert not publish_filter.should_publish(
+            "solar_production", "sensor.solar", 5040.0
+        )
+        assert publish_filter.should_publish("solar_production", "sensor.solar", 5060.0)
+
+    def test_heartbeat_forces_republish(self, clock):
+        publish_filter = PublishFilter(heartbeat_minutes=10, clock=clock)
+        publish_filter.mark_published("sensor.mode", "on")
+
+        clock.now = 599
+        assert not publish_filter.should_publish("mode", "sensor.mode", "on")
+        clock.now = 600
+        assert publish_filter.should_publish("mode", "sensor.mode", "on")
@@ -0,0 +1,90 @@
+import pytest
+from unittest.mock import Mock, call
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from publish_plan import PublishPlan
+from system_state import SystemState
+
+
+@pytest.fixture
+def state():
+    return SystemState(
+        solar_surplus=1500.234,
+        total_surplus=1600.0,
+        chp_production=0,
+        battery_soc=85.0,
+        battery_power=0.0,
+        battery_charging=0.0,
+        battery_discharging=0.0,
+        grid_power=-1000.0,
+        grid_import=0.0,
+        grid_export=1000.0,
+        solar_production=2000.0,
+        miner_consumption=0.0,
+        miner_power_limit=0.0,
+        house_consumption=500.0,
+        miner_surplus=1500.0,
+        last_updated="now",
+        is_dry_run=False,
+        miner_intended_switch_state="off",
+    )
+
+
+class TestPublishPlan:
+    def test_compiles_only_configured_entities(self):
+        plan = PublishPlan(
+            {
+                "solar_surplus": "sensor.solar_surplus",
+                "is_dry_run": "binary_sensor.dry_run",
+                "unknown_key": "sensor.unknown",
+                "controller_running": "binary_sensor.running",
+                "last_successful_run": "sensor.last_run",
+            }
+        )
+
+        assert [entry[:3] for entry in plan.entries] == [
+            ("solar_surplus", "sensor.solar_surplus", {"unit_of_measurement": "W"}),
+            ("is_dry_run", "binary_sensor.dry_run", {}),
+        ]
+
+    def test_publish_formats_values(self, state):
+        plan = PublishPlan(
+            {
+                "solar_surplus": "sensor.solar_surplus",
+                "chp_production": "sensor.chp_production",
+                "is_dry_run": "binary_sensor.dry_run",
+                "miner_intended_switch_state": "sensor.miner_intended",
+                "chp_intended_switch_state": "sensor.chp_intended",
+                "controller_running": "binary_sensor.running",
+                "last_successful_run": "sensor.last_run",
+            }
+        )
+        app = Mock()
+
+        plan.publish(app, state)
+
+        app.set_state.assert_has_calls(
+            [
+                call(
+                    "sensor.solar_surplus",
+                    state=1500.23,
+                    attributes={"unit_of_measurement": "W"},
+                ),
+                call(
+                    "sensor.chp_production",
+                    state=0,
+                    attributes={"unit_of_measurement": "W"},
+                ),
+                call("binary_sensor.dry_run", state="off", attributes={}),
+                call("sensor.miner_intended", state="off", attributes={}),
+                call("binary_sensor.running", state="on"),
+                call("sensor.last_run", state="now"),
+            ]
+        )
+        assert app.set_state.call_count == 6
+
+    def test_system_state_is_slotted(self, state):
+        assert not hasattr(state, "__dict__")
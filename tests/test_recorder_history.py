@@ -0,0 +1,266 @@
+import pytest
+import math
+import sqlite3
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+import numpy as np
+from recorder_history import main, read_recorder_batches, read_recorder_columns
+from replay import ReplayEngine, read_history_csv
+
+START = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+
+SENSORS = {
+    "grid_power": "sensor.grid_power",
+    "battery_soc": "sensor.battery_soc",
+    "battery_power": "sensor.battery_power",
+    "solar_production": "sensor.solar_production",
+    "miner_consumption": "sensor.miner_consumption",
+    "chp_production": "sensor.chp_production",
+}
+
+
+def create_recorder(path, rows, legacy=False):
+    """
+    Creates a recorder database with the columns the reader uses. Rows are (entity_id,
+    state, seconds after START) with an optional last report in seconds after START.
+    """
+    connection = sqlite3.connect(path)
+    if legacy:
+        connection.execute(
+            "CREATE TABLE states (state_id INTEGER PRIMARY KEY, entity_id TEXT, state TEXT, last_updated_ts FLOAT)"
+        )
+        connection.executemany(
+            "INSERT INTO states (entity_id, state, last_updated_ts) VALUES (?, ?, ?)",
+            [(entity_id, state, START + offset) for entity_id, state, offset in rows],
+        )
+    else:
+        connection.execute(
+            "CREATE TABLE states_meta (metadata_id INTEGER PRIMARY KEY, entity_id TEXT)"
+        )
+        connection.execute(
+            "CREATE TABLE states (state_id INTEGER PRIMARY KEY, entity_id TEXT, state TEXT, last_updated_ts FLOAT, "
+            "last_reported_ts FLOAT, metadata_id INTEGER)"
+        )
+        connection.execute(
+            "CREATE INDEX ix_states_metadata_id_last_updated_ts ON states (metadata_id, last_updated_ts)"
+        )
+        entity_ids = sorted({row[0] for row in rows})
+        connection.executemany(
+            "INSERT INTO states_meta (entity_id) VALUES (?)",
+            [(entity_id,) for entity_id in entity_ids],
+        )
+        connection.executemany(
+            "INSERT INTO states (state, last_updated_ts, last_reported_ts, metadata_id) "
+            "VALUES (?, ?, ?, (SELECT metadata_id FROM states_meta WHERE entity_id = ?))",
+            [
+                (
+                    row[1],
+                    START + row[2],
+                    START + row[3] if len(row) > 3 else None,
+                    row[0],
+                )
+                for row in rows
+            ],
+        )
+    connection.commit()
+    connection.close()
+
+
+def surplus_rows(minutes):
+    """
+    Rows of a surplus that rises and falls every hour, with the other sensors changing
+    rarely.
+    """
+    rows = []
+    for minute in range(minutes):
+        surplus = 3000 * abs(math.sin(minute / 60 * math.pi))
+        rows += [
+            ("sensor.grid_power", str(-surplus / 10), minute * 60),
+            ("sensor.battery_power", str(surplus), minute * 60 + 5),
+            ("sensor.solar_production", str(surplus / 1000 + 0.5), minute * 60 + 10),
+        ]
+    for minute in range(0, minutes, 10):
+        rows += [
+            ("sensor.battery_soc", str(50 + minute % 40), minute * 60),
+            ("sensor.miner_consumption", "0", minute * 60),
+            ("sensor.chp_production", "0", minute * 60),
+        ]
+    return rows
+
+
+class TestReadRecorderColumns:
+    def test_forward_fill_and_staleness(self, tmp_path):
+        """
+        Tests that states are forward-filled onto the grid until they become stale or
+        unavailable.
+        """
+        path = tmp_path / "home-assistant_v2.db"
+        create_recorder(
+            path,
+            [
+                ("sensor.grid_power", "100", 30),
+                ("sensor.grid_power", "unavailable", 150),
+                ("sensor.grid_power", "300", 200),
+                ("sensor.battery_soc", "50", 0, 170),
+            ],
+        )
+
+        blocks = list(
+            read_recorder_columns(
+                path,
+                {
+                    "grid_power": "sensor.grid_power",
+                    "battery_soc": "sensor.battery_soc",
+                },
+                step_seconds=60,
+                start=START,
+                end=START + 300,
+                max_age_seconds=100,
+            )
+        )
+
+        times, columns = blocks[0]
+        assert list(times - START) == [0, 60, 120, 180, 240, 300]
+        np.testing.assert_array_equal(
+            columns["grid_power"], [np.nan, 100, 100, np.nan, 300, 300]
+        )
+        # Reported again at 170 s, so only stale after 270 s
+        np.testing.assert_array_equal(
+            columns["battery_soc"], [50, 50, 50, 50, 50, np.nan]
+        )
+
+    def test_per_sensor_staleness_limits(self, tmp_path):
+        path = tmp_path / "home-assistant_v2.db"
+        create_recorder(
+            path, [("sensor.grid_power", "100", 0), ("sensor.battery_soc", "50", 0)]
+        )
+
+        _, columns = next(
+            read_recorder_columns(
+                path,
+                {
+                    "grid_power": "sensor.grid_power",
+                    "battery_soc": "sensor.battery_soc",
+                },
+                start=START,
+                end=START + 3600,
+                max_age_seconds={"grid_power": 60},
+            )
+        )
+
+        assert np.isnan(columns["grid_power"][-1])
+        assert columns["battery_soc"][-1] == 50
+
+    def test_blocks_do_not_depend_on_chunk_size(self, tmp_path):
+        """
+        Tests that small database chunks and fixed-size blocks give the same samples as
+        one large read.
+        """
+        path = tmp_path / "home-assistant_v2.db"
+        create_recorder(path, surplus_rows(300))
+
+        whole = list(
+            read_recorder_columns(path, SENSORS, block_size=10000, chunk_size=100000)
+        )
+        streamed = list(
+            read_recorder_columns(path, SENSORS, block_size=7, chunk_size=3)
+        )
+
+        assert len(whole) == 1
+        assert {len(times) for times, _ in streamed[:-1]} == {7}
+        np.testing.assert_array_equal(
+            np.concatenate([times for times, _ in streamed]), whole[0][0]
+        )
+        for key in SENSORS:
+            np.testing.assert_array_equal(
+                np.concatenate([columns[key] for _, columns in streamed]),
+                whole[0][1][key],
+            )
+
+    def test_legacy_entity_id_schema(self, tmp_path):
+        path = tmp_path / "home-assistant_v2.db"
+        create_recorder(
+            path,
+            [("sensor.grid_power", "100", 0), ("sensor.grid_power", "200", 120)],
+            legacy=True,
+        )
+
+        times, columns = next(
+            read_recorder_columns(path, {"grid_power": "sensor.grid_power"})
+        )
+
+        assert list(columns["grid_power"]) == [100, 100, 200]
+
+    def test_unknown_entity_raises(self, tmp_path):
+        path = tmp_path / "home-assistant_v2.db"
+        create_recorder(path, [("sensor.grid_power", "100", 0)])
+
+        with pytest.raises(ValueError, match="sensor.battery_soc"):
+            next(
+                read_recorder_columns(
+                    path,
+                    {
+                        "grid_power": "sensor.grid_power",
+                        "battery_soc": "sensor.battery_soc",
+                    },
+                )
+            )
+
+
+def test_batches_replay_like_the_exported_csv(tmp_path):
+    """
+    Tests that streamed batches replay to the same summary as the CSV export read by
+    replay.py.
+    """
+    path = tmp_path / "home-assistant_v2.db"
+    output = tmp_path / "history.csv"
+    create_recorder(path, surplus_rows(180))
+    config = tmp_path / "apps.yaml"
+    config.write_text(
+        "energy_manager:\n  sensors:\n"
+        + "".join(f"    {key}: {entity_id}\n" for key, entity_id in SENSORS.items())
+        + "  miner_heater:\n    switch_entity: switch.miner\n    power_limit_entity: number.miner_power_limit\n"
+    )
+    main([str(path), "--config", str(config), "--output", str(output)])
+    args = {
+        "sensors": SENSORS,
+        "miner_heater": {
+            "switch_entity": "switch.miner",
+            "power_limit_entity": "number.miner_power_limit",
+        },
+    }
+
+    batches = read_recorder_batches(path, SENSORS, block_size=50)
+    streamed = ReplayEngine(args).run_batches(
+        (batch, batch.timestamps) for batch in batches
+    )
+    expected = ReplayEngine(args).run(read_history_csv(output, SENSORS))
+
+    assert streamed.ticks == 180
+    assert streamed.switch_toggles["switch.miner"] > 0
+    assert streamed == expected
+
+
+def test_streaming_memory_does_not_grow_with_the_history(tmp_path):
+    """
+    Tests that the peak memory of streaming the recorder in blocks stays flat when the
+    history grows from 10 to 80 days.
+    """
+    peaks = {}
+    for days in (10, 80):
+        path = tmp_path / f"recorder_{days}.db"
+        create_recorder(path, surplus_rows(days * 1440))
+        tracemalloc.start()
+        try:
+            ticks = sum(len(batch) for batch in read_recorder_batches(path, SENSORS))
+            peaks[days] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert ticks == days * 1440
+
+    assert peaks[80] < 1.5 * peaks[10]
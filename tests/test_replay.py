@@ -0,0 +1,208 @@
+import pytest
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+import numpy as np
+from replay import ReplayEngine, read_history_csv, load_app_args
+from system_state_batch import SENSOR_KEYS, SystemStateBatch
+
+START = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def args():
+    """Fixture for app arguments with all three handlers."""
+    return {
+        "dry_run_switch_entity": "input_boolean.dry_run",
+        "sensors": {
+            "grid_power": "sensor.grid_power",
+            "battery_soc": "sensor.battery_soc",
+            "battery_power": "sensor.battery_power",
+            "solar_production": "sensor.solar_production",
+            "miner_consumption": "sensor.miner_consumption",
+            "chp_production": "sensor.chp_production",
+        },
+        "miner_heater": {
+            "switch_entity": "switch.miner",
+            "power_limit_entity": "number.miner_power_limit",
+            "activation_threshold": 2000,
+            "max_power": 6000,
+            "power_step": 1000,
+            "min_write_interval_seconds": 60,
+        },
+        "chp_handler": {
+            "switch_entity": "switch.chp",
+            "power_draw_threshold": 1000,
+            "min_wait_time": 3,
+        },
+        "battery_handler": {"disable_charge_switch": "switch.disable_charge"},
+    }
+
+
+def make_row(minute, battery_power, grid_power=0.0, solar_kw=4.0):
+    return START + timedelta(minutes=minute), {
+        "grid_power": str(grid_power),
+        "battery_soc": "40",
+        "battery_power": str(battery_power),
+        "solar_production": str(solar_kw),
+        "miner_consumption": "0",
+        "chp_production": "0",
+    }
+
+
+class TestReplayEngine:
+    def test_miner_follows_surplus(self, args):
+        """Test that the miner is switched on during surplus and off afterwards."""
+        rows = [make_row(minute, battery_power=3000) for minute in range(10)]
+        rows += [
+            make_row(minute, battery_power=0, solar_kw=0.5) for minute in range(10, 20)
+        ]
+
+        summary = ReplayEngine(args).run(rows)
+
+        assert summary.ticks == 20
+        assert summary.skipped_ticks == 0
+        assert summary.switch_toggles["switch.miner"] == 2
+        assert summary.miner_energy_kwh == pytest.approx(3000 * 10 / 60 / 1000)
+
+    def test_power_limit_writes_use_replay_time(self, args):
+        """
+        Test that the minimum write interval is enforced in replayed time, not wall
+        time.
+        """
+        rows = [
+            make_row(0, battery_power=3000),
+            make_row(0.5, battery_power=4200),
+            make_row(2, battery_power=4200),
+        ]
+        engine = ReplayEngine(args)
+
+        engine.run(rows)
+
+        assert engine.app.states["number.miner_power_limit"]["state"] == 4000
+
+    def test_chp_respects_min_wait_time(self, args):
+        """Test that the CHP is not switched off again before its minimum wait time."""
+        rows = [make_row(0, battery_power=0, grid_power=2000, solar_kw=0)]
+        rows += [
+            make_row(minute, battery_power=0, grid_power=0, solar_kw=0)
+            for minute in range(1, 5)
+        ]
+
+        summary = ReplayEngine(args).run(rows)
+
+        assert summary.switch_toggles["switch.chp"] == 2
+        assert summary.chp_on_hours == pytest.approx(3 / 60)
+
+    def test_missing_sensor_skips_tick(self, args):
+        """Test that ticks with unusable sensor data are counted as skipped."""
+        timestamp, values = make_row(0, battery_power=0)
+        values["grid_power"] = "unavailable"
+
+        summary = ReplayEngine(args).run([(timestamp, values)])
+
+        assert summary.skipped_ticks == 1
+
+    def test_batch_replay_matches_row_replay(self, args):
+        """
+        Test that replaying a SystemStateBatch gives the same summary as replaying the
+        raw rows.
+        """
+        rows = [
+            make_row(minute, battery_power=3000, grid_power=-200)
+            for minute in range(10)
+        ]
+        rows += [
+            make_row(minute, battery_power=0, grid_power=2000, solar_kw=0)
+            for minute in range(10, 20)
+        ]
+        rows[12][1]["grid_power"] = "unavailable"
+        times = np.array([timestamp.timestamp() for timestamp, _ in rows])
+        columns = {
+            key: [
+                float(values[key]) if values[key] != "unavailable" else np.nan
+                for _, values in rows
+            ]
+            for key in SENSOR_KEYS
+        }
+
+        expected = ReplayEngine(args).run(rows)
+        summary = ReplayEngine(args).run_batch(
+            SystemStateBatch.from_sensor_columns(times, columns), times
+        )
+
+        assert summary == expected
+        assert summary.skipped_ticks == 1
+        assert summary.estimated_grid_export_kwh < summary.grid_export_kwh
+
+    def test_replay_skips_unused_statistics_and_info_records(self, args):
+        """
+        Test that a replay only updates SignalStats for a smoothed surplus statistic,
+        and formats no records below WARNING.
+        """
+        engine = ReplayEngine(args)
+
+        assert engine.signal_stats is None
+        assert not engine.app.structured_log.enabled("INFO")
+        assert engine.app.structured_log.enabled("WARNING")
+
+        args["miner_heater"]["surplus_statistic"] = "ewma"
+        engine = ReplayEngine(args)
+        engine.run([make_row(minute, battery_power=3000) for minute in range(3)])
+
+        assert engine.signal_stats.windows["miner_surplus"].count == 3
+
+    def test_batch_replay_runs_a_day_of_minutes_quickly(self, args):
+        """
+        Test that a day of minute samples replays well within the time a year needs to
+        replay in seconds.
+        """
+        times = START.timestamp() + 60.0 * np.arange(1440)
+        solar_kw = 6.0 * np.clip(np.sin(np.arange(1440) / 1440 * 2 * np.pi), 0, None)
+        columns = {key: np.zeros(1440) for key in SENSOR_KEYS}
+        columns["solar_production"] = solar_kw
+        columns["battery_soc"] = np.full(1440, 60.0)
+        columns["battery_power"] = 600 * solar_kw
+        columns["grid_power"] = -200 * solar_kw
+        batch = SystemStateBatch.from_sensor_columns(times, columns)
+
+        engine = ReplayEngine(args)
+        start = time.perf_counter()
+        summary = engine.run_batch(batch, times)
+        seconds = time.perf_counter() - start
+
+        assert summary.ticks == 1440
+        assert summary.switch_toggles["switch.miner"] > 0
+        # A year in under a minute, with a wide margin for slow machines
+        assert seconds < 60 / 365
+
+
+def test_read_history_csv(tmp_path):
+    """Test reading a history CSV into timestamped rows."""
+    path = tmp_path / "history.csv"
+    path.write_text("timestamp,grid_power,battery_soc\n2024-06-01T12:00:00,-100,50\n")
+
+    rows = list(
+        read_history_csv(path, ["grid_power", "battery_soc", "solar_production"])
+    )
+
+    assert rows == [
+        (
+            datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc),
+            {"grid_power": "-100", "battery_soc": "50"},
+        )
+    ]
+
+
+def test_load_app_args_with_overrides():
+    """Test loading apps.yaml with parameter overrides."""
+    args = load_app_args(
+        "apps/apps.yaml", overrides=["miner_heater.activation_threshold=2500"]
+    )
+
+    assert args["miner_heater"]["activation_threshold"] == 2500
+    assert "grid_power" in args["sensors"]
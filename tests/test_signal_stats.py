@@ -0,0 +1,119 @@
+import pytest
+import random
+import numpy as np
+from unittest.mock import Mock
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from miner_heater_handler import MinerHeaterHandler
+from signal_stats import RollingWindow, SignalStats
+from system_state import SystemState
+from write_ledger import WriteLedger
+
+
+def make_state(miner_surplus):
+    return SystemState(
+        solar_surplus=miner_surplus,
+        total_surplus=miner_surplus,
+        chp_production=0,
+        battery_soc=80,
+        battery_power=0,
+        battery_charging=0,
+        battery_discharging=0,
+        grid_power=0,
+        grid_import=0,
+        grid_export=0,
+        solar_production=0,
+        miner_consumption=0,
+        miner_power_limit=0.0,
+        house_consumption=0,
+        miner_surplus=miner_surplus,
+        last_updated="now",
+        is_dry_run=False,
+    )
+
+
+class TestRollingWindow:
+    def test_matches_naive_statistics(self):
+        """
+        Tests the windowed statistics against a recomputation over the last samples.
+        """
+        rng = random.Random(1)
+        window = RollingWindow(7)
+        values, times = [], []
+        timestamp = 1.7e9
+        for _ in range(200):
+            timestamp += rng.uniform(10, 90)
+            value = rng.uniform(-3000, 6000)
+            window.push(value, timestamp)
+            values.append(value)
+            times.append(timestamp)
+
+            recent, recent_times = values[-7:], times[-7:]
+            assert window.mean() == pytest.approx(np.mean(recent))
+            assert window.min() == min(recent)
+            assert window.max() == max(recent)
+            assert window.last() == value
+            if len(recent) > 1:
+                expected_slope = np.polyfit(
+                    np.array(recent_times) - recent_times[0], recent, 1
+                )[0]
+                assert window.slope() == pytest.approx(
+                    expected_slope, rel=1e-6, abs=1e-9
+                )
+
+    def test_empty_and_single_sample(self):
+        """Tests that statistics are None until there are enough samples."""
+        window = RollingWindow(5)
+        assert window.mean() is None and window.min() is None and window.ewma() is None
+
+        window.push(10.0, 0.0)
+        assert window.mean() == 10.0
+        assert window.slope() is None
+
+    def test_ewma_weights_by_elapsed_time(self):
+        """
+        Tests that the moving average approaches a step by 1 - 1/e after one time
+        constant.
+        """
+        window = RollingWindow(5, ewma_seconds=100)
+        window.push(0.0, 0.0)
+        window.push(1000.0, 100.0)
+        assert window.ewma() == pytest.approx(1000 * (1 - np.exp(-1)))
+
+
+class TestSignalStats:
+    def test_unknown_statistic(self):
+        """Tests that an unknown statistic is rejected."""
+        stats = SignalStats()
+        with pytest.raises(ValueError):
+            stats.value("miner_surplus", "median")
+
+    def test_miner_uses_smoothed_surplus(self):
+        """
+        Tests that a short surplus dip does not turn the miner off when it uses the
+        window maximum.
+        """
+        app = Mock()
+        app.get_state.return_value = "on"
+        stats = SignalStats(["miner_surplus"], window=5)
+        handler = MinerHeaterHandler(
+            app,
+            {
+                "switch_entity": "switch.miner",
+                "power_limit_entity": "number.miner_power_limit",
+                "activation_threshold": 2000,
+                "surplus_statistic": "max",
+            },
+            write_ledger=WriteLedger(),
+            signal_stats=stats,
+        )
+
+        for timestamp, surplus in enumerate([3000, 3000, 500]):
+            state = make_state(surplus)
+            stats.update(state, timestamp * 60)
+            handler.evaluate_and_act(state)
+
+        assert state.miner_intended_switch_state == "on"
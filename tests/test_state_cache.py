@@ -0,0 +1,81 @@
+import pytest
+from unittest.mock import Mock
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from state_cache import StateCache
+
+
+@pytest.fixture
+def mock_app():
+    """Fixture for a mocked AppDaemon app instance."""
+    app = Mock()
+    app.get_state.return_value = "on"
+    return app
+
+
+class TestStateCache:
+    def test_reads_each_entity_once(self, mock_app):
+        """Test that repeated reads of the same entity hit the cache."""
+        cache = StateCache(mock_app)
+
+        assert cache.get_state("switch.miner") == "on"
+        assert cache.get_state("switch.miner") == "on"
+
+        mock_app.get_state.assert_called_once_with("switch.miner")
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_attribute_reads_are_cached_separately(self, mock_app):
+        """
+        Test that attribute reads are fetched with the attribute and cached per
+        attribute.
+        """
+        cache = StateCache(mock_app)
+        mock_app.get_state.return_value = "2024-01-01T00:00:00+00:00"
+
+        cache.get_state("switch.chp", attribute="last_changed")
+        cache.get_state("switch.chp", attribute="last_changed")
+
+        mock_app.get_state.assert_called_once_with(
+            "switch.chp", attribute="last_changed"
+        )
+
+    def test_full_state_serves_other_attributes(self, mock_app):
+        """
+        Test that a cached full state answers state and attribute reads without further
+        calls.
+        """
+        cache = StateCache(mock_app)
+        mock_app.get_state.return_value = {
+            "state": "2000.0",
+            "attributes": {"last_write": "t"},
+            "last_changed": "c",
+        }
+
+        cache.get_state("number.miner_power_limit", attribute="all")
+
+        assert cache.get_state("number.miner_power_limit") == "2000.0"
+        assert (
+            cache.get_state("number.miner_power_limit", attribute="last_write") == "t"
+        )
+        assert (
+            cache.get_state("number.miner_power_limit", attribute="last_changed") == "c"
+        )
+        assert mock_app.get_state.call_count == 1
+        assert cache.hits == 3
+
+    def test_prime_with_snapshot(self, mock_app):
+        """Test that a primed snapshot is served without any reads."""
+        cache = StateCache(mock_app)
+        cache.prime({"switch.miner": {"state": "off", "attributes": {}}})
+
+        assert cache.get_state("switch.miner") == "off"
+        assert cache.get_state("switch.miner", attribute="all") == {
+            "state": "off",
+            "attributes": {},
+        }
+        mock_app.get_state.assert_not_called()
+        assert cache.misses == 0
@@ -0,0 +1,210 @@
+import pytest
+import sys
+import threading
+from unittest.mock import Mock
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from controller_config import LoggingConfig
+from structured_log import StructuredLog, create_structured_log, format_record, get_log
+from system_state import SystemState
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Expensive:
+    """A field value that counts how often it is formatted."""
+
+    formatted = 0
+
+    def __str__(self):
+        Expensive.formatted += 1
+        return "expensive"
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def app():
+    return Mock()
+
+
+class TestStructuredLog:
+    def test_disabled_levels_are_not_formatted(self, app, clock):
+        log = StructuredLog(app, level="INFO", clock=clock)
+        Expensive.formatted = 0
+
+        log.debug("state", value=Expensive())
+
+        assert Expensive.formatted == 0
+        app.log.assert_not_called()
+        assert log.enabled("WARNING") and not log.enabled("DEBUG")
+
+    def test_records_are_key_value_lines(self, app, clock):
+        log = StructuredLog(app, level="DEBUG", clock=clock)
+
+        log.debug("loop_started")
+        log.info("switch", entity="switch.miner", state="on", dry_run=False)
+        log.warning("loop_overrun", budget_seconds=60)
+        log.error("action_failed", error="timed out")
+
+        app.log.assert_any_call("loop_started", level="DEBUG")
+        app.log.assert_any_call("switch entity=switch.miner state=on dry_run=false")
+        app.log.assert_any_call("loop_overrun budget_seconds=60", level="WARNING")
+        app.error.assert_called_once_with('action_failed error="timed out"')
+
+    def test_identical_records_are_deduplicated(self, app, clock):
+        """
+        Tests that an identical record is written once per interval, then with the
+        number of dropped repeats.
+        """
+        log = StructuredLog(app, repeat_seconds=300, clock=clock)
+
+        for _ in range(6):
+            log.info("miner_write_skipped", new_limit=4000)
+            clock.now += 60
+        log.info("miner_write_skipped", new_limit=5000)
+
+        assert [call.args[0] for call in app.log.call_args_list] == [
+            "miner_write_skipped new_limit=4000",
+            "miner_write_skipped new_limit=4000 repeated=4",
+            "miner_write_skipped new_limit=5000",
+        ]
+        assert log.suppressed == 4
+
+    def test_warnings_errors_and_actions_are_not_deduplicated(self, app, clock):
+        """
+        Tests that an on-off-on sequence of a switch and repeated failures are all
+        written.
+        """
+        log = StructuredLog(app, repeat_seconds=300, clock=clock)
+
+        for state in ("on", "off", "on"):
+            log.info("switch", entity="switch.miner", state=state, dry_run=False)
+            clock.now += 60
+        log.warning("loop_aborted", reason="system state unavailable")
+        log.warning("loop_aborted", reason="system state unavailable")
+        log.error("action_failed", error="timed out")
+        log.error("action_failed", error="timed out")
+
+        assert [call.args[0] for call in app.log.call_args_list].count(
+            "switch entity=switch.miner state=on dry_run=false"
+        ) == 2
+        assert app.log.call_count == 5
+        assert app.error.call_count == 2
+        assert log.suppressed == 0
+
+    def test_rate_limited_events_ignore_their_fields(self, app, clock):
+        log = StructuredLog(
+            app, repeat_seconds=0, rate_limits={"toggle_blocked": 120}, clock=clock
+        )
+
+        for elapsed in range(0, 180, 30):
+            log.info("toggle_blocked", elapsed_seconds=elapsed)
+            clock.now += 30
+        log.info("other", value=1)
+        log.info("other", value=1)
+
+        assert [call.args[0] for call in app.log.call_args_list] == [
+            "toggle_blocked elapsed_seconds=0",
+            "toggle_blocked elapsed_seconds=120 repeated=3",
+            "other value=1",
+            "other value=1",
+        ]
+
+    def test_dataclass_fields_are_flattened(self):
+        state = SystemState(
+            solar_surplus=1500.0,
+            total_surplus=1500.0,
+            chp_production=0.0,
+            battery_soc=55.5,
+            battery_power=1000.0,
+            battery_charging=1000.0,
+            battery_discharging=0.0,
+            grid_power=-500.0,
+            grid_import=0.0,
+            grid_export=500.0,
+            solar_production=2500.0,
+            miner_consumption=0.0,
+            miner_power_limit=0.0,
+            house_consumption=1500.0,
+            miner_surplus=1000.0,
+            last_updated="2024-06-01T12:00:00+00:00",
+            is_dry_run=False,
+        )
+
+        record = format_record("system_state", {"state": state})
+
+        assert record.startswith(
+            "system_state state.solar_surplus=1500 state.total_surplus=1500 "
+        )
+        assert "state.battery_soc=55.5 " in record
+        assert (
+            "state.last_updated=2024-06-01T12:00:00+00:00 state.is_dry_run=false state.miner_intended_power_limit=none"
+            in record
+        )
+
+    def test_unhashable_fields_are_always_written(self, app, clock):
+        log = StructuredLog(app, clock=clock)
+
+        log.info("values", items=[1, 2])
+        log.info("values", items=[1, 2])
+
+        assert app.log.call_count == 2
+
+    def test_threads_share_the_deduplication(self, app):
+        """
+        Tests that records logged from several threads are each written or counted as
+        suppressed exactly once.
+        """
+        clock = Clock()
+        records = []
+        app.log = records.append
+        log = StructuredLog(app, repeat_seconds=60, clock=clock)
+
+        def run(thread):
+            for index in range(2000):
+                log.info("sample", thread=thread, value=index % 50)
+                clock.now += 1
+
+        threads = [threading.Thread(target=run, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(records) + log.suppressed == 8000
+        repeated = sum(
+            int(field.split("=")[1])
+            for record in records
+            for field in record.split()
+            if field.startswith("repeated=")
+        )
+        assert repeated + sum(entry[1] for entry in log._recent.values()) == (
+            log.suppressed
+        )
+
+
+def test_create_from_args_and_get_log(app):
+    log = create_structured_log(
+        app,
+        LoggingConfig.from_dict(
+            {"level": "debug", "repeat_seconds": 60, "rate_limits": {"a": 10}}
+        ),
+    )
+    app.structured_log = log
+
+    assert log.enabled("DEBUG")
+    assert log.rate_limits == {"a": 10}
+    assert get_log(app) is log
+    assert get_log(Mock()).repeat_seconds == 0
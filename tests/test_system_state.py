@@ -3,11 +3,12 @@ from unittest.mock import Mock
 import sys
 import unittest
 
-
 # Add the apps directory to the python path to allow for imports
-sys.path.append('apps')
+sys.path.append("apps")
 
 from system_state import SystemState
+from publish_filter import PublishFilter
+
 
 @pytest.fixture
 def mock_app():
@@ -21,30 +22,30 @@ def mock_app():
             "battery_power": "sensor.battery_power",
             "solar_production": "sensor.solar_production",
             "miner_consumption": "sensor.miner_consumption",
-            "chp_production": "sensor.chp_production"
+            "chp_production": "sensor.chp_production",
         },
-        "miner_heater": {
-            "power_limit_entity": "number.miner_power_limit"
-        }
+        "miner_heater": {"power_limit_entity": "number.miner_power_limit"},
     }
     return app
 
+
 from datetime import datetime, timezone
 from unittest.mock import call
 
+
 class TestSystemState:
     def test_from_home_assistant_success(self, mock_app):
         """Test successful creation of SystemState from Home Assistant."""
         mock_app.args["dry_run_switch_entity"] = "input_boolean.dry_run"
         mock_app.get_state.side_effect = [
-            "off",      # dry_run_switch
+            "off",  # dry_run_switch
             "-1500.0",  # grid_power
-            "85.5",     # battery_soc
-            "-500.0",   # battery_power
-            "2.0",      # solar_production (in kW)
-            "100.0",    # chp_production
-            "1000.0",   # miner_consumption
-            "1200.0"    # miner_power_limit
+            "85.5",  # battery_soc
+            "-500.0",  # battery_power
+            "2.0",  # solar_production (in kW)
+            "100.0",  # chp_production
+            "1000.0",  # miner_consumption
+            "1200.0",  # miner_power_limit
         ]
 
         state = SystemState.from_home_assistant(mock_app)
@@ -54,7 +55,7 @@ class TestSystemState:
         assert state.grid_power == -1500.0
         assert state.battery_soc == 85.5
         assert state.battery_power == -500.0
-        assert state.solar_production == 2000.0 # aW
+        assert state.solar_production == 2000.0  # aW
         assert state.chp_production == 100.0
         assert state.miner_consumption == 1000.0
         assert state.miner_power_limit == 1200.0
@@ -66,6 +67,39 @@ class TestSystemState:
         assert state.total_surplus == 1500.0
         assert "T" in state.last_updated
 
+    def test_from_home_assistant_snapshot_reads(self, mock_app):
+        """Test that snapshot mode reads all entities with a single bulk call."""
+        mock_app.args["dry_run_switch_entity"] = "input_boolean.dry_run"
+        mock_app.args["snapshot_reads"] = True
+        mock_app.get_state.side_effect = None
+        mock_app.get_state.return_value = {
+            "input_boolean.dry_run": {"state": "on", "attributes": {}},
+            "sensor.grid_power": {"state": "-1500.0", "attributes": {}},
+            "sensor.battery_soc": {"state": "85.5", "attributes": {}},
+            "sensor.battery_power": {"state": "-500.0", "attributes": {}},
+            "sensor.solar_production": {"state": "2.0", "attributes": {}},
+            "sensor.chp_production": {"state": "100.0", "attributes": {}},
+            "sensor.miner_consumption": {"state": "unavailable", "attributes": {}},
+            "number.miner_power_limit": {"state": "1200.0", "attributes": {}},
+            "sensor.unrelated": {"state": "42", "attributes": {}},
+        }
+
+        state = SystemState.from_home_assistant(mock_app)
+
+        mock_app.get_state.assert_called_once_with(copy=False)
+        assert state.is_dry_run
+        assert state.grid_power == -1500.0
+        assert state.solar_production == 2000.0
+        assert state.miner_consumption == 0.0
+        assert state.miner_power_limit == 1200.0
+
+    def test_from_snapshot_missing_sensor(self, mock_app):
+        """Test that a sensor missing from the snapshot yields no state."""
+        snapshot = {"sensor.grid_power": {"state": "-1500.0", "attributes": {}}}
+
+        assert SystemState.from_snapshot(mock_app, snapshot) is None
+        mock_app.error.assert_called_once()
+
     def test_publish_to_ha(self, mock_app):
         """Test that all state variables are published to HA correctly."""
         now = datetime.now(timezone.utc).isoformat()
@@ -89,7 +123,7 @@ class TestSystemState:
             is_dry_run=True,
             miner_intended_power_limit=1500.0,
             miner_intended_switch_state="on",
-            battery_intended_charge_switch_state="off"
+            battery_intended_charge_switch_state="off",
         )
 
         publish_entities = {
@@ -118,85 +152,244 @@ class TestSystemState:
 
         expected_calls = [
             # Standard sensor values
-            call('sensor.controller_solar_surplus', state=1500.23, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_total_surplus', state=1600.23, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_chp_production', state=100.0, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_battery_soc', state=85.57, attributes={'unit_of_measurement': '%'}),
-            call('sensor.controller_battery_power', state=-500.79, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_battery_charging', state=0.0, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_battery_discharging', state=500.79, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_grid_power', state=-1000.0, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_grid_import', state=0.0, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_grid_export', state=1000.0, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_solar_production', state=2000.12, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_miner_consumption', state=950.0, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_miner_power_limit', state=1200.0, attributes={'unit_of_measurement': 'W'}),
-
+            call(
+                "sensor.controller_solar_surplus",
+                state=1500.23,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_total_surplus",
+                state=1600.23,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_chp_production",
+                state=100.0,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_battery_soc",
+                state=85.57,
+                attributes={"unit_of_measurement": "%"},
+            ),
+            call(
+                "sensor.controller_battery_power",
+                state=-500.79,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_battery_charging",
+                state=0.0,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_battery_discharging",
+                state=500.79,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_grid_power",
+                state=-1000.0,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_grid_import",
+                state=0.0,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_grid_export",
+                state=1000.0,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_solar_production",
+                state=2000.12,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_miner_consumption",
+                state=950.0,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_miner_power_limit",
+                state=1200.0,
+                attributes={"unit_of_measurement": "W"},
+            ),
             # Boolean and intended states
-            call('binary_sensor.controller_is_dry_run', state='on', attributes={}),
-            call('sensor.controller_miner_intended_power_limit', state=1500.0, attributes={'unit_of_measurement': 'W'}),
-            call('sensor.controller_miner_intended_switch_state', state='on', attributes={}),
-            call('sensor.controller_battery_intended_charge_switch_state', state='off', attributes={}),
-
+            call("binary_sensor.controller_is_dry_run", state="on", attributes={}),
+            call(
+                "sensor.controller_miner_intended_power_limit",
+                state=1500.0,
+                attributes={"unit_of_measurement": "W"},
+            ),
+            call(
+                "sensor.controller_miner_intended_switch_state",
+                state="on",
+                attributes={},
+            ),
+            call(
+                "sensor.controller_battery_intended_charge_switch_state",
+                state="off",
+                attributes={},
+            ),
             # Controller status
-            call('binary_sensor.controller_running', state='on'),
-            call('sensor.controller_last_successful_run', state=now),
+            call("binary_sensor.controller_running", state="on"),
+            call("sensor.controller_last_successful_run", state=now),
         ]
 
         mock_app.set_state.assert_has_calls(expected_calls, any_order=True)
         assert mock_app.set_state.call_count == len(expected_calls)
 
+    def test_publish_to_ha_suppresses_unchanged_values(self, mock_app):
+        """Test that a publish filter only lets changed values through."""
+        state = SystemState(
+            solar_surplus=1500.0,
+            total_surplus=1600.0,
+            chp_production=100.0,
+            battery_soc=85.0,
+            battery_power=0.0,
+            battery_charging=0.0,
+            battery_discharging=0.0,
+            grid_power=-1000.0,
+            grid_import=0.0,
+            grid_export=1000.0,
+            solar_production=2000.0,
+            miner_consumption=0.0,
+            miner_power_limit=0.0,
+            house_consumption=500.0,
+            miner_surplus=1500.0,
+            last_updated="now",
+            is_dry_run=False,
+        )
+        publish_entities = {
+            "solar_surplus": "sensor.controller_solar_surplus",
+            "battery_soc": "sensor.controller_battery_soc",
+            "controller_running": "binary_sensor.controller_running",
+            "last_successful_run": "sensor.controller_last_successful_run",
+        }
+        publish_filter = PublishFilter({"solar_surplus": {"absolute": 20}})
+
+        state.publish_to_ha(mock_app, publish_entities, publish_filter)
+        assert mock_app.set_state.call_count == 4
+
+        mock_app.set_state.reset_mock()
+        state.solar_surplus = 1510.0
+        state.battery_soc = 86.0
+        state.last_updated = "later"
+        state.publish_to_ha(mock_app, publish_entities, publish_filter)
+
+        mock_app.set_state.assert_has_calls(
+            [
+                call(
+                    "sensor.controller_battery_soc",
+                    state=86.0,
+                    attributes={"unit_of_measurement": "%"},
+                ),
+                call("sensor.controller_last_successful_run", state="later"),
+            ],
+            any_order=True,
+        )
+        assert mock_app.set_state.call_count == 2
+
+
 class TestSystemStateActions:
     def test_execute_actions_normal_run(self, mock_app):
         """Test that actions are executed correctly in a normal run."""
         state = SystemState(
             # Sensor values are not relevant for this test
-            solar_surplus=0, total_surplus=0, chp_production=0, battery_soc=0, battery_power=0,
-            battery_charging=0, battery_discharging=0, grid_power=0, grid_import=0, grid_export=0,
-            solar_production=0, miner_consumption=0, miner_power_limit=0, house_consumption=0, miner_surplus=0, last_updated="now",
+            solar_surplus=0,
+            total_surplus=0,
+            chp_production=0,
+            battery_soc=0,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            grid_power=0,
+            grid_import=0,
+            grid_export=0,
+            solar_production=0,
+            miner_consumption=0,
+            miner_power_limit=0,
+            house_consumption=0,
+            miner_surplus=0,
+            last_updated="now",
             # Set dry run to False
             is_dry_run=False,
             # Set intended actions
-            miner_intended_switch_state='on',
+            miner_intended_switch_state="on",
             miner_intended_power_limit=3000.0,
-            battery_intended_charge_switch_state='off'
+            battery_intended_charge_switch_state="off",
         )
         # Add necessary configs to mock_app.args
-        mock_app.args["miner_heater"] = {"switch_entity": "switch.miner", "power_limit_entity": "number.miner_power"}
-        mock_app.args["battery_handler"] = {"disable_charge_switch": "switch.battery_disable_charge"}
+        mock_app.args["miner_heater"] = {
+            "switch_entity": "switch.miner",
+            "power_limit_entity": "number.miner_power",
+        }
+        mock_app.args["battery_handler"] = {
+            "disable_charge_switch": "switch.battery_disable_charge"
+        }
 
         # Mock current states
         def get_state_side_effect(entity_id, **kwargs):
-            if entity_id == "switch.miner": return "off"
-            if entity_id == "number.miner_power": return {"state": "0", "attributes": {}}
-            if entity_id == "switch.battery_disable_charge": return "on"
+            if entity_id == "switch.miner":
+                return "off"
+            if entity_id == "number.miner_power":
+                return {"state": "0", "attributes": {}}
+            if entity_id == "switch.battery_disable_charge":
+                return "on"
+
         mock_app.get_state.side_effect = get_state_side_effect
 
         state.execute_actions(mock_app)
 
         # Assert miner actions
         mock_app.turn_on.assert_any_call("switch.miner")
-        mock_app.set_state.assert_any_call("number.miner_power", state=3000.0, attributes=unittest.mock.ANY)
+        mock_app.set_state.assert_any_call(
+            "number.miner_power", state=3000.0, attributes=unittest.mock.ANY
+        )
         # Assert battery actions
         mock_app.turn_off.assert_any_call("switch.battery_disable_charge")
 
     def test_execute_actions_dry_run(self, mock_app):
         """Test that actions are logged but not executed in a dry run."""
         state = SystemState(
-            solar_surplus=0, total_surplus=0, chp_production=0, battery_soc=0, battery_power=0,
-            battery_charging=0, battery_discharging=0, grid_power=0, grid_import=0, grid_export=0,
-            solar_production=0, miner_consumption=0, miner_power_limit=0, house_consumption=0, miner_surplus=0, last_updated="now",
+            solar_surplus=0,
+            total_surplus=0,
+            chp_production=0,
+            battery_soc=0,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            grid_power=0,
+            grid_import=0,
+            grid_export=0,
+            solar_production=0,
+            miner_consumption=0,
+            miner_power_limit=0,
+            house_consumption=0,
+            miner_surplus=0,
+            last_updated="now",
             is_dry_run=True,
-            miner_intended_switch_state='on',
+            miner_intended_switch_state="on",
             miner_intended_power_limit=3000.0,
-            battery_intended_charge_switch_state='off'
+            battery_intended_charge_switch_state="off",
         )
-        mock_app.args["miner_heater"] = {"switch_entity": "switch.miner", "power_limit_entity": "number.miner_power"}
-        mock_app.args["battery_handler"] = {"disable_charge_switch": "switch.battery_disable_charge"}
+        mock_app.args["miner_heater"] = {
+            "switch_entity": "switch.miner",
+            "power_limit_entity": "number.miner_power",
+        }
+        mock_app.args["battery_handler"] = {
+            "disable_charge_switch": "switch.battery_disable_charge"
+        }
 
         def get_state_side_effect(entity_id, **kwargs):
-            if entity_id == "switch.miner": return "off"
-            if entity_id == "switch.battery_disable_charge": return "on"
+            if entity_id == "switch.miner":
+                return "off"
+            if entity_id == "switch.battery_disable_charge":
+                return "on"
+
         mock_app.get_state.side_effect = get_state_side_effect
 
         state.execute_actions(mock_app)
@@ -208,8 +401,10 @@ class TestSystemStateActions:
 
         # Assert logs were made
         expected_logs = [
-            call("[DRY RUN] Would have turned on switch.miner"),
-            call("[DRY RUN] Would have set power limit for number.miner_power to 3000.0 W."),
-            call("[DRY RUN] Would have turned OFF to enable charging for switch.battery_disable_charge")
+            call("switch entity=switch.miner state=on dry_run=true"),
+            call("power_limit entity=number.miner_power limit=3000 dry_run=true"),
+            call(
+                "charge_switch entity=switch.battery_disable_charge state=off charging=enabled dry_run=true"
+            ),
         ]
         mock_app.log.assert_has_calls(expected_logs, any_order=True)
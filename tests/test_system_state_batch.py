@@ -0,0 +1,97 @@
+import pytest
+from unittest.mock import Mock
+import sys
+import numpy as np
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from system_state import SystemState
+from system_state_batch import SystemStateBatch, SENSOR_KEYS, FIELDS
+
+SENSORS = {key: f"sensor.{key}" for key in SENSOR_KEYS}
+
+
+@pytest.fixture
+def mock_app():
+    """Fixture for a mocked AppDaemon app instance."""
+    app = Mock()
+    app.args = {
+        "sensors": SENSORS,
+        "miner_heater": {"power_limit_entity": "number.miner_power_limit"},
+    }
+    return app
+
+
+@pytest.fixture
+def columns():
+    """
+    Fixture for random raw sensor columns, including samples where the surplus exceeds
+    production.
+    """
+    rng = np.random.default_rng(42)
+    size = 1000
+    return {
+        "grid_power": rng.uniform(-8000, 8000, size),
+        "battery_soc": rng.uniform(0, 100, size),
+        "battery_power": rng.uniform(-5000, 5000, size),
+        "solar_production": rng.uniform(0, 10, size),
+        "miner_consumption": rng.uniform(0, 6000, size),
+        "chp_production": rng.uniform(0, 3000, size),
+    }
+
+
+class TestSystemStateBatch:
+    def test_matches_scalar_path_exactly(self, mock_app, columns):
+        """
+        Test that every derived field equals the result of the scalar SystemState
+        factory.
+        """
+        power_limits = np.arange(len(columns["grid_power"]), dtype=np.float64)
+        batch = SystemStateBatch.from_sensor_columns(
+            ["t"] * len(power_limits), columns, power_limits
+        )
+
+        for index in range(len(batch)):
+            snapshot = {
+                SENSORS[key]: {"state": repr(float(columns[key][index]))}
+                for key in SENSOR_KEYS
+            }
+            snapshot["number.miner_power_limit"] = {
+                "state": repr(float(power_limits[index]))
+            }
+            scalar = SystemState.from_snapshot(mock_app, snapshot)
+            for name in FIELDS:
+                assert getattr(batch, name)[index] == getattr(scalar, name), name
+
+    def test_surplus_is_clamped_to_production(self, columns):
+        """Test that the solar surplus never exceeds solar production."""
+        batch = SystemStateBatch.from_sensor_columns(["t"] * 1000, columns)
+
+        assert np.all(batch.solar_surplus <= batch.solar_production)
+        assert np.any(batch.solar_surplus == batch.solar_production)
+
+    def test_unavailable_miner_consumption_is_zero(self):
+        """
+        Test that missing miner consumption samples count as zero, as in the scalar
+        path.
+        """
+        columns = {key: [1.0, 1.0] for key in SENSOR_KEYS}
+        columns["miner_consumption"] = [np.nan, 500.0]
+
+        batch = SystemStateBatch.from_sensor_columns(["a", "b"], columns)
+
+        assert list(batch.miner_consumption) == [0.0, 500.0]
+
+    def test_state_returns_system_state(self, columns):
+        """Test converting a sample back into a SystemState."""
+        batch = SystemStateBatch.from_sensor_columns(
+            ["2024-01-01T00:00:00+00:00"] * 1000, columns
+        )
+
+        state = batch.state(3)
+
+        assert isinstance(state, SystemState)
+        assert state.grid_power == columns["grid_power"][3]
+        assert state.last_updated == "2024-01-01T00:00:00+00:00"
+        assert sum(1 for _ in batch.states()) == 1000
@@ -0,0 +1,105 @@
+import pytest
+from unittest.mock import Mock
+import sys
+from datetime import datetime, timedelta, timezone
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from toggle_index import ToggleIndex, parse_last_changed
+from chp_handler import ChpHandler
+from fake_hass import FakeHass
+from system_state import SystemState
+
+START = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def fake():
+    fake = FakeHass({}, now=START)
+    fake.set_entity("switch.chp", "off")
+    fake.set_entity("switch.miner", "off")
+    return fake
+
+
+def make_state(grid_import):
+    return SystemState(
+        solar_surplus=0,
+        total_surplus=0,
+        chp_production=0,
+        battery_soc=50,
+        battery_power=0,
+        battery_charging=0,
+        battery_discharging=0,
+        grid_power=grid_import,
+        grid_import=grid_import,
+        grid_export=0,
+        solar_production=0,
+        miner_consumption=0,
+        miner_power_limit=0,
+        house_consumption=grid_import,
+        miner_surplus=0,
+        last_updated="now",
+        is_dry_run=False,
+    )
+
+
+class TestToggleIndex:
+    def test_seeded_once_and_updated_by_listener(self, fake):
+        """
+        Test that the index is seeded from last_changed and then follows state changes
+        without reads.
+        """
+        index = ToggleIndex(fake, clock=fake.clock)
+        index.track("switch.chp")
+        index.track("switch.chp")
+        assert fake.call_counts["get_state"] == 1
+
+        fake.now = START + timedelta(minutes=5)
+        assert index.seconds_since_change("switch.chp") == 300
+
+        fake.set_entity("switch.chp", "on")
+        fake.now = START + timedelta(minutes=6)
+        assert index.seconds_since_change("switch.chp") == 60
+        assert fake.call_counts["get_state"] == 1
+
+    def test_unknown_entity(self, fake):
+        index = ToggleIndex(fake, clock=fake.clock)
+        assert index.seconds_since_change("switch.unknown") is None
+
+    def test_parse_last_changed(self):
+        assert parse_last_changed("2024-01-01T12:00:00+00:00") == START
+        assert parse_last_changed(START) == START
+        assert parse_last_changed(None) is None
+
+
+class TestChpHandlerWithToggleIndex:
+    def test_min_wait_time_without_ha_reads(self, fake):
+        """
+        Test that the CHP dwell time check uses the index instead of reading
+        last_changed.
+        """
+        index = ToggleIndex(fake, clock=fake.clock)
+        handler = ChpHandler(
+            fake,
+            {"switch_entity": "switch.chp", "min_wait_time": 3},
+            clock=fake.clock,
+            toggle_index=index,
+            miner_config={"switch_entity": "switch.miner"},
+        )
+        fake.set_entity("switch.chp", "on")
+        fake.call_counts.clear()
+
+        fake.now = START + timedelta(minutes=2)
+        state = make_state(grid_import=0)
+        handler.evaluate_and_act(state)
+        assert state.chp_intended_switch_state is None
+
+        fake.now = START + timedelta(minutes=3)
+        state = make_state(grid_import=0)
+        handler.evaluate_and_act(state)
+        assert state.chp_intended_switch_state == "off"
+
+        assert (
+            fake.call_counts["get_state"] == 4
+        )  # only the switch states of CHP and miner
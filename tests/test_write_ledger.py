@@ -0,0 +1,173 @@
+import pytest
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+import sys
+
+# Add the apps directory to the python path to allow for imports
+sys.path.append("apps")
+
+from miner_heater_handler import MinerHeaterHandler
+from system_state import SystemState
+from write_ledger import WriteLedger
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class TestWriteLedger:
+    def test_seconds_since_write(self, clock):
+        """Tests that the ledger reports the time since the last write of an entity."""
+        ledger = WriteLedger(clock=clock)
+        assert ledger.seconds_since_write("number.miner_power_limit") is None
+
+        ledger.record("number.miner_power_limit", 2000)
+        clock.now += timedelta(seconds=90)
+
+        assert ledger.seconds_since_write("number.miner_power_limit") == 90
+        assert ledger.last_value("number.miner_power_limit") == 2000
+
+    def test_persists_across_instances(self, clock, tmp_path):
+        """Tests that a recorded write survives a restart."""
+        path = str(tmp_path / "ledger.json")
+        WriteLedger(path, clock=clock).record("number.miner_power_limit", 3000)
+
+        ledger = WriteLedger(path, clock=clock)
+        assert ledger.load()
+        clock.now += timedelta(minutes=2)
+
+        assert ledger.seconds_since_write("number.miner_power_limit") == 120
+        assert ledger.last_value("number.miner_power_limit") == 3000
+
+    def test_load_missing_or_corrupt_file(self, tmp_path):
+        """Tests that a missing or unreadable file leaves the ledger empty."""
+        path = tmp_path / "ledger.json"
+        assert not WriteLedger(str(path)).load()
+
+        path.write_text(
+            json.dumps({"number.miner_power_limit": {"time": "not a time"}})
+        )
+        ledger = WriteLedger(str(path))
+        assert not ledger.load()
+        assert ledger.seconds_since_write("number.miner_power_limit") is None
+
+    def test_failed_save_keeps_the_write_in_memory(self, clock, tmp_path):
+        """Tests that a file that cannot be written is reported instead of raised."""
+        log = Mock()
+        ledger = WriteLedger(
+            str(tmp_path / "missing" / "ledger.json"), clock=clock, log=log
+        )
+
+        ledger.record("number.miner_power_limit", 3000)
+
+        assert ledger.last_value("number.miner_power_limit") == 3000
+        assert ledger.save_failures == 1
+        assert log.error.call_args.args == ("write_ledger_failed",)
+
+    def test_miner_rate_limit_uses_ledger(self, clock):
+        """
+        Tests that the miner handler checks the write interval without reading the
+        entity's attributes.
+        """
+        app = Mock()
+        app.get_state.return_value = "on"
+        ledger = WriteLedger(clock=clock)
+        handler = MinerHeaterHandler(
+            app,
+            {
+                "switch_entity": "switch.miner",
+                "power_limit_entity": "number.miner_power_limit",
+                "activation_threshold": 2000,
+                "max_power": 6000,
+                "power_step": 1000,
+                "min_write_interval_seconds": 60,
+            },
+            clock=clock,
+            write_ledger=ledger,
+        )
+        ledger.record("number.miner_power_limit", 2000)
+        clock.now += timedelta(seconds=30)
+
+        state = SystemState(
+            solar_surplus=0,
+            total_surplus=0,
+            chp_production=0,
+            battery_soc=90,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            grid_power=0,
+            grid_import=0,
+            grid_export=0,
+            solar_production=0,
+            miner_consumption=2000,
+            miner_power_limit=2000,
+            house_consumption=0,
+            miner_surplus=4500,
+            last_updated=clock.now.isoformat(),
+            is_dry_run=False,
+        )
+        handler.evaluate_and_act(state)
+
+        assert state.miner_intended_power_limit is None
+        assert app.log.call_args.args[0].startswith(
+            "miner_write_skipped entity=number.miner_power_limit new_limit=4000"
+        )
+        for call in app.get_state.call_args_list:
+            assert call.kwargs.get("attribute") != "all"
+
+    def test_execute_actions_records_power_limit(self, clock):
+        """
+        Tests that a power limit write is recorded in the ledger without reading the
+        entity back.
+        """
+        app = Mock()
+        sensors = (
+            "grid_power",
+            "battery_soc",
+            "battery_power",
+            "solar_production",
+            "miner_consumption",
+            "chp_production",
+        )
+        app.args = {
+            "sensors": {name: f"sensor.{name}" for name in sensors},
+            "miner_heater": {"power_limit_entity": "number.miner_power_limit"},
+        }
+        ledger = WriteLedger(clock=clock)
+        state = SystemState(
+            solar_surplus=0,
+            total_surplus=0,
+            chp_production=0,
+            battery_soc=90,
+            battery_power=0,
+            battery_charging=0,
+            battery_discharging=0,
+            grid_power=0,
+            grid_import=0,
+            grid_export=0,
+            solar_production=0,
+            miner_consumption=0,
+            miner_power_limit=0,
+            house_consumption=0,
+            miner_surplus=0,
+            last_updated=clock.now.isoformat(),
+            is_dry_run=False,
+            miner_intended_power_limit=3000,
+        )
+
+        state.execute_actions(app, write_ledger=ledger)
+
+        app.set_state.assert_called_once_with("number.miner_power_limit", state=3000)
+        app.get_state.assert_not_called()
+        assert ledger.last_value("number.miner_power_limit") == 3000